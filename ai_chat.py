@@ -1,24 +1,49 @@
 # ai_chat.py
-import os, json, httpx
+import os, sys, json, time, asyncio, logging, httpx
+from types import SimpleNamespace
+from contextlib import asynccontextmanager, aclosing
 from datetime import datetime
 from typing import Optional, List, Dict, Any
 from fastapi import Response
-from fastapi import FastAPI, HTTPException, Body, Depends
+from fastapi import APIRouter, FastAPI, HTTPException, Body, Depends, Header, Query, Request
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field, HttpUrl
 from dotenv import load_dotenv
 
 from sqlalchemy import (
-    create_engine, Column, String, Integer, DateTime, Text, Enum, Float, JSON
+    create_engine, Column, String, Integer, DateTime, Text, Enum, Float, JSON,
+    Index, bindparam, event, case, func, inspect, insert, select, text, update, and_, or_
 )
-from sqlalchemy.orm import sessionmaker, declarative_base, Session
+from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+import analytics
+import llm_client
+import metrics
+from analytics import GROUP_DIMS, Rollups, message_delta
+from contacts import (
+    CONTACT_FIELDS, CONTACTS_BULK_CHUNK, MISSING, ContactCache, bulk_format, iter_contact_rows,
+)
+from ndjson import (
+    EXPORT_BATCH, IMPORT_BATCH, NDJSON_MEDIA_TYPE, BulkReport, dumps_line, iter_ndjson, parse_datetime,
+)
+from feed import ChangeFeed, message_event
+from http_cache import CompressionMiddleware, etag, not_modified
+from incidents import IncidentIndex
+from llm_dispatch import INTERACTIVE
+from search import build_search, ensure_fts, match_expr, page as search_page
+from media import media_store
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, encode_cursor, decode_cursor
 
 # ------------------ Env / Config ------------------
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
+# checked when an LLM call is made, so the app (and its tests) import without it
 API_KEY = os.getenv("LLM_API_KEY")
-if not API_KEY:
-    raise RuntimeError("LLM_API_KEY not set.")
 
 # Text default model (no uploads)
 TEXT_MODEL   = os.getenv("LLM_MODEL", "llama-3.1-8b-instant")
@@ -31,17 +56,94 @@ GROQ_URL = os.getenv("LLM_URL", "https://api.groq.com/openai/v1/chat/completions
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./propai.db")
 
+# SQLite tuning, applied to every pooled connection
+SQLITE_JOURNAL_MODE    = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS     = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE       = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+DB_POOL_SIZE    = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+
+# Create/backfill the schema on startup. Set to 0 when a release step runs `python ai_chat.py migrate`.
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "1") == "1"
+
+def _sync_url(url: str) -> str:
+    # Heroku-style postgres:// is not a scheme SQLAlchemy accepts
+    return "postgresql://" + url[len("postgres://"):] if url.startswith("postgres://") else url
+
+def _async_url(url: str) -> str:
+    # routes use the async driver for the same database (aiosqlite / asyncpg, see requirements.txt)
+    url = _sync_url(url)
+    for sync_prefix, async_prefix in (
+        ("sqlite://", "sqlite+aiosqlite://"),
+        ("postgresql://", "postgresql+asyncpg://"),
+    ):
+        if url.startswith(sync_prefix):
+            return async_prefix + url[len(sync_prefix):]
+    return url
+
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+def _apply_sqlite_pragmas(dbapi_conn, _record):
+    cur = dbapi_conn.cursor()
+    cur.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cur.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cur.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cur.close()
+
 # ------------------ DB Setup ------------------
 Base = declarative_base()
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
-def get_db() -> Session:
-    db = SessionLocal()
+# Engines are created on first use (not at import); the session factories are bound then.
+SessionLocal = sessionmaker(autoflush=False, autocommit=False)
+AsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False)
+_engine = None
+_async_engine = None
+
+def get_engine():
+    """Sync engine: schema creation/backfill and offline scripts only."""
+    global _engine
+    if _engine is None:
+        _engine = create_engine(_sync_url(DATABASE_URL), connect_args={"check_same_thread": False} if IS_SQLITE else {})
+        if IS_SQLITE:
+            event.listen(_engine, "connect", _apply_sqlite_pragmas)
+        SessionLocal.configure(bind=_engine)
+    return _engine
+
+def get_async_engine():
+    """Async engine: every route."""
+    global _async_engine
+    if _async_engine is None:
+        pool_kwargs = {} if ":memory:" in DATABASE_URL else {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW}
+        _async_engine = create_async_engine(_async_url(DATABASE_URL), pool_pre_ping=True, **pool_kwargs)
+        if IS_SQLITE:
+            event.listen(_async_engine.sync_engine, "connect", _apply_sqlite_pragmas)
+        # statement timings on the engine every route uses
+        metrics.instrument_engine(_async_engine.sync_engine)
+        AsyncSessionLocal.configure(bind=_async_engine)
+    return _async_engine
+
+async def dispose_engines():
+    global _engine, _async_engine
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    if _engine is not None:
+        _engine.dispose()
+    _engine = _async_engine = None
+
+metrics.REGISTRY.gauge("db_pool_checked_out", "Pooled DB connections currently in use.",
+                       lambda: getattr(_async_engine.pool, "checkedout", lambda: 0)() if _async_engine else 0)
+
+async def get_db() -> AsyncSession:
+    started = time.perf_counter()
+    get_async_engine()
     try:
-        yield db
+        async with AsyncSessionLocal() as db:
+            yield db
     finally:
-        db.close()
+        metrics.DB_SESSION_LATENCY.observe(time.perf_counter() - started)
 
 class Contact(Base):
     __tablename__ = "contacts"
@@ -75,7 +177,228 @@ class Message(Base):
     confidence = Column(Float, nullable=True)
     entities = Column(JSON, nullable=True)
 
-Base.metadata.create_all(bind=engine)
+    __table_args__ = (
+        Index("ix_messages_phone_created_at", "phone", "created_at"),
+    )
+
+class ThreadSummaryRow(Base):
+    # Denormalized per-phone rollup of `messages`, maintained on every insert
+    __tablename__ = "thread_summaries"
+    phone = Column(String, primary_key=True)
+    last_message = Column(Text, nullable=True)
+    last_status = Column(String, nullable=True)
+    count = Column(Integer, nullable=False, default=0)
+    last_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, nullable=True)  # last change to the thread; the ETag of its reads
+
+    __table_args__ = (
+        Index("ix_thread_summaries_last_at_phone", "last_at", "phone"),
+        Index("ix_thread_summaries_count_phone", "count", "phone"),
+        Index("ix_thread_summaries_updated_at", "updated_at"),
+    )
+
+@event.listens_for(Message, "after_insert")
+def _bump_thread_summary(mapper, connection, target: Message):
+    at = target.created_at or datetime.utcnow()
+    last_text = target.body or target.ai_reply or None
+    is_newest = ThreadSummaryRow.last_at <= at
+    now = datetime.utcnow()
+    values: Dict[str, Any] = {
+        "count": ThreadSummaryRow.count + 1,
+        "updated_at": now,
+        "last_status": case((is_newest, target.status), else_=ThreadSummaryRow.last_status),
+        "last_at": case((is_newest, at), else_=ThreadSummaryRow.last_at),
+    }
+    if last_text is not None:
+        # messages without text (media-only) keep the previous preview
+        values["last_message"] = case((is_newest, last_text), else_=ThreadSummaryRow.last_message)
+    res = connection.execute(
+        update(ThreadSummaryRow).where(ThreadSummaryRow.phone == target.phone).values(**values)
+    )
+    if res.rowcount == 0:
+        connection.execute(
+            insert(ThreadSummaryRow).values(
+                phone=target.phone, count=1, last_at=at, updated_at=now,
+                last_message=last_text, last_status=target.status,
+            )
+        )
+
+class MessageRollup(Base):
+    # Inbound messages per day / property / classification, see analytics.py
+    __tablename__ = "rollup_messages"
+    day = Column(String(10), primary_key=True)
+    property = Column(String, primary_key=True)
+    category = Column(String, primary_key=True)
+    priority = Column(String, primary_key=True)
+    messages = Column(Integer, nullable=False)
+    confidence_sum = Column(Float, nullable=False)
+    confidence_n = Column(Integer, nullable=False)
+
+class ResponseRollup(Base):
+    # Replies per day the tenant started waiting / property
+    __tablename__ = "rollup_responses"
+    day = Column(String(10), primary_key=True)
+    property = Column(String, primary_key=True)
+    responses = Column(Integer, nullable=False)
+    seconds_sum = Column(Float, nullable=False)
+    seconds_max = Column(Float, nullable=False)
+
+def _dialect_insert():
+    if IS_SQLITE:
+        return sqlite_insert
+    from sqlalchemy.dialects.postgresql import insert as pg_insert  # only loaded on Postgres deployments
+    return pg_insert
+
+def _rollup_upserts():
+    ins = _dialect_insert()
+    m, r = ins(MessageRollup), ins(ResponseRollup)
+    return (
+        m.on_conflict_do_update(
+            index_elements=["day", "property", "category", "priority"],
+            set_={k: getattr(MessageRollup, k) + m.excluded[k] for k in ("messages", "confidence_sum", "confidence_n")},
+        ),
+        r.on_conflict_do_update(
+            index_elements=["day", "property"],
+            set_={
+                "responses": ResponseRollup.responses + r.excluded.responses,
+                "seconds_sum": ResponseRollup.seconds_sum + r.excluded.seconds_sum,
+                "seconds_max": case((r.excluded.seconds_max > ResponseRollup.seconds_max, r.excluded.seconds_max),
+                                    else_=ResponseRollup.seconds_max),
+            },
+        ),
+    )
+
+_MESSAGE_ROLLUP_COLS = ("day", "property", "category", "priority", "messages", "confidence_sum", "confidence_n")
+_RESPONSE_ROLLUP_COLS = ("day", "property", "responses", "seconds_sum", "seconds_max")
+
+def write_rollups(connection, delta: Rollups):
+    upsert_messages, upsert_responses = _rollup_upserts()
+    if delta.messages:
+        connection.execute(upsert_messages, [dict(zip(_MESSAGE_ROLLUP_COLS, r)) for r in delta.message_rows()])
+    if delta.responses:
+        connection.execute(upsert_responses, [dict(zip(_RESPONSE_ROLLUP_COLS, r)) for r in delta.response_rows()])
+
+def _property_sync(connection, phone: str) -> str:
+    row = connection.execute(
+        select(Contact.property_name, Contact.address).where(Contact.phone == phone)
+    ).first()
+    return analytics.property_of(row._asdict() if row else None)
+
+@event.listens_for(Message, "after_insert")
+def _bump_rollups(mapper, connection, target: Message):
+    delta = Rollups()
+    prop = _property_sync(connection, target.phone)
+    at = target.created_at or datetime.utcnow()
+    if target.direction == "inbound":
+        delta.add_message(at, prop, target.category, target.priority, target.confidence)
+    else:
+        # reply time: oldest inbound since the previous outbound message
+        last_out = (
+            select(func.max(Message.created_at))
+            .where(Message.phone == target.phone, Message.direction == "outbound",
+                   Message.id != target.id, Message.created_at <= at)
+            .scalar_subquery()
+        )
+        since = connection.execute(
+            select(func.min(Message.created_at)).where(
+                Message.phone == target.phone, Message.direction == "inbound", Message.created_at <= at,
+                or_(last_out.is_(None), Message.created_at > last_out),
+            )
+        ).scalar()
+        if since is not None:
+            delta.add_response(since, prop, (at - since).total_seconds())
+    write_rollups(connection, delta)
+
+@event.listens_for(Message, "after_update")
+def _move_rollups(mapper, connection, target: Message):
+    # reclassification: move the message between rollup buckets
+    state = inspect(target)
+    fields = ("category", "priority", "confidence")
+    if target.direction != "inbound" or not any(state.attrs[f].history.deleted for f in fields):
+        return
+    before = SimpleNamespace(direction=target.direction, created_at=target.created_at, **{
+        f: (state.attrs[f].history.deleted or [getattr(target, f)])[0] for f in fields
+    })
+    write_rollups(connection, message_delta(_property_sync(connection, target.phone), before, target))
+
+def rebuild_rollups(connection):
+    """Recompute the analytics rollups from messages + contacts (backfill; `python analytics.py rebuild` for SQLite)."""
+    contacts = {r.phone: r._asdict() for r in connection.execute(
+        select(Contact.phone, Contact.property_name, Contact.address))}
+    rows = connection.execute(
+        select(Message.phone, Message.direction, Message.category, Message.priority,
+               Message.confidence, Message.created_at)
+        .order_by(Message.phone, Message.created_at, Message.id)
+    )
+    totals = analytics.scan(rows, lambda phone: analytics.property_of(contacts.get(phone)))
+    connection.execute(MessageRollup.__table__.delete())
+    connection.execute(ResponseRollup.__table__.delete())
+    write_rollups(connection, totals)
+
+def rebuild_thread_summaries(connection, phones: Optional[List[str]] = None):
+    """
+    Recompute thread_summaries from messages, for every phone (backfill for databases
+    that predate the table) or just `phones` (bulk inserts bypass the ORM event).
+    """
+    summaries = ThreadSummaryRow.__table__
+    if phones is None:
+        connection.execute(summaries.delete())
+    else:
+        connection.execute(summaries.delete().where(summaries.c.phone.in_(phones)))
+    stmt = text(
+        "INSERT INTO thread_summaries (phone, count, last_at, last_status, last_message, updated_at) "
+        "SELECT m.phone, COUNT(*), MAX(m.created_at), "
+        " (SELECT s.status FROM messages s WHERE s.phone = m.phone "
+        "  ORDER BY s.created_at DESC, s.id DESC LIMIT 1), "
+        " (SELECT COALESCE(NULLIF(s.body, ''), NULLIF(s.ai_reply, '')) FROM messages s "
+        "  WHERE s.phone = m.phone AND COALESCE(NULLIF(s.body, ''), NULLIF(s.ai_reply, '')) IS NOT NULL "
+        "  ORDER BY s.created_at DESC, s.id DESC LIMIT 1), "
+        " :now "
+        "FROM messages m " + ("" if phones is None else "WHERE m.phone IN :phones ") + "GROUP BY m.phone"
+    )
+    stmt = stmt.bindparams(bindparam("now", type_=DateTime()))
+    if phones is None:
+        connection.execute(stmt, {"now": datetime.utcnow()})
+    else:
+        connection.execute(stmt.bindparams(bindparam("phones", expanding=True)),
+                           {"phones": list(phones), "now": datetime.utcnow()})
+
+# Full-text search over body / ai_reply (SQLite only): FTS5 table + sync triggers, see search.py
+FTS_ENABLED = False
+
+def migrate():
+    """Create missing tables/indexes and backfill derived tables. Idempotent; run on startup or as a release step."""
+    global FTS_ENABLED
+    engine = get_engine()
+    Base.metadata.create_all(bind=engine)
+    # create_all skips columns and indexes added to tables that already exist
+    if "updated_at" not in {c["name"] for c in inspect(engine).get_columns("thread_summaries")}:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE thread_summaries ADD COLUMN updated_at TIMESTAMP"))
+    for ix in (*Message.__table__.indexes, *ThreadSummaryRow.__table__.indexes):
+        ix.create(bind=engine, checkfirst=True)
+
+    with engine.begin() as conn:
+        has_summaries = conn.execute(select(ThreadSummaryRow.phone).limit(1)).first()
+        has_messages = conn.execute(select(Message.id).limit(1)).first()
+        if has_messages and not has_summaries:
+            rebuild_thread_summaries(conn)
+        if has_messages and not conn.execute(select(MessageRollup.day).limit(1)).first():
+            rebuild_rollups(conn)
+
+    if IS_SQLITE:
+        raw = engine.raw_connection()
+        try:
+            FTS_ENABLED = ensure_fts(raw.driver_connection)
+        finally:
+            raw.close()
+
+def _detect_fts():
+    # schema migrated elsewhere: just see whether the search index is there
+    global FTS_ENABLED
+    if IS_SQLITE:
+        with get_engine().connect() as conn:
+            FTS_ENABLED = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'")).first() is not None
 
 # ------------------ System Prompt ------------------
 PM_SYSTEM = (
@@ -126,7 +449,7 @@ class StoredMessage(BaseModel):
     entities: Optional[Dict[str, Any]] = None
 
     class Config:
-        orm_mode = True
+        from_attributes = True
 
 class ThreadSummary(BaseModel):
     id: str
@@ -134,46 +457,138 @@ class ThreadSummary(BaseModel):
     last_message: Optional[str] = None
     last_status: Optional[str] = None
     count: int
+    last_at: Optional[datetime] = None
+
+# Newest-first pages. Pass next_cursor as ?before= for older items, prev_cursor as ?after= for newer ones.
+class ThreadPage(BaseModel):
+    items: List[StoredMessage]
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+class ThreadListPage(BaseModel):
+    items: List[ThreadSummary]
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+class SearchHit(BaseModel):
+    id: int
+    phone: str
+    direction: str
+    body: Optional[str] = None
+    ai_reply: Optional[str] = None
+    category: Optional[str] = None
+    priority: Optional[str] = None
+    status: Optional[str] = None
+    created_at: datetime
+    snippet: Optional[str] = None  # best-matching fragment, hits wrapped in <mark></mark>
+    score: float                   # bm25, lower is better
+
+class SearchPage(BaseModel):
+    items: List[SearchHit]
+    next_cursor: Optional[str] = None
 
 # ------------------ App ------------------
-app = FastAPI(title="PropAI PM Chat (single-file)")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # the LLM client, Twilio client and DB pools are created on first use; only the schema is done up front
+    await asyncio.to_thread(migrate if DB_AUTO_MIGRATE else _detect_fts)
+    if not API_KEY:
+        log.warning("LLM_API_KEY not set; /pm_chat will fail until it is")
+    metrics.start_profiler()
+    try:
+        yield
+    finally:
+        metrics.stop_profiler()
+        await media_store.aclose()
+        await llm_client.shutdown()
+        await dispose_engines()
+
+router = APIRouter()
 
 FRONTEND_ORIGIN = os.getenv("FRONTEND_ORIGIN", "")
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[
-        "https://prop-ai-three.vercel.app",
-        "http://localhost:3000",
-        "http://127.0.0.1:3000",
-    ],
-    allow_methods=["GET", "POST", "OPTIONS", "DELETE", "PUT", "PATCH", "HEAD"],
-    allow_headers=["*"],
-    expose_headers=["*"],
-    allow_credentials=True,
-)
+
+def create_app() -> FastAPI:
+    app = FastAPI(title="PropAI PM Chat (single-file)", lifespan=lifespan)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=[
+            "https://prop-ai-three.vercel.app",
+            "http://localhost:3000",
+            "http://127.0.0.1:3000",
+        ],
+        allow_methods=["GET", "POST", "OPTIONS", "DELETE", "PUT", "PATCH", "HEAD"],
+        allow_headers=["*"],
+        expose_headers=["*"],
+        allow_credentials=True,
+    )
+    app.add_middleware(CompressionMiddleware)
+    # request latency middleware + /metrics (and /metrics/profile when PROFILER_INTERVAL_MS is set)
+    metrics.install(app)
+    app.include_router(router)
+    return app
 
 # ------------------ LLM Helper ------------------
-async def call_groq(messages: List[Dict[str, Any]], model: str) -> str:
+def _llm_headers() -> Dict[str, str]:
+    if not API_KEY:
+        raise HTTPException(status_code=500, detail="LLM_API_KEY not set.")
+    return {
+        "Authorization": f"Bearer {API_KEY}",
+        "Content-Type": "application/json",
+    }
+
+async def call_groq(messages: List[Dict[str, Any]], model: str, priority: int = INTERACTIVE) -> str:
     payload = {
         "model": model,
         "messages": messages,
         "temperature": 0.2,
     }
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json",
-    }
-    async with httpx.AsyncClient(timeout=60) as client:
-        r = await client.post(GROQ_URL, headers=headers, json=payload)
-        try:
-            r.raise_for_status()
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(status_code=r.status_code, detail=f"LLM error: {r.text}") from e
-        data = r.json()
-        return data.get("choices", [{}])[0].get("message", {}).get("content", "")
+    headers = _llm_headers()
+    try:
+        r, data = await llm_client.post_chat(GROQ_URL, headers, payload, priority)
+    except llm_client.LLMUnavailable as e:
+        raise HTTPException(status_code=503, detail="LLM provider is busy, try again shortly.", headers=e.headers) from e
+    try:
+        r.raise_for_status()
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(status_code=r.status_code, detail=f"LLM error: {r.text}") from e
+    return data.get("choices", [{}])[0].get("message", {}).get("content", "")
+
+# ------------------ Contact Cache ------------------
+# Read-through phone -> contact fields (negative lookups included); invalidated on every write
+contact_cache = ContactCache()
+metrics.REGISTRY.gauge("contact_cache", "Contact cache lookups and size.", lambda: {
+    k: v for k, v in contact_cache.stats().items() if k in ("hits", "misses", "size")
+}, label="kind")
+
+# ------------------ Change Feed ------------------
+# message.created events for GET /events (this app has no classifier or delivery callbacks)
+feed = ChangeFeed()
+metrics.REGISTRY.gauge("change_feed", "Change feed subscribers and logged events.", feed.stats, label="kind")
+
+# ------------------ Incidents ------------------
+# Recent inbound reports per property, near-duplicates grouped into incidents (see incidents.py)
+incident_index = IncidentIndex()
+metrics.REGISTRY.gauge("incident_index", "Reports and open incidents in the near-duplicate index.",
+                       incident_index.size, label="kind")
+
+async def _get_contact(db: AsyncSession, phone: str) -> Optional[Dict[str, Any]]:
+    contact = contact_cache.get(phone)
+    if contact is MISSING:
+        row = await db.get(Contact, phone)
+        contact = {k: getattr(row, k) for k in CONTACT_FIELDS} if row else None
+        contact_cache.set(phone, contact)
+    return contact
+
+def _contact_upsert():
+    ins = _dialect_insert()(Contact)
+    # created_at is kept from the first insert
+    return ins.on_conflict_do_update(
+        index_elements=[Contact.phone],
+        set_={k: ins.excluded[k] for k in (*CONTACT_FIELDS, "updated_at")},
+    )
 
 # ------------------ Routes ------------------
-@app.get("/")
+@router.get("/")
 def health():
     return {
         "ok": True,
@@ -182,8 +597,7 @@ def health():
         "db": DATABASE_URL,
     }
 
-@app.post("/pm_chat", response_model=PmChatResponse)
-async def pm_chat(req: PmChatRequest = Body(...), db: Session = Depends(get_db)):
+async def _pm_chat_messages(req: PmChatRequest, db: AsyncSession):
     has_text = bool((req.message or "").strip())
     has_upload = bool(req.image_url or req.document_url)
     if not has_text and not has_upload:
@@ -193,26 +607,31 @@ async def pm_chat(req: PmChatRequest = Body(...), db: Session = Depends(get_db))
     model = VISION_MODEL if has_upload else TEXT_MODEL
 
     # ---------- ENRICH CONTEXT WITH PHONE FROM DB IF NEEDED ----------
-    ctx: Dict[str, Any] = req.context.dict()
+    ctx: Dict[str, Any] = req.context.model_dump()
     # If tenant_phone not provided, try to backfill from DB using req.phone
     if not ctx.get("tenant_phone") and req.phone:
-        row = db.get(Contact, req.phone)
-        if row:
-            ctx["tenant_phone"] = row.phone
+        contact = await _get_contact(db, req.phone)
+        if contact:
+            ctx["tenant_phone"] = req.phone
             # also patch any missing fields from DB
-            for k in ("tenant_name", "unit", "address", "hotline", "portal_url", "property_name"):
-                if not ctx.get(k) and getattr(row, k):
-                    ctx[k] = getattr(row, k)
+            for k in CONTACT_FIELDS:
+                if not ctx.get(k) and contact.get(k):
+                    ctx[k] = contact[k]
 
     # ------------------ Build messages ------------------
     system_with_context = PM_SYSTEM + "\n\nContext JSON:\n" + json.dumps(ctx, ensure_ascii=False)
 
     if has_upload:
         user_parts: List[Dict[str, Any]] = [{"type": "text", "text": req.message}] if has_text else []
+        # images are fetched once, downscaled and inlined (or replaced by the cached description), see media.py
         if req.image_url:
-            user_parts.append({"type": "image_url", "image_url": {"url": req.image_url}})
+            user_parts += await media_store.image_parts(req.image_url, model, call_groq)
         if req.document_url:
-            user_parts.append({"type": "text", "text": f"Document URL: {req.document_url}"})
+            # a document that turns out to be a photo/scan goes through the same path; anything else stays a link
+            user_parts += await media_store.image_parts(
+                req.document_url, model, call_groq,
+                fallback={"type": "text", "text": f"Document URL: {req.document_url}"},
+            )
         user_content: Any = user_parts
     else:
         user_content = req.message
@@ -221,20 +640,53 @@ async def pm_chat(req: PmChatRequest = Body(...), db: Session = Depends(get_db))
         {"role": "system", "content": system_with_context},
         {"role": "user",   "content": user_content},
     ]
+    return model, messages
+
+@router.post("/pm_chat", response_model=PmChatResponse)
+async def pm_chat(req: PmChatRequest = Body(...), db: AsyncSession = Depends(get_db)):
+    model, messages = await _pm_chat_messages(req, db)
 
     reply = (await call_groq(messages, model=model) or "").strip()
     if not reply:
         reply = "Sorry—I'm not sure how to help with that yet."
     return PmChatResponse(reply=reply)
 
+@router.post("/pm_chat/stream")
+async def pm_chat_stream(request: Request, req: PmChatRequest = Body(...), db: AsyncSession = Depends(get_db)):
+    """
+    Streaming /pm_chat over Server-Sent Events: `data: {"delta": ...}` frames,
+    then `event: done` with the full reply (or `event: error`).
+    The upstream completion is cancelled when the client disconnects.
+    """
+    model, messages = await _pm_chat_messages(req, db)
+    payload = {"model": model, "messages": messages, "temperature": 0.2}
+    headers = _llm_headers()
+
+    async def events():
+        parts: List[str] = []
+        try:
+            async with aclosing(llm_client.stream_chat(GROQ_URL, headers, payload)) as deltas:
+                async for delta in deltas:
+                    if await request.is_disconnected():
+                        return
+                    parts.append(delta)
+                    yield llm_client.sse({"delta": delta})
+        except httpx.HTTPError as e:
+            yield llm_client.sse({"detail": f"LLM error: {e}"}, event="error")
+            return
+        reply = "".join(parts).strip() or "Sorry—I'm not sure how to help with that yet."
+        yield llm_client.sse({"reply": reply}, event="done")
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=llm_client.SSE_HEADERS)
+
 # ---------- Contacts (persist context) ----------
-@app.post("/contacts/upsert")
-def upsert_contact(phone: str, context: Context, db: Session = Depends(get_db)):
+@router.post("/contacts/upsert")
+async def upsert_contact(phone: str, context: Context, db: AsyncSession = Depends(get_db)):
     phone = phone.strip()
     if not phone:
         raise HTTPException(400, "phone required")
 
-    row = db.get(Contact, phone)
+    row = await db.get(Contact, phone)
     now = datetime.utcnow()
     if row:
         row.tenant_name = context.tenant_name
@@ -257,51 +709,202 @@ def upsert_contact(phone: str, context: Context, db: Session = Depends(get_db)):
             updated_at=now,
         )
         db.add(row)
-    db.commit()
+    await db.commit()
+    contact_cache.invalidate(phone)
     return {"ok": True}
 
-@app.get("/contacts/{phone}", response_model=Context)
-def get_contact(phone: str, db: Session = Depends(get_db)):
-    row = db.get(Contact, phone)
-    if not row:
+@router.post("/contacts/bulk")
+async def bulk_contacts(
+    request: Request,
+    format: Optional[str] = Query(None, pattern="^(csv|ndjson)$", description="Defaults from Content-Type"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Upsert many contacts from a streamed CSV (header row) or NDJSON body with
+    phone, tenant_name, unit, address and optional hotline/portal_url/property_name.
+    Each CONTACTS_BULK_CHUNK rows are one multi-row upsert and one commit;
+    bad rows are reported and skipped.
+    """
+    fmt = bulk_format(request.headers.get("content-type"), format)
+    report = BulkReport(done="upserted", key="phone")
+    stmt = _contact_upsert()
+    chunk: Dict[str, Dict[str, Any]] = {}  # by phone: one statement may not upsert a row twice (Postgres)
+
+    async def write():
+        await db.execute(stmt, list(chunk.values()))
+        await db.commit()
+        contact_cache.invalidate(*chunk)
+        report.done += len(chunk)
+
+    async for line_no, phone, contact, error in iter_contact_rows(request.stream(), fmt):
+        report.rows += 1
+        if error:
+            report.error(line_no, error, phone)
+            continue
+        now = datetime.utcnow()
+        chunk[phone] = {"phone": phone, **contact, "created_at": now, "updated_at": now}
+        if len(chunk) >= CONTACTS_BULK_CHUNK:
+            await write()
+            chunk = {}
+    if chunk:
+        await write()
+    return report.result()
+
+@router.get("/contacts/{phone}", response_model=Context)
+async def get_contact(phone: str, db: AsyncSession = Depends(get_db)):
+    contact = await _get_contact(db, phone)
+    if not contact:
         raise HTTPException(404, "Not found")
-    return Context(
-        tenant_name=row.tenant_name,
-        unit=row.unit,
-        address=row.address,
-        hotline=row.hotline,
-        portal_url=row.portal_url,
-        property_name=row.property_name,
-        tenant_phone=row.phone,  # <— include phone in returned context
-    )
+    return Context(**contact, tenant_phone=phone)  # <— include phone in returned context
 
 # ---------- Minimal Threads API (for your UI) ----------
-@app.get("/threads", response_model=List[ThreadSummary])
-def list_threads(db: Session = Depends(get_db)):
-    sums: Dict[str, ThreadSummary] = {}
-    q = db.query(Message).order_by(Message.created_at.asc()).all()
-    for m in q:
-        if m.phone not in sums:
-            sums[m.phone] = ThreadSummary(
-                id=m.phone, participant=m.phone, last_message=None, last_status=None, count=0
-            )
-        t = sums[m.phone]
-        t.count += 1
-        last_text = m.body or m.ai_reply
-        if last_text:
-            t.last_message = last_text
-        t.last_status = m.status
-    return sorted(sums.values(), key=lambda t: (t.count, t.id), reverse=True)
-
-@app.get("/threads/{phone}", response_model=List[StoredMessage])
-def get_thread(phone: str, db: Session = Depends(get_db)):
-    rows = (
-        db.query(Message)
-        .filter(Message.phone == phone)
-        .order_by(Message.created_at.asc())
-        .all()
+async def _keyset_page(db: AsyncSession, stmt, sort_col, id_col, key, limit: int, before, after):
+    """
+    Newest-first keyset page over (sort_col, id_col). Returns (rows, next_cursor, prev_cursor);
+    `key(row)` gives the row's (sort value, id) for cursors.
+    """
+    if after:
+        v, k = after
+        newer = (
+            stmt.where(or_(sort_col > v, and_(sort_col == v, id_col > k)))
+            .order_by(sort_col.asc(), id_col.asc())
+            .limit(limit)
+        )
+        rows = list((await db.execute(newer)).scalars().all())[::-1]
+        has_older = False
+        if rows:
+            v, k = key(rows[-1])
+            older = stmt.where(or_(sort_col < v, and_(sort_col == v, id_col < k))).limit(1)
+            has_older = (await db.execute(older)).first() is not None
+    else:
+        if before:
+            v, k = before
+            stmt = stmt.where(or_(sort_col < v, and_(sort_col == v, id_col < k)))
+        stmt = stmt.order_by(sort_col.desc(), id_col.desc()).limit(limit + 1)
+        rows = list((await db.execute(stmt)).scalars().all())
+        has_older = len(rows) > limit
+        rows = rows[:limit]
+    next_cursor = encode_cursor(*key(rows[-1])) if rows and has_older else None
+    prev_cursor = encode_cursor(*key(rows[0])) if rows else None
+    return rows, next_cursor, prev_cursor
+
+def _version(updated_at: Optional[datetime], count: int) -> str:
+    return etag(f"{updated_at:%Y%m%d%H%M%S%f}" if updated_at else 0, count)
+
+@router.get("/threads", response_model=ThreadListPage)
+async def list_threads(
+    request: Request,
+    response: Response,
+    sort: str = Query("recent", pattern="^(recent|count)$"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    # the newest summary change (indexed) + how many threads: cheap, and the same on every worker
+    changed, threads = (await db.execute(
+        select(func.max(ThreadSummaryRow.updated_at), func.count(ThreadSummaryRow.phone))
+    )).one()
+    unchanged = not_modified(request, response, _version(changed, threads))
+    if unchanged:
+        return unchanged
+    if sort == "recent":
+        sort_col, key = ThreadSummaryRow.last_at, (lambda r: (r.last_at, r.phone))
+    else:
+        sort_col, key = ThreadSummaryRow.count, (lambda r: (r.count, r.phone))
+    rows, next_cursor, prev_cursor = await _keyset_page(
+        db, select(ThreadSummaryRow), sort_col, ThreadSummaryRow.phone, key, limit,
+        decode_cursor(before, as_datetime=sort == "recent"),
+        decode_cursor(after, as_datetime=sort == "recent"),
     )
-    return rows
+    items = [
+        ThreadSummary(
+            id=r.phone, participant=r.phone, last_message=r.last_message,
+            last_status=r.last_status, count=r.count, last_at=r.last_at,
+        )
+        for r in rows
+    ]
+    return ThreadListPage(items=items, next_cursor=next_cursor, prev_cursor=prev_cursor or after)
+
+@router.get("/threads/{phone}", response_model=ThreadPage)
+async def get_thread(
+    phone: str,
+    request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    summary = (await db.execute(
+        select(ThreadSummaryRow.updated_at, ThreadSummaryRow.count).where(ThreadSummaryRow.phone == phone)
+    )).first()
+    unchanged = not_modified(request, response, _version(*summary) if summary else _version(None, 0))
+    if unchanged:
+        return unchanged
+    rows, next_cursor, prev_cursor = await _keyset_page(
+        db, select(Message).where(Message.phone == phone),
+        Message.created_at, Message.id, lambda r: (r.created_at, r.id), limit,
+        decode_cursor(before), decode_cursor(after),
+    )
+    # rows are validated into StoredMessage by the response_model
+    return {"items": rows, "next_cursor": next_cursor, "prev_cursor": prev_cursor or after}
+
+# ---------- Full-text search ----------
+@router.get("/search", response_model=SearchPage)
+async def search_messages(
+    q: str = Query(..., min_length=1, description='Words must all appear; "a phrase", prefix*'),
+    category: Optional[str] = None,
+    priority: Optional[str] = None,
+    phone: Optional[str] = None,
+    since: Optional[datetime] = Query(None, description="created_at >= since (UTC)"),
+    until: Optional[datetime] = Query(None, description="created_at < until (UTC)"),
+    sort: str = Query("rank", pattern="^(rank|recent)$"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    before: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """Full-text search over message bodies and AI replies (SQLite FTS5). Pass next_cursor as ?before=."""
+    if not FTS_ENABLED:
+        raise HTTPException(501, "Search needs a SQLite DATABASE_URL with FTS5")
+    if not match_expr(q):
+        raise HTTPException(400, "q has no searchable words")
+    sql, params = build_search(
+        q, phone=phone, category=category, priority=priority, since=since, until=until,
+        sort=sort, before=decode_cursor(before, as_datetime=sort == "recent"), limit=limit,
+    )
+    rows = (await db.execute(text(sql), params)).all()
+    hits, last = search_page(rows, limit, sort)
+    return SearchPage(items=hits, next_cursor=encode_cursor(*last) if last else None)
+
+# ---------- Analytics ----------
+@router.get("/analytics")
+async def get_analytics(
+    bucket: str = Query("day", pattern="^(day|week|month)$"),
+    group_by: str = Query(",".join(GROUP_DIMS), description="Comma-separated subset of property,category,priority"),
+    since: Optional[datetime] = Query(None, description="From this day (UTC)"),
+    until: Optional[datetime] = Query(None, description="Before this day (UTC)"),
+    property_name: Optional[str] = Query(None, alias="property"),
+    category: Optional[str] = None,
+    priority: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """Inbound message counts, average confidence and reply times per period, from the rollup tables."""
+    dims = [g.strip() for g in group_by.split(",") if g.strip()]
+    unknown = [g for g in dims if g not in GROUP_DIMS]
+    if unknown:
+        raise HTTPException(400, f"Unknown group_by {', '.join(unknown)}")
+    m_stmt, r_stmt = select(*MessageRollup.__table__.c), select(*ResponseRollup.__table__.c)
+    if since:
+        m_stmt = m_stmt.where(MessageRollup.day >= since.date().isoformat())
+        r_stmt = r_stmt.where(ResponseRollup.day >= since.date().isoformat())
+    if until:
+        m_stmt = m_stmt.where(MessageRollup.day < until.date().isoformat())
+        r_stmt = r_stmt.where(ResponseRollup.day < until.date().isoformat())
+    message_rows = (await db.execute(m_stmt)).all()
+    response_rows = (await db.execute(r_stmt)).all()
+    return analytics.aggregate(message_rows, response_rows, bucket, dims,
+                               {"property": property_name, "category": category, "priority": priority})
 
 # ---------- Lightweight seeding endpoints (optional) ----------
 class CreateMessage(BaseModel):
@@ -313,8 +916,8 @@ class CreateMessage(BaseModel):
     to: Optional[str] = None
     from_: Optional[str] = None
 
-@app.post("/messages", response_model=StoredMessage)
-def create_message(msg: CreateMessage, db: Session = Depends(get_db)):
+@router.post("/messages", response_model=StoredMessage)
+async def create_message(msg: CreateMessage, db: AsyncSession = Depends(get_db)):
     if msg.direction not in ("inbound", "outbound"):
         raise HTTPException(400, "direction must be inbound|outbound")
     row = Message(
@@ -327,6 +930,138 @@ def create_message(msg: CreateMessage, db: Session = Depends(get_db)):
         status=msg.status or "received",
     )
     db.add(row)
-    db.commit()
-    db.refresh(row)
-    return row
+    await db.commit()
+    await db.refresh(row)
+    prop = analytics.property_of(await _get_contact(db, row.phone))
+    if row.direction == "inbound":
+        incident_index.add(str(row.id), prop, row.phone, row.body, row.created_at)
+    out = StoredMessage.model_validate(row)  # one validation for the feed and the response
+    feed.publish({"type": "message.created", **message_event(row.phone, out.model_dump(), prop)})
+    return out
+
+@router.get("/events")
+async def change_feed(
+    phone: Optional[List[str]] = Query(None, description="Only these threads (repeatable)"),
+    property_name: Optional[str] = Query(None, alias="property"),
+    resume: Optional[str] = Query(None, description="Resume token (the last event id seen)"),
+    last_event_id: Optional[str] = Header(None),
+):
+    """Server-Sent Events of created messages (see feed.py); resumes via Last-Event-ID."""
+    return StreamingResponse(feed.stream(phone, property_name, resume or last_event_id),
+                             media_type="text/event-stream", headers=llm_client.SSE_HEADERS)
+
+@router.get("/incidents")
+def list_incidents(
+    property_name: Optional[str] = Query(None, alias="property"),
+    min_reports: int = Query(2, ge=1, description="1 also lists reports nobody else has sent"),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """Open incidents: near-duplicate inbound reports at one property within INCIDENT_WINDOW, newest first."""
+    return {"items": incident_index.incidents(property_name, min_reports, limit), **incident_index.stats}
+
+# ---------- NDJSON export / import ----------
+@router.get("/export/messages")
+async def export_messages(
+    phone: Optional[str] = None,
+    since: Optional[datetime] = Query(None, description="created_at >= since (UTC)"),
+    until: Optional[datetime] = Query(None, description="created_at < until (UTC)"),
+    category: Optional[str] = None,
+):
+    """
+    Stream messages with their classifications as NDJSON in id order. Rows come
+    from a server-side cursor EXPORT_BATCH at a time, so memory stays flat
+    however many match; the output feeds straight back into /import/messages.
+    """
+    stmt = select(Message.__table__)
+    if phone:
+        stmt = stmt.where(Message.phone == phone)
+    if since:
+        stmt = stmt.where(Message.created_at >= since)
+    if until:
+        stmt = stmt.where(Message.created_at < until)
+    if category:
+        stmt = stmt.where(Message.category == category)
+    stmt = stmt.order_by(Message.id).execution_options(yield_per=EXPORT_BATCH)
+
+    async def lines():
+        # own connection: the request's session is gone once streaming starts
+        async with get_async_engine().connect() as conn:
+            result = await conn.stream(stmt)
+            async for rows in result.partitions(EXPORT_BATCH):
+                yield "".join(dumps_line(dict(r._mapping)) for r in rows)
+
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE,
+                             headers={"Content-Disposition": 'attachment; filename="messages.ndjson"'})
+
+_IMPORT_FIELDS = ("to", "from_", "ai_reply", "category", "priority", "action", "confidence", "entities")
+
+def _import_row(obj: Dict[str, Any]) -> Dict[str, Any]:
+    direction = obj.get("direction") or "inbound"
+    if direction not in ("inbound", "outbound"):
+        raise ValueError("direction must be inbound|outbound")
+    phone = obj.get("phone") or obj.get("to" if direction == "outbound" else "from_")
+    if not phone:
+        raise ValueError("phone required")
+    confidence = obj.get("confidence")
+    return {
+        **{f: obj.get(f) for f in _IMPORT_FIELDS},
+        "phone": phone,
+        "direction": direction,
+        "body": obj.get("body") or obj.get("text") or obj.get("message"),
+        "media_urls": [str(u) for u in (obj.get("media_urls") or [])],
+        "status": obj.get("status") or "received",
+        "created_at": parse_datetime(obj.get("created_at")) or datetime.utcnow(),
+        "confidence": float(confidence) if confidence is not None else None,
+    }
+
+@router.post("/import/messages")
+async def import_messages(request: Request, db: AsyncSession = Depends(get_db)):
+    """
+    Ingest an NDJSON body of messages (the /export/messages format; ids are
+    reassigned). Each IMPORT_BATCH rows are one multi-row insert plus a
+    thread_summaries refresh for the phones they touch, in one commit;
+    bad lines are reported and skipped.
+    """
+    report = BulkReport(done="imported", key="phone")
+    chunk: List[Dict[str, Any]] = []
+
+    async def write():
+        await db.execute(insert(Message.__table__), chunk)
+        phones = list({row["phone"] for row in chunk})
+        await db.run_sync(lambda session: rebuild_thread_summaries(session.connection(), phones))
+        # new rows only (ids are reassigned); reply times of imported history need a rebuild
+        props = {r.phone: analytics.property_of(r._asdict()) for r in await db.execute(
+            select(Contact.phone, Contact.property_name, Contact.address).where(Contact.phone.in_(phones)))}
+        delta = Rollups()
+        for row in chunk:
+            if row["direction"] == "inbound":
+                delta.add_message(row["created_at"], props.get(row["phone"], analytics.NO_PROPERTY),
+                                  row["category"], row["priority"], row["confidence"])
+        await db.run_sync(lambda session: write_rollups(session.connection(), delta))
+        await db.commit()
+        report.done += len(chunk)
+
+    async for line_no, obj, error in iter_ndjson(request.stream()):
+        report.rows += 1
+        if error:
+            report.error(line_no, error)
+            continue
+        try:
+            chunk.append(_import_row(obj))
+        except (TypeError, ValueError) as e:
+            report.error(line_no, str(e), obj.get("phone"))
+            continue
+        if len(chunk) >= IMPORT_BATCH:
+            await write()
+            chunk = []
+    if chunk:
+        await write()
+    return report.result()
+
+app = create_app()
+
+if __name__ == "__main__":
+    # release step: `python ai_chat.py migrate`, then run the workers with DB_AUTO_MIGRATE=0
+    if sys.argv[1:] != ["migrate"]:
+        sys.exit("usage: python ai_chat.py migrate")
+    migrate()
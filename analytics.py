@@ -0,0 +1,240 @@
+# analytics.py
+# Incremental per-day rollups of tenant messages, shared by main.py (message_store) and ai_chat.py.
+#
+#   rollup_messages   (day, property, category, priority) -> inbound messages, confidence sum / count
+#   rollup_responses  (day, property)                     -> replies, reply-time sum / max
+#
+# Writers add signed deltas (a reclassified message moves from one bucket to another), so the
+# tables are only ever upserted with `+=`; /analytics folds days into weeks or months on read.
+#
+#   python analytics.py rebuild --db ./data/store.db     # backfill / repair a SQLite database
+import argparse, sqlite3
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+UNCLASSIFIED = "unclassified"
+NO_PRIORITY  = "none"
+NO_PROPERTY  = "unknown"
+
+GROUP_DIMS = ("property", "category", "priority")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollup_messages (
+    day VARCHAR(10) NOT NULL, property VARCHAR NOT NULL, category VARCHAR NOT NULL, priority VARCHAR NOT NULL,
+    messages INTEGER NOT NULL, confidence_sum FLOAT NOT NULL, confidence_n INTEGER NOT NULL,
+    PRIMARY KEY (day, property, category, priority)
+);
+CREATE TABLE IF NOT EXISTS rollup_responses (
+    day VARCHAR(10) NOT NULL, property VARCHAR NOT NULL,
+    responses INTEGER NOT NULL, seconds_sum FLOAT NOT NULL, seconds_max FLOAT NOT NULL,
+    PRIMARY KEY (day, property)
+);
+"""
+UPSERT_MESSAGES = (
+    "INSERT INTO rollup_messages (day, property, category, priority, messages, confidence_sum, confidence_n) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(day, property, category, priority) DO UPDATE SET "
+    "messages = messages + excluded.messages, confidence_sum = confidence_sum + excluded.confidence_sum, "
+    "confidence_n = confidence_n + excluded.confidence_n"
+)
+UPSERT_RESPONSES = (
+    "INSERT INTO rollup_responses (day, property, responses, seconds_sum, seconds_max) VALUES (?, ?, ?, ?, ?) "
+    "ON CONFLICT(day, property) DO UPDATE SET responses = responses + excluded.responses, "
+    "seconds_sum = seconds_sum + excluded.seconds_sum, seconds_max = MAX(seconds_max, excluded.seconds_max)"
+)
+SELECT_MESSAGES  = "SELECT day, property, category, priority, messages, confidence_sum, confidence_n FROM rollup_messages"
+SELECT_RESPONSES = "SELECT day, property, responses, seconds_sum, seconds_max FROM rollup_responses"
+
+
+def _as_datetime(v: Any) -> datetime:
+    return v if isinstance(v, datetime) else datetime.fromisoformat(str(v))
+
+
+def property_of(contact: Optional[Dict[str, Any]]) -> str:
+    if not contact:
+        return NO_PROPERTY
+    return contact.get("property_name") or contact.get("address") or NO_PROPERTY
+
+
+class Rollups:
+    """Signed deltas (or totals) keyed like the two tables; merge() adds another set in."""
+
+    def __init__(self):
+        self.messages: Dict[Tuple[str, ...], List[float]] = defaultdict(lambda: [0, 0.0, 0])
+        self.responses: Dict[Tuple[str, ...], List[float]] = defaultdict(lambda: [0, 0.0, 0.0])
+
+    def __len__(self) -> int:
+        return len(self.messages) + len(self.responses)
+
+    def add_message(self, at: Any, prop: str, category: Optional[str], priority: Optional[str],
+                    confidence: Optional[float], sign: int = 1):
+        """Count one inbound message (sign=-1 takes it back out, before a reclassification)."""
+        s = self.messages[(_as_datetime(at).date().isoformat(), prop, category or UNCLASSIFIED, priority or NO_PRIORITY)]
+        s[0] += sign
+        if confidence is not None:
+            s[1] += sign * confidence
+            s[2] += sign
+
+    def add_response(self, waiting_since: Any, prop: str, seconds: float):
+        """One reply, bucketed by the day the tenant started waiting."""
+        s = self.responses[(_as_datetime(waiting_since).date().isoformat(), prop)]
+        s[0] += 1
+        s[1] += seconds
+        s[2] = max(s[2], seconds)
+
+    def merge(self, other: "Rollups"):
+        for key, (n, total, count) in other.messages.items():
+            s = self.messages[key]
+            s[0] += n
+            s[1] += total
+            s[2] += count
+        for key, (n, total, longest) in other.responses.items():
+            s = self.responses[key]
+            s[0] += n
+            s[1] += total
+            s[2] = max(s[2], longest)
+
+    def message_rows(self) -> List[tuple]:
+        return [(*k, *v) for k, v in self.messages.items() if any(v)]
+
+    def response_rows(self) -> List[tuple]:
+        return [(*k, *v) for k, v in self.responses.items()]
+
+
+def message_delta(prop: str, old: Any, new: Any) -> Rollups:
+    """Deltas for an inbound message going from `old` to `new` (either may be None)."""
+    delta = Rollups()
+    for msg, sign in ((old, -1), (new, 1)):
+        if msg is not None and msg.direction == "inbound":
+            delta.add_message(msg.created_at, prop, msg.category, msg.priority, msg.confidence, sign)
+    return delta
+
+
+def waiting_since(thread: Sequence[Any]) -> Optional[datetime]:
+    """created_at of the oldest inbound message since the last outbound one (None if nobody is waiting)."""
+    since = None
+    for msg in reversed(thread):
+        if msg.direction != "inbound":
+            break
+        since = msg.created_at
+    return since
+
+
+def scan(rows: Iterable[tuple], property_for: Callable[[str], str]) -> Rollups:
+    """
+    Rollups from scratch. `rows` are (phone, direction, category, priority, confidence,
+    created_at) ordered by phone, created_at, id, as both apps store them.
+    """
+    out = Rollups()
+    phone, prop, waiting = None, NO_PROPERTY, None
+    for p, direction, category, priority, confidence, created_at in rows:
+        if p != phone:
+            phone, prop, waiting = p, property_for(p), None
+        at = _as_datetime(created_at)
+        if direction == "inbound":
+            out.add_message(at, prop, category, priority, confidence)
+            waiting = waiting or at
+        elif waiting is not None:
+            out.add_response(waiting, prop, (at - waiting).total_seconds())
+            waiting = None
+    return out
+
+
+# ------------------ Reading ------------------
+
+def period(day: str, bucket: str) -> str:
+    d = date.fromisoformat(day)
+    if bucket == "week":
+        return (d - timedelta(days=d.weekday())).isoformat()  # Monday
+    if bucket == "month":
+        return d.replace(day=1).isoformat()
+    return day
+
+
+def aggregate(message_rows: Iterable[tuple], response_rows: Iterable[tuple], bucket: str = "day",
+              group_by: Sequence[str] = GROUP_DIMS, filters: Optional[Dict[str, Optional[str]]] = None) -> Dict[str, Any]:
+    """
+    Fold table rows into `bucket` periods, grouped by `group_by` (a subset of GROUP_DIMS).
+    Response times only break down by property. `filters` keeps rows whose dims match.
+    """
+    filters = {k: v for k, v in (filters or {}).items() if v is not None}
+    series: Dict[tuple, List[float]] = defaultdict(lambda: [0, 0.0, 0])
+    for day, prop, category, priority, n, total, count in message_rows:
+        dims = {"property": prop, "category": category, "priority": priority}
+        if any(dims[k] != v for k, v in filters.items()):
+            continue
+        s = series[(period(day, bucket), *(dims[g] for g in group_by))]
+        s[0] += n
+        s[1] += total
+        s[2] += count
+
+    by_property = "property" in group_by
+    responses: Dict[tuple, List[float]] = defaultdict(lambda: [0, 0.0, 0.0])
+    for day, prop, n, total, longest in response_rows:
+        if filters.get("property", prop) != prop:
+            continue
+        s = responses[(period(day, bucket), prop) if by_property else (period(day, bucket),)]
+        s[0] += n
+        s[1] += total
+        s[2] = max(s[2], longest)
+
+    return {
+        "bucket": bucket,
+        "group_by": list(group_by),
+        "series": [
+            {"period": key[0], **dict(zip(group_by, key[1:])), "messages": n,
+             "avg_confidence": round(total / count, 4) if count else None}
+            for key, (n, total, count) in sorted(series.items()) if n
+        ],
+        "responses": [
+            {"period": key[0], **({"property": key[1]} if by_property else {}), "responses": n,
+             "avg_response_seconds": round(total / n, 1) if n else None, "max_response_seconds": round(longest, 1)}
+            for key, (n, total, longest) in sorted(responses.items())
+        ],
+    }
+
+
+# ------------------ SQLite (main.py's store, and the rebuild command) ------------------
+
+def write_sqlite(conn: sqlite3.Connection, delta: Rollups):
+    conn.executemany(UPSERT_MESSAGES, delta.message_rows())
+    conn.executemany(UPSERT_RESPONSES, delta.response_rows())
+
+
+def rebuild_sqlite(conn: sqlite3.Connection) -> Rollups:
+    """Recompute both tables from `messages` + `contacts`, in one transaction."""
+    conn.executescript(SCHEMA)
+    contacts = {r[0]: {"property_name": r[1], "address": r[2]}
+                for r in conn.execute("SELECT phone, property_name, address FROM contacts")}
+    rows = conn.execute(
+        "SELECT phone, direction, category, priority, confidence, created_at FROM messages "
+        "ORDER BY phone, created_at, id"
+    )
+    totals = scan(rows, lambda phone: property_of(contacts.get(phone)))
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM rollup_messages")
+        conn.execute("DELETE FROM rollup_responses")
+        write_sqlite(conn, totals)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return totals
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Analytics rollup maintenance")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    rebuild = sub.add_parser("rebuild", help="recompute rollups from existing messages")
+    rebuild.add_argument("--db", default="./data/store.db", help="SQLite file (main.py's STORE_DB or ai_chat.py's database)")
+    args = ap.parse_args()
+
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    conn.execute("PRAGMA busy_timeout=5000")
+    totals = rebuild_sqlite(conn)
+    print(f"rebuilt {len(totals.messages)} message and {len(totals.responses)} response rollup rows in {args.db}")
+
+
+if __name__ == "__main__":
+    main()
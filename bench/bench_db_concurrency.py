@@ -0,0 +1,79 @@
+# bench/bench_db_concurrency.py
+# ai_chat read latency with and without concurrent writers, per SQLite journal mode.
+#
+#   python bench/bench_db_concurrency.py [seconds] [readers] [writers]
+# Runs itself once per journal mode (DELETE = old default, WAL = new default).
+import asyncio, os, statistics, subprocess, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SECONDS = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+READERS = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+WRITERS = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+PHONES = [f"+1555000{i:04d}" for i in range(50)]
+
+
+def _pct(samples, q):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * q), len(samples) - 1)] if samples else float("nan")
+
+
+async def _loop(client, stop_at, fn, out):
+    i = 0
+    while time.perf_counter() < stop_at:
+        t0 = time.perf_counter()
+        r = await fn(client, i)
+        r.raise_for_status()
+        out.append((time.perf_counter() - t0) * 1000)
+        i += 1
+
+
+def _read(client, i):
+    return client.get(f"/threads/{PHONES[i % len(PHONES)]}", params={"limit": 50})
+
+
+def _write(client, i):
+    return client.post("/messages", json={"phone": PHONES[i % len(PHONES)], "direction": "inbound", "body": f"w{i}"})
+
+
+async def _phase(base_url, writers):
+    import httpx
+    reads, writes = [], []
+    limits = httpx.Limits(max_connections=READERS + WRITERS)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        stop_at = time.perf_counter() + SECONDS
+        tasks = [_loop(client, stop_at, _read, reads) for _ in range(READERS)]
+        tasks += [_loop(client, stop_at, _write, writes) for _ in range(writers)]
+        await asyncio.gather(*tasks)
+    return reads, writes
+
+
+def child():
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_db.db')}"
+    os.environ.setdefault("LLM_API_KEY", "bench")
+    sys.path.insert(0, os.path.join(ROOT, "bench"))
+    import ai_chat
+    from fake_llm import serve_in_thread
+
+    base_url = serve_in_thread(ai_chat.app)
+    import httpx
+    with httpx.Client(base_url=base_url) as c:
+        for i in range(2000):
+            _write(c, i).raise_for_status()
+
+    mode = os.environ.get("SQLITE_JOURNAL_MODE", "WAL")
+    for label, writers in (("reads only", 0), ("reads+writes", WRITERS)):
+        reads, writes = asyncio.run(_phase(base_url, writers))
+        print(f"[{mode:<6}] {label:<13} reads/s={len(reads) / SECONDS:7.1f} "
+              f"p50={statistics.median(reads):6.1f}ms p95={_pct(reads, 0.95):6.1f}ms "
+              f"p99={_pct(reads, 0.99):6.1f}ms writes/s={len(writes) / SECONDS:6.1f}")
+
+
+if __name__ == "__main__":
+    if os.environ.get("BENCH_CHILD"):
+        child()
+    else:
+        for mode in ("DELETE", "WAL"):
+            env = {**os.environ, "BENCH_CHILD": "1", "SQLITE_JOURNAL_MODE": mode}
+            subprocess.run([sys.executable, "-W", "ignore", __file__, *sys.argv[1:]], env=env, check=True)
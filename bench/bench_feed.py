@@ -0,0 +1,73 @@
+# bench/bench_feed.py
+# GET /events fan-out: N open dashboards (each watching one of P phones over SSE) while
+# tenants text in. Reports push latency (webhook accepted -> event received) and how many
+# requests the same freshness would cost by polling /threads/{phone} every POLL_S seconds.
+#
+#   python bench/bench_feed.py [dashboards] [phones] [messages]
+import asyncio, json, os, statistics, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+DASHBOARDS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+PHONES = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+MESSAGES = int(sys.argv[3]) if len(sys.argv) > 3 else 300
+POLL_S = 2.0
+
+os.environ.setdefault("STORE_DB", os.path.join(tempfile.mkdtemp(prefix="feed-bench-"), "store.db"))
+os.environ.setdefault("LLM_API_KEY", "bench")
+
+import httpx
+
+from fake_llm import serve_in_thread
+
+
+async def dashboard(client: httpx.AsyncClient, phone: str, sent_at, latencies, ready: asyncio.Event, counter):
+    async with client.stream("GET", "/events", params={"phone": phone}) as r:
+        async for line in r.aiter_lines():
+            if line.startswith("event: ready"):
+                counter[0] += 1
+                if counter[0] == DASHBOARDS:
+                    ready.set()
+            elif line.startswith("data: ") and '"message"' in line:
+                body = json.loads(line[6:])["message"]["body"]
+                latencies.append(time.perf_counter() - sent_at[body])
+
+
+async def main():
+    os.environ["LLM_URL"] = serve_in_thread() + "/openai/v1/chat/completions"
+    import main as app_module
+    base = serve_in_thread(app_module.app)
+    phones = [f"+1555{i:07d}" for i in range(PHONES)]
+    sent_at, latencies, counter = {}, [], [0]
+    ready = asyncio.Event()
+    limits = httpx.Limits(max_connections=DASHBOARDS + 10)
+    async with httpx.AsyncClient(base_url=base, timeout=None, limits=limits) as client:
+        tasks = [asyncio.create_task(dashboard(client, phones[i % PHONES], sent_at, latencies, ready, counter))
+                 for i in range(DASHBOARDS)]
+        await asyncio.wait_for(ready.wait(), 30)
+        t0 = time.perf_counter()
+        for i in range(MESSAGES):
+            body = f"bench message {i}"
+            sent_at[body] = time.perf_counter()
+            await client.post("/twilio/incoming", json={"From": phones[i % PHONES], "To": "+1", "Body": body})
+        expected = MESSAGES * DASHBOARDS // PHONES
+        while len(latencies) < expected and time.perf_counter() - t0 < 30:
+            await asyncio.sleep(0.05)
+        wall = time.perf_counter() - t0
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    lat = sorted(latencies)
+    print(f"{DASHBOARDS} dashboards on {PHONES} phones, {MESSAGES} inbound texts in {wall:.1f}s")
+    print(f"  pushed {len(lat)}/{expected} events  p50={statistics.median(lat) * 1000:.1f}ms  "
+          f"p95={lat[int(len(lat) * 0.95) - 1] * 1000:.1f}ms")
+    print(f"  polling every {POLL_S:.0f}s instead: {DASHBOARDS / POLL_S:.0f} req/s "
+          f"({DASHBOARDS * wall / POLL_S:.0f} thread fetches for this run), "
+          f"~{POLL_S / 2 * 1000:.0f}ms average staleness")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+# bench/bench_http_cache.py
+# What an idle dashboard costs: the same /threads and /threads/{phone} reads repeated with
+# nothing changing. Three clients: plain (no validators, no compression; how the dashboard
+# behaved before), compressed first fetches (Accept-Encoding: br, gzip), and revalidating
+# with the ETag it got (If-None-Match), which is what a browser does under Cache-Control: no-cache.
+#
+#   python bench/bench_http_cache.py [main|ai_chat] [threads] [messages per thread] [reads]
+import asyncio, os, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+APP = sys.argv[1] if len(sys.argv) > 1 else "main"
+THREADS = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+PER_THREAD = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+READS = int(sys.argv[4]) if len(sys.argv) > 4 else 2000
+
+tmp = tempfile.mkdtemp(prefix="http-cache-bench-")
+os.environ.setdefault("STORE_DB", os.path.join(tmp, "store.db"))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tmp, 'ai_chat.db')}")
+os.environ.setdefault("LLM_API_KEY", "bench")
+os.environ.setdefault("LLM_URL", "http://127.0.0.1:9/unreachable")  # seeding must not classify
+os.environ.setdefault("LLM_MAX_RETRIES", "0")
+
+import httpx
+
+BODY = "Hi, the kitchen sink in my unit has been leaking since this morning, can someone come by?"
+
+
+async def seed(c: httpx.AsyncClient, phones):
+    for phone in phones:
+        for i in range(PER_THREAD):
+            if APP == "ai_chat":
+                await c.post("/messages", json={"phone": phone, "direction": "inbound", "body": f"{BODY} ({i})"})
+            else:
+                await c.post("/sms/send", json={"to": phone, "body": f"{BODY} ({i})"})
+
+
+async def reads(c: httpx.AsyncClient, paths, headers_for):
+    sent, started = 0, time.perf_counter()
+    statuses = {}
+    for i in range(READS):
+        path = paths[i % len(paths)]
+        r = await c.get(path, headers=headers_for(path))
+        sent += int(r.headers.get("content-length") or len(r.content))
+        statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+    return sent / READS, (time.perf_counter() - started) / READS, statuses
+
+
+async def main():
+    mod = __import__(APP)
+    phones = [f"+1555{i:07d}" for i in range(THREADS)]
+    paths = ["/threads"] + [f"/threads/{p}" for p in phones]
+    async with mod.app.router.lifespan_context(mod.app):
+        transport = httpx.ASGITransport(app=mod.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+            await seed(c, phones)
+            await asyncio.sleep(1)  # main: let the fake Twilio delivery callbacks land
+            tags = {}
+            for p in paths:
+                r = await c.get(p, headers={"Accept-Encoding": "br, gzip"})
+                tags[p] = r.headers["etag"]
+
+            print(f"{APP}: {THREADS} threads x {PER_THREAD} messages, {READS} reads of /threads + /threads/{{phone}}")
+            for label, headers_for in (
+                ("plain (before)", lambda p: {"Accept-Encoding": "identity"}),
+                ("compressed", lambda p: {"Accept-Encoding": "br, gzip"}),
+                ("revalidate (304)", lambda p: {"Accept-Encoding": "br, gzip", "If-None-Match": tags[p]}),
+            ):
+                per_read, secs, statuses = await reads(c, paths, headers_for)
+                print(f"  {label:<18} {per_read / 1024:7.2f} KiB/read  {secs * 1e6:7.0f}us/read  {statuses}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
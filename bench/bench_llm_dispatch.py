@@ -0,0 +1,80 @@
+# bench/bench_llm_dispatch.py
+# The LLM dispatcher against a fake provider that rate limits like Groq (429 + Retry-After).
+# A burst of bulk calls is queued first, then urgent and interactive ones arrive behind it.
+# Three setups: no retries (how calls behaved before the dispatcher), retries honoring
+# Retry-After, and retries plus client-side requests/min pacing at the provider's rate.
+#
+#   python bench/bench_llm_dispatch.py [bulk calls] [provider rpm]
+import asyncio, os, statistics, sys, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+BULK_CALLS = int(sys.argv[1]) if len(sys.argv) > 1 else 150
+PROVIDER_RPM = float(sys.argv[2]) if len(sys.argv) > 2 else 1200
+os.environ.setdefault("FAKE_LLM_RPM", str(PROVIDER_RPM))
+os.environ.setdefault("FAKE_LLM_BURST", "10")
+os.environ.setdefault("FAKE_LLM_LATENCY_MS", "50")
+os.environ.setdefault("LLM_BACKOFF_BASE", "0.2")
+
+import fake_llm
+import llm_client
+import llm_dispatch
+from fake_llm import serve_in_thread
+from llm_dispatch import BULK, INTERACTIVE, PRIORITY_NAMES, URGENT, TokenBucket
+
+PAYLOAD = {"model": "bench", "messages": [{"role": "user", "content": "Classify: the sink is leaking"}],
+           "response_format": {"type": "json_object"}}
+
+
+async def one(url: str, priority: int, results):
+    t0 = time.perf_counter()
+    try:
+        r, _ = await llm_client.post_chat(url, {}, PAYLOAD, priority)
+        ok = r.is_success
+    except llm_client.LLMUnavailable:
+        ok = False
+    results[priority].append((ok, time.perf_counter() - t0))
+
+
+async def run(url: str, label: str, max_retries: int, rpm: float):
+    # the dispatcher llm_client uses, reconfigured per setup
+    d = llm_dispatch.dispatcher
+    d.__init__(rpm=rpm, concurrency=32, max_retries=max_retries)
+    if rpm:
+        d.requests = TokenBucket(rpm, seconds=FAKE_BURST_SECONDS)
+    fake_llm.STATS.update(requests=0, rate_limited=0)
+    fake_llm._bucket.update(level=fake_llm.FAKE_BURST, at=time.monotonic())
+    results = {p: [] for p in (URGENT, INTERACTIVE, BULK)}
+    t0 = time.perf_counter()
+    tasks = [asyncio.create_task(one(url, BULK, results)) for _ in range(BULK_CALLS)]
+    await asyncio.sleep(0.3)
+    tasks += [asyncio.create_task(one(url, p, results)) for p in (URGENT, INTERACTIVE) for _ in range(10)]
+    await asyncio.gather(*tasks)
+    wall = time.perf_counter() - t0
+
+    print(f"{label:<26} wall={wall:5.1f}s  provider 429s={fake_llm.STATS['rate_limited']:<4} "
+          f"retried={d.stats['retried']:<4} failed={d.stats['failed']}")
+    for p, rows in results.items():
+        lat = sorted(t for _, t in rows)
+        ok = sum(1 for good, _ in rows if good)
+        print(f"    {PRIORITY_NAMES[p]:<12} ok {ok:>3}/{len(rows):<3} p50={statistics.median(lat) * 1000:7.0f}ms "
+              f"p95={lat[int(len(lat) * 0.95) - 1] * 1000:7.0f}ms")
+
+
+FAKE_BURST_SECONDS = float(os.environ["FAKE_LLM_BURST"]) / PROVIDER_RPM * 60
+
+
+async def main():
+    url = serve_in_thread() + "/openai/v1/chat/completions"
+    print(f"{BULK_CALLS} bulk calls, then 10 urgent + 10 interactive; provider {PROVIDER_RPM:.0f} rpm, "
+          f"burst {fake_llm.FAKE_BURST:.0f}")
+    await run(url, "no retries (before)", 0, 0)
+    await run(url, "retries + Retry-After", llm_dispatch.LLM_MAX_RETRIES, 0)
+    await run(url, "retries + rpm pacing", llm_dispatch.LLM_MAX_RETRIES, PROVIDER_RPM)
+    await llm_client.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
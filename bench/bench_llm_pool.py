@@ -0,0 +1,53 @@
+# bench/bench_llm_pool.py
+# Per-call latency of call_groq-style requests: fresh AsyncClient per call vs the shared pool.
+#
+#   python bench/bench_llm_pool.py [calls]
+import asyncio, os, statistics, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+import llm_client
+from fake_llm import serve_in_thread
+
+PAYLOAD = {"model": "llama-3.1-8b-instant", "messages": [{"role": "user", "content": "hi"}]}
+
+
+async def _fresh(url: str) -> None:
+    async with httpx.AsyncClient(timeout=60) as client:
+        r = await client.post(url, json=PAYLOAD)
+        r.raise_for_status()
+
+
+async def _pooled(url: str) -> None:
+    r = await llm_client.get_client().post(url, json=PAYLOAD)
+    r.raise_for_status()
+
+
+async def _run(fn, url: str, calls: int):
+    await fn(url)  # warm-up
+    samples = []
+    for _ in range(calls):
+        t0 = time.perf_counter()
+        await fn(url)
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples
+
+
+def _report(name: str, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{name:<8} n={len(samples)} mean={statistics.mean(samples):.2f}ms "
+          f"p50={statistics.median(samples):.2f}ms p95={p95:.2f}ms")
+
+
+async def main(calls: int):
+    url = serve_in_thread() + "/openai/v1/chat/completions"
+    _report("fresh", await _run(_fresh, url, calls))
+    _report("pooled", await _run(_pooled, url, calls))
+    await llm_client.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200))
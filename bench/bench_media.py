@@ -0,0 +1,104 @@
+# bench/bench_media.py
+# /pm_chat with an image_url through the media pipeline: the first ask (fetch + downscale), repeat
+# asks about the same URL (served from the cache, sent inline) and follow-ups answered from the
+# cached description. A local file server stands in for the photo host and counts downloads; the
+# fake LLM counts request bytes.
+#
+#   python bench/bench_media.py [app] [calls] [image side px]
+import asyncio, io, os, statistics, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+os.environ.setdefault("FAKE_LLM_LATENCY_MS", "100")
+os.environ.setdefault("FAKE_LLM_CHUNK_MS", "0")
+os.environ.setdefault("MEDIA_DIR", tempfile.mkdtemp(prefix="media-bench-"))
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
+from PIL import Image
+
+import fake_llm
+from fake_llm import serve_in_thread
+
+APP = sys.argv[1] if len(sys.argv) > 1 else "main"
+CALLS = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+SIDE = int(sys.argv[3]) if len(sys.argv) > 3 else 4000
+PHOTO_LATENCY_MS = float(os.getenv("PHOTO_LATENCY_MS", "50"))
+
+# ------------------ stand-ins ------------------
+
+def _photo(side: int) -> bytes:
+    # noisy gradient so JPEG can't compress it to nothing
+    im = Image.effect_noise((side, side * 3 // 4), 64).convert("RGB")
+    out = io.BytesIO()
+    im.save(out, "JPEG", quality=92)
+    return out.getvalue()
+
+PHOTO = _photo(SIDE)
+photos = FastAPI()
+downloads = {"n": 0}
+
+@photos.get("/photo/{name}.jpg")
+async def photo(name: str):
+    downloads["n"] += 1
+    await asyncio.sleep(PHOTO_LATENCY_MS / 1000)
+    return Response(PHOTO, media_type="image/jpeg")
+
+llm_bytes = {"n": 0, "calls": 0}
+
+@fake_llm.app.middleware("http")
+async def count_bytes(request: Request, call_next):
+    llm_bytes["n"] += int(request.headers.get("content-length") or 0)
+    llm_bytes["calls"] += 1
+    return await call_next(request)
+
+
+async def _run(client: httpx.AsyncClient, body, calls: int):
+    lat = []
+    for _ in range(calls):
+        t0 = time.perf_counter()
+        (await client.post("/pm_chat", json=body)).raise_for_status()
+        lat.append((time.perf_counter() - t0) * 1000)
+    return lat
+
+
+async def main():
+    os.environ["LLM_URL"] = serve_in_thread() + "/openai/v1/chat/completions"
+    os.environ.setdefault("LLM_API_KEY", "bench")
+    os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+    os.environ.setdefault("STORE_BACKEND", "memory")
+    photo_base = serve_in_thread(photos)
+    mod = __import__(APP)
+    media = __import__("media")
+    base_url = serve_in_thread(mod.app)
+
+    def body(name):
+        return {"message": "What's wrong here?", "image_url": f"{photo_base}/photo/{name}.jpg",
+                "context": {"tenant_name": "John Doe", "unit": "3A", "address": "123 Maple St"}}
+
+    print(f"[{APP}] photo {SIDE}px, {len(PHOTO) / 1024:.0f} KiB, host latency {PHOTO_LATENCY_MS:.0f}ms")
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        rows = []
+        for label, reuse, name, calls in (
+            ("first ask (fetch+downscale)", False, "a", 1),
+            ("repeat, same url (inline)", False, "a", CALLS),
+            ("follow-ups (description)", True, "b", CALLS),
+        ):
+            media.MEDIA_REUSE_DESCRIPTION = reuse
+            if reuse:
+                await client.post("/pm_chat", json=body(name))   # first look, described in the background
+                await asyncio.sleep(0.5)
+            d0, b0, c0 = downloads["n"], llm_bytes["n"], llm_bytes["calls"]
+            lat = await _run(client, body(name), calls)
+            rows.append((label, statistics.median(lat), downloads["n"] - d0,
+                         (llm_bytes["n"] - b0) / max(llm_bytes["calls"] - c0, 1) / 1024))
+    for label, p50, dl, kib in rows:
+        print(f"  {label:<30} p50={p50:7.1f}ms  downloads={dl:<3} LLM request={kib:8.1f} KiB")
+    print(f"  media stats: {media.media_store.stats}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
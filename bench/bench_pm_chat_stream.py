@@ -0,0 +1,56 @@
+# bench/bench_pm_chat_stream.py
+# Time-to-first-token for /pm_chat vs /pm_chat/stream against the streaming stub.
+#
+#   FAKE_LLM_LATENCY_MS=150 FAKE_LLM_CHUNK_MS=40 python bench/bench_pm_chat_stream.py [app] [calls]
+import asyncio, os, statistics, sys, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+os.environ.setdefault("FAKE_LLM_LATENCY_MS", "150")
+os.environ.setdefault("FAKE_LLM_CHUNK_MS", "40")
+
+import httpx
+
+from fake_llm import serve_in_thread
+
+APP = sys.argv[1] if len(sys.argv) > 1 else "main"
+CALLS = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+BODY = {
+    "message": "Any tips for a leaky faucet?",
+    "context": {"tenant_name": "John Doe", "unit": "3A", "address": "123 Maple St"},
+}
+
+
+async def main():
+    os.environ["LLM_URL"] = serve_in_thread() + "/openai/v1/chat/completions"
+    os.environ.setdefault("LLM_API_KEY", "bench")
+    os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+    os.environ.setdefault("STORE_BACKEND", "memory")
+    app = __import__(APP).app
+    base_url = serve_in_thread(app)
+
+    ttft_full, ttft_stream, total_stream = [], [], []
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        for _ in range(CALLS):
+            t0 = time.perf_counter()
+            (await client.post("/pm_chat", json=BODY)).raise_for_status()
+            ttft_full.append((time.perf_counter() - t0) * 1000)
+
+            t0 = time.perf_counter()
+            first = None
+            async with client.stream("POST", "/pm_chat/stream", json=BODY) as r:
+                async for line in r.aiter_lines():
+                    if first is None and line.startswith("data:"):
+                        first = (time.perf_counter() - t0) * 1000
+            ttft_stream.append(first)
+            total_stream.append((time.perf_counter() - t0) * 1000)
+
+    print(f"[{APP}] /pm_chat        first byte of reply p50={statistics.median(ttft_full):.0f}ms")
+    print(f"[{APP}] /pm_chat/stream first token         p50={statistics.median(ttft_stream):.0f}ms "
+          f"(complete p50={statistics.median(total_stream):.0f}ms)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+# bench/bench_sms_send.py
+# Outbound /sms/send throughput: legacy TestClient status callbacks vs the in-process event bus.
+#
+#   python bench/bench_sms_send.py [sends] [concurrency]
+import asyncio, os, statistics, sys, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+os.environ.setdefault("LLM_API_KEY", "bench")
+os.environ.setdefault("STORE_BACKEND", "memory")
+
+import httpx
+
+import main
+from fake_llm import serve_in_thread
+
+SENDS = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+CONCURRENCY = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+
+async def legacy_simulate_status_callbacks(msg_sid: str):
+    # the previous implementation: a fresh TestClient per callback, run inside the event loop
+    from fastapi.testclient import TestClient
+    for status in ("sent", "delivered"):
+        await asyncio.sleep(main.FAKE_TWILIO_DELAY_MS / 1000)
+        TestClient(main.app).post("/twilio/status", json={"MessageSid": msg_sid, "MessageStatus": status})
+
+
+async def run(label: str, base_url: str):
+    sem = asyncio.Semaphore(CONCURRENCY)
+    latencies, sids = [], []
+
+    async def one(client, i):
+        async with sem:
+            t0 = time.perf_counter()
+            r = await client.post("/sms/send", json={"to": f"+1555{i % 100:07d}", "body": f"hello {i}"})
+            r.raise_for_status()
+            latencies.append((time.perf_counter() - t0) * 1000)
+            sids.append(r.json()["sid"])
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(client, i) for i in range(SENDS)))
+        accepted = time.perf_counter() - t0
+        while any(main.STORE["messages"][sid].status != "delivered" for sid in sids):
+            await asyncio.sleep(0.01)
+        delivered = time.perf_counter() - t0
+
+    print(f"{label:<8} sends/s={SENDS / accepted:7.1f} p50={statistics.median(latencies):6.1f}ms "
+          f"all delivered after {delivered:.2f}s")
+
+
+async def main_():
+    base_url = serve_in_thread(main.app)
+    original = main._simulate_status_callbacks
+    main._simulate_status_callbacks = legacy_simulate_status_callbacks
+    await run("legacy", base_url)
+    main._simulate_status_callbacks = original
+    await run("bus", base_url)
+
+
+if __name__ == "__main__":
+    asyncio.run(main_())
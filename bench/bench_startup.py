@@ -0,0 +1,81 @@
+# bench/bench_startup.py
+# Cold start of both apps, each in a fresh interpreter: how long `import <app>` takes, and
+# how long from spawning uvicorn until the first request that touches the database (GET
+# /threads) succeeds. The first run of each app starts on an empty database; the rest
+# reuse it, like a restarted or newly scaled-out worker. "ai_chat premigrated" runs the
+# schema step once up front (`python ai_chat.py migrate`) and starts with DB_AUTO_MIGRATE=0.
+#
+#   python bench/bench_startup.py [runs]
+import os, socket, statistics, subprocess, sys, tempfile, time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+APPS = (  # label, module, extra env
+    ("main", "main", {}),
+    ("ai_chat", "ai_chat", {}),
+    ("ai_chat premigrated", "ai_chat", {"DB_AUTO_MIGRATE": "0"}),
+)
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import {mod}; print(time.perf_counter() - t)"
+
+
+def app_env(tmp: str):
+    return {
+        **os.environ,
+        "PYTHONPATH": ROOT,
+        "LLM_API_KEY": "bench",
+        "STORE_DB": os.path.join(tmp, "store.db"),
+        "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'ai_chat.db')}",
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def import_time(mod: str, env) -> float:
+    out = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET.format(mod=mod)],
+                         env=env, cwd=ROOT, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def first_request(mod: str, env, client: httpx.Client) -> float:
+    port = free_port()
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", f"{mod}:app", "--port", str(port),
+                             "--log-level", "warning"], env=env, cwd=ROOT)
+    try:
+        while True:
+            try:
+                if client.get(f"http://127.0.0.1:{port}/threads").status_code == 200:
+                    return time.perf_counter() - t0
+            except httpx.TransportError:
+                pass
+            if proc.poll() is not None:
+                raise RuntimeError(f"{mod} exited with {proc.returncode}")
+            time.sleep(0.005)
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    print(f"{RUNS} runs per app, median (first run on an empty database in brackets)")
+    client = httpx.Client(timeout=1)  # built once: a new client per poll costs more than the app does
+    for label, mod, extra in APPS:
+        with tempfile.TemporaryDirectory(prefix="startup-bench-") as tmp:
+            env = {**app_env(tmp), **extra}
+            if extra.get("DB_AUTO_MIGRATE") == "0":
+                subprocess.run([sys.executable, f"{mod}.py", "migrate"], env=env, cwd=ROOT, check=True)
+            first = [first_request(mod, env, client) for _ in range(RUNS)]
+            imports = [import_time(mod, env) for _ in range(RUNS)]
+        print(f"  {label:<20} import {statistics.median(imports) * 1000:6.0f}ms   "
+              f"first request {statistics.median(first) * 1000:6.0f}ms  [{first[0] * 1000:.0f}ms]")
+
+
+if __name__ == "__main__":
+    main()
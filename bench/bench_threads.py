@@ -0,0 +1,104 @@
+# bench/bench_threads.py
+# ai_chat /threads: legacy full-table fold in Python vs the thread_summaries table.
+#
+#   python bench/bench_threads.py [messages] [phones]
+import asyncio, os, random, sqlite3, sys, tempfile, time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+N_MESSAGES = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+N_PHONES = int(sys.argv[2]) if len(sys.argv) > 2 else 5_000
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_threads.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+os.environ.setdefault("LLM_API_KEY", "bench")
+
+import ai_chat  # noqa: E402
+from ai_chat import (  # noqa: E402
+    AsyncSessionLocal, Message, SessionLocal, ThreadSummary, list_threads, rebuild_thread_summaries,
+)
+from pagination import MAX_PAGE_SIZE  # noqa: E402
+
+ai_chat.migrate()  # creates the schema in DB_PATH
+engine = ai_chat.get_engine()
+ai_chat.get_async_engine()
+
+
+def seed():
+    rnd = random.Random(0)
+    start = datetime(2024, 1, 1)
+    con = sqlite3.connect(DB_PATH)
+    rows = (
+        (f"+1555{rnd.randrange(N_PHONES):07d}", rnd.choice(("inbound", "outbound")),
+         f"message {i}", "[]", "received", (start + timedelta(seconds=i)).isoformat(" "))
+        for i in range(N_MESSAGES)
+    )
+    con.executemany(
+        "INSERT INTO messages (phone, direction, body, media_urls, status, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+    con.commit()
+    con.close()
+    with engine.begin() as conn:
+        rebuild_thread_summaries(conn)
+
+
+def legacy_list_threads(db):
+    # the pre-thread_summaries implementation
+    sums = {}
+    for m in db.query(Message).order_by(Message.created_at.asc()).all():
+        if m.phone not in sums:
+            sums[m.phone] = ThreadSummary(id=m.phone, participant=m.phone, last_message=None, last_status=None, count=0)
+        t = sums[m.phone]
+        t.count += 1
+        last_text = m.body or m.ai_reply
+        if last_text:
+            t.last_message = last_text
+        t.last_status = m.status
+    return sorted(sums.values(), key=lambda t: (t.count, t.id), reverse=True)
+
+
+def timed(name, fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        db = SessionLocal()
+        try:
+            t0 = time.perf_counter()
+            out = fn(db)
+            best = min(best, time.perf_counter() - t0)
+        finally:
+            db.close()
+    print(f"{name:<10} threads={len(out)} best={best * 1000:.1f}ms")
+    return out
+
+
+def timed_async(name, fn, repeat):
+    async def run():
+        best = float("inf")
+        for _ in range(repeat):
+            async with AsyncSessionLocal() as db:
+                t0 = time.perf_counter()
+                out = await fn(db)
+                best = min(best, time.perf_counter() - t0)
+        return best, out
+
+    best, out = asyncio.run(run())
+    print(f"{name:<10} threads={len(out)} best={best * 1000:.1f}ms")
+    return out
+
+
+if __name__ == "__main__":
+    t0 = time.perf_counter()
+    seed()
+    print(f"seeded {N_MESSAGES} messages / {N_PHONES} phones in {time.perf_counter() - t0:.1f}s ({DB_PATH})")
+    old = timed("legacy", legacy_list_threads, 1)
+    def page(sort):
+        async def fn(db):
+            return (await list_threads(sort=sort, limit=MAX_PAGE_SIZE, before=None, after=None, db=db)).items
+        return fn
+
+    new = timed_async("summaries", page("count"), 5)
+    assert [(t.id, t.count) for t in old[:MAX_PAGE_SIZE]] == [(t.id, t.count) for t in new]
+    timed_async("recent", page("recent"), 5)
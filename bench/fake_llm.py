@@ -0,0 +1,100 @@
+# bench/fake_llm.py
+# Local stand-in for the Groq OpenAI-compatible endpoint, used by the benchmarks.
+import asyncio, json, os, random, socket, threading, time
+from typing import Any, Dict
+
+import uvicorn
+from fastapi import FastAPI, Body
+from fastapi.responses import JSONResponse, StreamingResponse
+
+FAKE_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "0"))   # before the response / first chunk
+FAKE_CHUNK_MS   = float(os.getenv("FAKE_LLM_CHUNK_MS", "20"))    # between streamed chunks
+FAKE_ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))   # share of calls answered 429/500
+# provider-style rate limit: a bucket of FAKE_LLM_BURST requests refilled at FAKE_LLM_RPM; beyond it,
+# 429 with a (fractional) Retry-After (0 = no limit)
+FAKE_RPM        = float(os.getenv("FAKE_LLM_RPM", "0"))
+FAKE_BURST      = float(os.getenv("FAKE_LLM_BURST", "10"))
+
+STATS = {"requests": 0, "rate_limited": 0}
+_bucket = {"level": FAKE_BURST, "at": time.monotonic()}
+
+CLASSIFY_REPLY = {
+    "category": "maintenance",
+    "priority": "normal",
+    "entities": {},
+    "action": "route_to_pm",
+    "reply": "Thanks—we'll send someone to take a look.",
+    "confidence": 0.8,
+}
+
+PM_REPLY = (
+    "A leaky faucet is usually a worn washer or cartridge. Shut off the supply valves under the sink, "
+    "replace the washer or cartridge for that model, and schedule maintenance if the drip continues."
+)
+
+app = FastAPI(title="fake-llm")
+
+
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(payload: Dict[str, Any] = Body(...)):
+    STATS["requests"] += 1
+    if FAKE_RPM:
+        now = time.monotonic()
+        _bucket["level"] = min(FAKE_BURST, _bucket["level"] + (now - _bucket["at"]) * FAKE_RPM / 60)
+        _bucket["at"] = now
+        if _bucket["level"] < 1:
+            STATS["rate_limited"] += 1
+            wait = (1 - _bucket["level"]) * 60 / FAKE_RPM
+            return JSONResponse({"error": {"message": "rate limited"}}, status_code=429,
+                                headers={"Retry-After": f"{wait:.2f}"})
+        _bucket["level"] -= 1
+    if FAKE_LATENCY_MS:
+        await asyncio.sleep(FAKE_LATENCY_MS / 1000)
+    if FAKE_ERROR_RATE and random.random() < FAKE_ERROR_RATE:
+        if random.random() < 0.5:
+            return JSONResponse({"error": {"message": "rate limited"}}, status_code=429, headers={"Retry-After": "1"})
+        return JSONResponse({"error": {"message": "upstream error"}}, status_code=500)
+    wants_json = (payload.get("response_format") or {}).get("type") == "json_object"
+    content = json.dumps(CLASSIFY_REPLY) if wants_json else PM_REPLY
+    if payload.get("stream"):
+        return StreamingResponse(_stream(content, payload.get("model")), media_type="text/event-stream")
+    # a non-streamed completion still takes the whole generation time
+    await asyncio.sleep(FAKE_CHUNK_MS / 1000 * (len(content.split(" ")) - 1))
+    return {
+        "id": "chatcmpl-fake",
+        "model": payload.get("model"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 10, "total_tokens": 20},
+    }
+
+
+async def _stream(content: str, model: str):
+    words = content.split(" ")
+    for i, word in enumerate(words):
+        if i:
+            await asyncio.sleep(FAKE_CHUNK_MS / 1000)
+        delta = word if i == 0 else " " + word
+        chunk = {"id": "chatcmpl-fake", "model": model,
+                 "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}]}
+        yield f"data: {json.dumps(chunk)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve_in_thread(asgi_app=app, port: int = 0) -> str:
+    """Run `asgi_app` with uvicorn on a daemon thread; returns its base URL."""
+    port = port or _free_port()
+    server = uvicorn.Server(uvicorn.Config(asgi_app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}"
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="127.0.0.1", port=int(os.getenv("PORT", "8765")))
@@ -0,0 +1,284 @@
+# bench/loadtest.py
+# Load test main.py and/or ai_chat.py against a local fake LLM (bench/fake_llm.py).
+# Each app runs under uvicorn in its own process; main.py keeps its built-in fake Twilio.
+#
+#   python bench/loadtest.py --app both --duration 20 --concurrency 32 \
+#       --llm-latency-ms 300 --llm-error-rate 0.02 --stream
+#
+# Results are printed and written as JSON to bench/results/ so runs can be compared across commits.
+import argparse, asyncio, json, os, random, socket, statistics, subprocess, sys, tempfile, time
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH = os.path.join(ROOT, "bench")
+
+DEFAULT_MIX = {
+    "main": "incoming=4,classify=2,pm_chat=1,threads=2,thread=3",
+    "ai_chat": "pm_chat=1,threads=2,thread=4,messages=3",
+}
+
+FALLBACK_TEXTS = [
+    "Hi, my dishwasher keeps tripping the breaker.",
+    "The heat isn't working in the bedroom.",
+    "When is rent due this month?",
+    "Water is pouring from the ceiling into the hallway right now.",
+    "Can I get a copy of my lease?",
+]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def _pct(samples: List[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    s = sorted(samples)
+    return s[min(int(len(s) * q), len(s) - 1)]
+
+
+def _spawn(args: List[str], env: Dict[str, str], port: int) -> subprocess.Popen:
+    proc = subprocess.Popen(args, cwd=ROOT, env={**os.environ, **env},
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"{' '.join(args)} did not start on port {port}")
+
+
+def _load_seed_texts(path: str) -> List[str]:
+    # NDJSON lines; any of body/text/message/Body or a `thread` list is used as tenant text
+    texts: List[str] = []
+    if not path or not os.path.exists(path):
+        return texts
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue
+            for k in ("body", "text", "message", "Body"):
+                if isinstance(row.get(k), str) and row[k].strip():
+                    texts.append(row[k].strip()[:600])
+            if isinstance(row.get("thread"), list):
+                texts.extend(str(t) for t in row["thread"] if t)
+    return texts
+
+
+class Workload:
+    def __init__(self, app: str, texts: List[str], contexts: List[Dict[str, Any]], phones: int, stream: bool):
+        self.app = app
+        self.texts = texts
+        self.contexts = contexts
+        self.phones = [f"+1555{i:07d}" for i in range(phones)]
+        self.stream = stream
+
+    def context_for(self, phone: str) -> Dict[str, Any]:
+        ctx = dict(self.contexts[hash(phone) % len(self.contexts)])
+        ctx["unit"] = phone[-4:]
+        return ctx
+
+    async def seed(self, client: httpx.AsyncClient):
+        for phone in self.phones:
+            r = await client.post("/contacts/upsert", params={"phone": phone}, json=self.context_for(phone))
+            r.raise_for_status()
+            if self.app == "ai_chat":
+                await client.post("/messages", json={"phone": phone, "direction": "inbound", "body": random.choice(self.texts)})
+            else:
+                await client.post("/twilio/incoming", json={"From": phone, "To": "+15550000000", "Body": random.choice(self.texts)})
+
+    async def op(self, client: httpx.AsyncClient, name: str) -> httpx.Response:
+        phone = random.choice(self.phones)
+        text = random.choice(self.texts)
+        ctx = self.context_for(phone)
+        if name == "incoming":
+            return await client.post("/twilio/incoming", json={"From": phone, "To": "+15550000000", "Body": text})
+        if name == "classify":
+            return await client.post("/classify", json={"thread": [text], "context": ctx})
+        if name == "pm_chat":
+            body = {"message": text, "context": ctx, "phone": phone}
+            if not self.stream:
+                return await client.post("/pm_chat", json=body)
+            async with client.stream("POST", "/pm_chat/stream", json=body) as r:
+                async for line in r.aiter_lines():
+                    if line.startswith("event: error"):
+                        r.status_code = 502
+                return r
+        if name == "threads":
+            return await client.get("/threads", params={"limit": 50})
+        if name == "thread":
+            return await client.get(f"/threads/{phone}", params={"limit": 50})
+        if name == "messages":
+            return await client.post("/messages", json={"phone": phone, "direction": "inbound", "body": text})
+        raise ValueError(f"unknown op {name}")
+
+
+async def drive(base_url: str, work: Workload, mix: Dict[str, int], duration: float, concurrency: int):
+    names = [n for n, w in mix.items() for _ in range(w)]
+    lat: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    codes: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        await work.seed(client)
+        stop_at = time.perf_counter() + duration
+
+        async def user():
+            while time.perf_counter() < stop_at:
+                name = random.choice(names)
+                t0 = time.perf_counter()
+                try:
+                    r = await work.op(client, name)
+                    code = r.status_code
+                except httpx.HTTPError as e:
+                    code = type(e).__name__
+                lat[name].append((time.perf_counter() - t0) * 1000)
+                codes[name][str(code)] += 1
+                if not (isinstance(code, int) and code < 400):
+                    errors[name] += 1
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - t0
+
+    out: Dict[str, Any] = {"elapsed_s": round(elapsed, 3), "routes": {}}
+    all_lat: List[float] = []
+    for name, samples in sorted(lat.items()):
+        all_lat += samples
+        out["routes"][name] = {
+            "count": len(samples),
+            "rps": round(len(samples) / elapsed, 2),
+            "errors": errors[name],
+            "error_rate": round(errors[name] / len(samples), 4),
+            "p50_ms": round(statistics.median(samples), 2),
+            "p95_ms": round(_pct(samples, 0.95), 2),
+            "p99_ms": round(_pct(samples, 0.99), 2),
+            "status_codes": dict(codes[name]),
+        }
+    total_err = sum(errors.values())
+    out["total"] = {
+        "count": len(all_lat),
+        "rps": round(len(all_lat) / elapsed, 2),
+        "errors": total_err,
+        "error_rate": round(total_err / len(all_lat), 4) if all_lat else 0.0,
+        "p50_ms": round(statistics.median(all_lat), 2) if all_lat else 0.0,
+        "p95_ms": round(_pct(all_lat, 0.95), 2),
+        "p99_ms": round(_pct(all_lat, 0.99), 2),
+    }
+    return out
+
+
+def _parse_mix(spec: str) -> Dict[str, int]:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = int(weight or 1)
+    return mix
+
+
+async def _examples(base_url: str):
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        r = await client.get("/examples")
+        r.raise_for_status()
+        return r.json()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--app", choices=["main", "ai_chat", "both"], default="both")
+    ap.add_argument("--duration", type=float, default=15)
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--phones", type=int, default=50)
+    ap.add_argument("--mix-main", default=DEFAULT_MIX["main"])
+    ap.add_argument("--mix-ai-chat", default=DEFAULT_MIX["ai_chat"])
+    ap.add_argument("--llm-latency-ms", type=float, default=300)
+    ap.add_argument("--llm-chunk-ms", type=float, default=20)
+    ap.add_argument("--llm-error-rate", type=float, default=0.0)
+    ap.add_argument("--stream", action="store_true", help="use /pm_chat/stream instead of /pm_chat")
+    ap.add_argument("--seed-file", default=os.path.join(ROOT, "requests.jsonl"))
+    ap.add_argument("--out", default="")
+    args = ap.parse_args()
+
+    llm_port = _free_port()
+    procs = [_spawn([sys.executable, os.path.join(BENCH, "fake_llm.py")], {
+        "PORT": str(llm_port),
+        "FAKE_LLM_LATENCY_MS": str(args.llm_latency_ms),
+        "FAKE_LLM_CHUNK_MS": str(args.llm_chunk_ms),
+        "FAKE_LLM_ERROR_RATE": str(args.llm_error_rate),
+    }, llm_port)]
+    tmp = tempfile.mkdtemp()
+    app_env = {
+        "LLM_API_KEY": "loadtest",
+        "LLM_URL": f"http://127.0.0.1:{llm_port}/openai/v1/chat/completions",
+        "USE_FAKE_TWILIO": "1",
+        "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'loadtest.db')}",
+        "STORE_DB": os.path.join(tmp, "store.db"),
+    }
+    apps = ["main", "ai_chat"] if args.app == "both" else [args.app]
+    report: Dict[str, Any] = {
+        "commit": _git_commit(),
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "args": vars(args),
+        "apps": {},
+    }
+    try:
+        ports = {}
+        for app in apps:
+            ports[app] = _free_port()
+            procs.append(_spawn([sys.executable, "-m", "uvicorn", f"{app}:app", "--port", str(ports[app]),
+                                 "--log-level", "warning"], app_env, ports[app]))
+
+        # seed texts and contexts from main's /examples plus an NDJSON file
+        main_url = f"http://127.0.0.1:{ports['main']}" if "main" in ports else None
+        examples = asyncio.run(_examples(main_url)) if main_url else {}
+        texts = [t for ex in examples.values() for t in ex["thread"]] + _load_seed_texts(args.seed_file)
+        contexts = [ex["context"] for ex in examples.values()] or [
+            {"tenant_name": "John Doe", "unit": "3A", "address": "123 Maple St, Atlanta, GA 30318"}
+        ]
+        texts = texts or FALLBACK_TEXTS
+
+        for app in apps:
+            mix = _parse_mix(args.mix_main if app == "main" else args.mix_ai_chat)
+            work = Workload(app, texts, contexts, args.phones, args.stream)
+            res = asyncio.run(drive(f"http://127.0.0.1:{ports[app]}", work, mix, args.duration, args.concurrency))
+            report["apps"][app] = res
+            t = res["total"]
+            print(f"\n[{app}] {t['count']} requests in {res['elapsed_s']}s → {t['rps']} req/s, "
+                  f"errors {t['error_rate']:.2%}, p50 {t['p50_ms']}ms p95 {t['p95_ms']}ms p99 {t['p99_ms']}ms")
+            for name, r in res["routes"].items():
+                print(f"  {name:<10} n={r['count']:<6} rps={r['rps']:<8} err={r['error_rate']:<7.2%} "
+                      f"p50={r['p50_ms']:<8} p95={r['p95_ms']:<8} p99={r['p99_ms']}")
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait(timeout=10)
+
+    out = args.out or os.path.join(BENCH, "results", f"loadtest-{report['commit']}-{int(time.time())}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nsaved {out}")
+
+
+if __name__ == "__main__":
+    main()
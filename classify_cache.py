@@ -0,0 +1,175 @@
+# classify_cache.py
+import asyncio, copy, hashlib, json, logging, os, re, sqlite3, threading, time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+# ------------------ Config ------------------
+CLASSIFY_CACHE_SIZE = int(os.getenv("CLASSIFY_CACHE_SIZE", "1024"))
+CLASSIFY_CACHE_TTL  = float(os.getenv("CLASSIFY_CACHE_TTL", "3600"))   # seconds
+CLASSIFY_CACHE_DB   = os.getenv("CLASSIFY_CACHE_DB", "")                # e.g. ./data/store.db; empty = memory only
+CLASSIFY_CACHE_PURGE_INTERVAL = float(os.getenv("CLASSIFY_CACHE_PURGE_INTERVAL", "600"))  # seconds between expired-row sweeps
+
+log = logging.getLogger(__name__)
+
+_WS = re.compile(r"\s+")
+
+
+def normalize_thread(thread: List[str]) -> List[str]:
+    # collapse whitespace and drop empty messages so trivially different payloads share a key
+    return [_WS.sub(" ", m).strip() for m in thread if m and m.strip()]
+
+
+def make_key(thread: List[str], context: Dict[str, Any], version: str) -> str:
+    """Content address for a classification: normalized thread + context + model/prompt version."""
+    blob = json.dumps(
+        {"v": version, "thread": normalize_thread(thread), "ctx": context},
+        sort_keys=True, ensure_ascii=False, separators=(",", ":"),
+    )
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ClassificationCache:
+    """
+    LRU with TTL in front of the LLM. When `db_path` is set, entries are also
+    written to a `classify_cache` SQLite table so hits survive restarts. The
+    database is opened on first use (or by open() at startup), read on a worker
+    thread, and written behind: set() returns at once and a background task
+    upserts what has accumulated. Expired rows are deleted when read and, every
+    `purge_interval` seconds, in bulk.
+    """
+
+    def __init__(self, maxsize: int = CLASSIFY_CACHE_SIZE, ttl: float = CLASSIFY_CACHE_TTL,
+                 db_path: Optional[str] = CLASSIFY_CACHE_DB or None,
+                 purge_interval: float = CLASSIFY_CACHE_PURGE_INTERVAL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.db_path = db_path
+        self.purge_interval = purge_interval
+        self.hits = 0
+        self.misses = 0
+        self._mem: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()  # the connection, used from worker threads
+        self._db: Optional[sqlite3.Connection] = None
+        self._pending: Dict[str, tuple] = {}  # key -> (json, expires_at) not yet written
+        self._writer: Optional[asyncio.Task] = None
+        self._purged_at = 0.0
+
+    # ------------------ SQLite ------------------
+
+    def open(self):
+        """Connect and create the table (idempotent; a no-op without `db_path`)."""
+        with self._lock:
+            self._connect()
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        # caller holds _lock
+        if self._db is None and self.db_path:
+            db = sqlite3.connect(self.db_path, check_same_thread=False)
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS classify_cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            db.commit()
+            self._db = db
+        return self._db
+
+    def _load(self, key: str, now: float) -> Optional[tuple]:
+        with self._lock:
+            db = self._connect()
+            row = db.execute("SELECT value, expires_at FROM classify_cache WHERE key = ?", (key,)).fetchone()
+            if row and row[1] <= now:
+                db.execute("DELETE FROM classify_cache WHERE key = ? AND expires_at <= ?", (key, now))
+                db.commit()
+                return None
+            return row
+
+    def _write(self, batch: Dict[str, tuple]):
+        now = time.time()
+        with self._lock:
+            db = self._connect()
+            db.executemany(
+                "INSERT OR REPLACE INTO classify_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                [(key, value, expires_at) for key, (value, expires_at) in batch.items()],
+            )
+            if now - self._purged_at >= self.purge_interval:
+                db.execute("DELETE FROM classify_cache WHERE expires_at < ?", (now,))
+                self._purged_at = now
+            db.commit()
+
+    async def _write_pending(self):
+        while self._pending:
+            batch, self._pending = self._pending, {}
+            try:
+                await asyncio.to_thread(self._write, batch)
+            except Exception:
+                # only costs a miss after a restart; the entries are still served from memory
+                log.exception("classify cache write failed; dropped %d entries", len(batch))
+
+    def _schedule_write(self):
+        if self._writer is not None and not self._writer.done():
+            return  # the running writer picks these up
+        try:
+            self._writer = asyncio.get_running_loop().create_task(self._write_pending())
+        except RuntimeError:
+            # no event loop (scripts, shell): write through
+            batch, self._pending = self._pending, {}
+            self._write(batch)
+
+    async def aclose(self):
+        """Write what is pending and close the connection (shutdown)."""
+        if self._writer is not None:
+            await self._writer
+        await self._write_pending()
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    # ------------------ cache ------------------
+
+    def _remember(self, key: str, expires_at: float, value: Dict[str, Any]):
+        self._mem[key] = (expires_at, value)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.maxsize:
+            self._mem.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        hit = self._mem.get(key)
+        if hit and hit[0] > now:
+            self._mem.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(hit[1])
+        if hit:
+            del self._mem[key]
+        row = self._pending.get(key)  # written but not flushed yet
+        if row is None and self.db_path:
+            row = await asyncio.to_thread(self._load, key, now)
+        if row and row[1] > now:
+            value = json.loads(row[0])
+            self._remember(key, row[1], value)
+            self.hits += 1
+            return copy.deepcopy(value)
+        self.misses += 1
+        return None
+
+    def set(self, key: str, value: Dict[str, Any]):
+        expires_at = time.time() + self.ttl
+        value = copy.deepcopy(value)
+        self._remember(key, expires_at, value)
+        if self.db_path:
+            self._pending[key] = (json.dumps(value, ensure_ascii=False), expires_at)
+            self._schedule_write()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "size": len(self._mem),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "persistent": bool(self.db_path),
+            "pending_writes": len(self._pending),
+        }
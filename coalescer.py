@@ -0,0 +1,111 @@
+# coalescer.py
+import asyncio, logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+log = logging.getLogger(__name__)
+
+
+class BurstCoalescer:
+    """
+    Debounce work per key and run it on a bounded pool of background workers.
+
+    submit(key, item) keeps only the latest item per key and waits `window`
+    seconds of quiet (at most `max_wait` after the first submit) before a
+    worker calls `handler(key, item)`. A key is never handled by two workers
+    at once; items that arrive while it is running are coalesced into one
+    follow-up call.
+    """
+
+    def __init__(self, handler: Callable[[str, Any], Awaitable[None]],
+                 window: float, max_wait: float, workers: int):
+        self.handler = handler
+        self.window = window
+        self.max_wait = max_wait
+        self.workers = workers
+        self._pending: Dict[str, Any] = {}          # key -> latest item not yet handed to a worker
+        self._first_at: Dict[str, float] = {}
+        self._deadline: Dict[str, float] = {}
+        self._timers: Dict[str, asyncio.Task] = {}
+        self._running: Set[str] = set()
+        self._queued: Set[str] = set()              # keys whose timer fired, waiting for a free worker
+        self._ready: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._idle: Optional[asyncio.Event] = None
+
+    # ------------------ lifecycle ------------------
+
+    def start(self):
+        if self._tasks:
+            return
+        self._ready = asyncio.Queue()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for t in [*self._timers.values(), *self._tasks]:
+            t.cancel()
+        await asyncio.gather(*self._timers.values(), *self._tasks, return_exceptions=True)
+        self._timers.clear()
+        self._queued.clear()
+        self._tasks = []
+
+    async def drain(self):
+        """Wait until nothing is pending or running (tests, graceful shutdown)."""
+        if self._idle is not None:
+            await self._idle.wait()
+
+    def depth(self) -> int:
+        return len(self._pending) + len(self._running)
+
+    # ------------------ scheduling ------------------
+
+    def submit(self, key: str, item: Any, immediate: bool = False):
+        self.start()
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self._pending[key] = item
+        first = self._first_at.setdefault(key, now)
+        delay = 0.0 if immediate else self.window
+        self._deadline[key] = min(now + delay, first + self.max_wait)
+        self._idle.clear()
+        if key in self._running or key in self._queued:
+            return  # picked up again when the current run finishes / a worker frees up
+        timer = self._timers.get(key)
+        if immediate and timer is not None:
+            timer.cancel()
+            timer = None
+        if timer is None:
+            self._timers[key] = asyncio.create_task(self._debounce(key))
+
+    async def _debounce(self, key: str):
+        loop = asyncio.get_running_loop()
+        while True:
+            delay = self._deadline[key] - loop.time()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        self._timers.pop(key, None)
+        self._queued.add(key)
+        await self._ready.put(key)
+
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            self._queued.discard(key)
+            if key in self._running or key not in self._pending:
+                continue  # stale entry: never hand a key to two workers, or a worker nothing
+            item = self._pending.pop(key)
+            self._first_at.pop(key, None)
+            self._deadline.pop(key, None)
+            self._running.add(key)
+            try:
+                await self.handler(key, item)
+            except Exception:
+                log.exception("background handler failed for %s", key)
+            finally:
+                self._running.discard(key)
+                if key in self._pending:
+                    self._timers[key] = asyncio.create_task(self._debounce(key))
+                elif not self._pending and not self._running:
+                    self._idle.set()
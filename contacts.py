@@ -0,0 +1,120 @@
+# contacts.py
+# Contact lookups and bulk import helpers shared by main.py and ai_chat.py.
+import csv, os, threading, time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from ndjson import iter_lines, iter_ndjson
+
+# ------------------ Config ------------------
+CONTACT_CACHE_SIZE  = int(os.getenv("CONTACT_CACHE_SIZE", "10000"))
+CONTACT_CACHE_TTL   = float(os.getenv("CONTACT_CACHE_TTL", "60"))   # bounds staleness across worker processes
+CONTACTS_BULK_CHUNK = int(os.getenv("CONTACTS_BULK_CHUNK", "5000"))  # rows per transaction
+
+CONTACT_FIELDS  = ("tenant_name", "unit", "address", "hotline", "portal_url", "property_name")
+REQUIRED_FIELDS = ("tenant_name", "unit", "address")
+
+MISSING = object()
+
+
+class ContactCache:
+    """
+    LRU + TTL of phone -> contact dict, including negative entries (None) so
+    webhooks from unknown numbers don't hit the database every time. Call
+    invalidate() after every write.
+    """
+
+    def __init__(self, maxsize: int = CONTACT_CACHE_SIZE, ttl: float = CONTACT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._mem: "OrderedDict[str, tuple]" = OrderedDict()  # phone -> (expires_at, contact | None)
+        self._lock = threading.Lock()
+
+    def get(self, phone: str):
+        """The cached contact (or None for a known-missing one), else MISSING."""
+        with self._lock:
+            hit = self._mem.get(phone)
+            if hit and hit[0] > time.monotonic():
+                self._mem.move_to_end(phone)
+                self.hits += 1
+                return hit[1]
+            if hit:
+                del self._mem[phone]
+            self.misses += 1
+            return MISSING
+
+    def set(self, phone: str, contact: Optional[Dict[str, Any]]):
+        with self._lock:
+            self._mem[phone] = (time.monotonic() + self.ttl, contact)
+            self._mem.move_to_end(phone)
+            while len(self._mem) > self.maxsize:
+                self._mem.popitem(last=False)
+
+    def invalidate(self, *phones: str):
+        with self._lock:
+            for phone in phones:
+                self._mem.pop(phone, None)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "size": len(self._mem),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+        }
+
+
+# ------------------ Bulk import ------------------
+
+def bulk_format(content_type: Optional[str], fmt: Optional[str]) -> str:
+    if fmt:
+        return fmt
+    ct = (content_type or "").lower()
+    if "csv" in ct:
+        return "csv"
+    return "ndjson"
+
+
+def _clean(raw: Dict[str, Any]) -> Tuple[Optional[str], Optional[Dict[str, Any]], Optional[str]]:
+    row = {str(k).strip().lower(): (v.strip() if isinstance(v, str) else v) for k, v in raw.items() if k}
+    phone = row.get("phone") or row.get("tenant_phone")
+    if not phone:
+        return None, None, "phone required"
+    missing = [f for f in REQUIRED_FIELDS if not row.get(f)]
+    if missing:
+        return phone, None, f"missing {', '.join(missing)}"
+    return phone, {f: (row.get(f) or None) for f in CONTACT_FIELDS}, None
+
+
+async def iter_contact_rows(chunks: AsyncIterator[bytes], fmt: str) -> AsyncIterator[Tuple[int, Optional[str], Optional[Dict[str, Any]], Optional[str]]]:
+    """
+    Parse a streamed CSV (header row required) or NDJSON body without
+    buffering it. Yields (line_no, phone, contact, error) per record.
+    """
+    if fmt != "csv":
+        async for line_no, obj, error in iter_ndjson(chunks):
+            yield (line_no, None, None, error) if error else (line_no, *_clean(obj))
+        return
+
+    header, record, line_no = None, "", 0
+    async for line_no, line in iter_lines(chunks):
+        # a quoted field may span lines: wait until the quotes balance
+        record += line + "\n"
+        if record.count('"') % 2:
+            continue
+        text, record = record, ""
+        if not text.strip():
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = values
+            continue
+        yield (line_no, *_clean(dict(zip(header, values))))
+    if record.strip() and header is not None:
+        # unbalanced quote at end of input: parse what is there
+        yield (line_no, *_clean(dict(zip(header, next(csv.reader([record]))))))
@@ -0,0 +1,37 @@
+# events.py
+import inspect, logging
+from collections import defaultdict
+from typing import Any, Callable, Dict, List
+
+log = logging.getLogger(__name__)
+
+Handler = Callable[[Dict[str, Any]], Any]
+
+
+class EventBus:
+    """
+    In-process publish/subscribe. Handlers may be sync or async; they run in
+    subscription order and one failing handler does not stop the others.
+    Subscribing to "*" receives every topic.
+    """
+
+    def __init__(self):
+        self._subs: Dict[str, List[Handler]] = defaultdict(list)
+
+    def subscribe(self, topic: str, handler: Handler) -> Callable[[], None]:
+        self._subs[topic].append(handler)
+
+        def unsubscribe():
+            if handler in self._subs[topic]:
+                self._subs[topic].remove(handler)
+        return unsubscribe
+
+    async def publish(self, topic: str, event: Dict[str, Any]):
+        event = {"type": topic, **event}
+        for handler in [*self._subs.get(topic, ()), *self._subs.get("*", ())]:
+            try:
+                res = handler(event)
+                if inspect.isawaitable(res):
+                    await res
+            except Exception:
+                log.exception("event handler failed for %s", topic)
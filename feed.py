@@ -0,0 +1,125 @@
+# feed.py
+# Change feed for the dashboard: message.created / message.classified / message.status events,
+# kept in a bounded in-memory log and pushed over Server-Sent Events instead of polling
+# /threads. Every frame's SSE id is a resume token; EventSource sends it back as Last-Event-ID
+# when it reconnects, and the client gets exactly what it missed (or a `reset` event telling it
+# to re-fetch, when that is no longer in the log or the process has restarted since).
+import asyncio, itertools, os, uuid
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Set
+
+from ndjson import dumps_line
+
+# ------------------ Config ------------------
+FEED_LOG_SIZE   = int(os.getenv("FEED_LOG_SIZE", "10000"))    # events kept for resuming
+FEED_QUEUE_SIZE = int(os.getenv("FEED_QUEUE_SIZE", "1000"))   # per client; slower clients are cut off and resume
+FEED_HEARTBEAT  = float(os.getenv("FEED_HEARTBEAT", "15"))    # seconds between keep-alive comments
+FEED_RETRY_MS   = 2000                                        # EventSource reconnect delay hint
+
+FEED_TOPICS = ("message.created", "message.classified", "message.status")
+
+
+class _Subscriber:
+    def __init__(self, phones: Optional[Set[str]], prop: Optional[str], size: int):
+        self.phones = phones
+        self.prop = prop
+        self.queue: asyncio.Queue = asyncio.Queue(size)
+
+    def wants(self, event: Dict[str, Any]) -> bool:
+        return ((self.phones is None or event.get("phone") in self.phones)
+                and (self.prop is None or event.get("property") == self.prop))
+
+
+class ChangeFeed:
+    """
+    publish() is synchronous (an EventBus handler, or called directly) and never blocks:
+    a subscriber whose queue is full is disconnected and resumes from the log.
+    """
+
+    def __init__(self, property_for: Optional[Callable[[str], str]] = None,
+                 log_size: int = FEED_LOG_SIZE, queue_size: int = FEED_QUEUE_SIZE):
+        self.property_for = property_for
+        self.queue_size = queue_size
+        self.epoch = uuid.uuid4().hex[:8]  # tokens from before a restart (or another worker) are recognized
+        self._seq = itertools.count(1)
+        self._last = 0
+        self._log: deque = deque(maxlen=log_size)
+        self._subs: Set[_Subscriber] = set()
+
+    def token(self, seq: int) -> str:
+        return f"{self.epoch}-{seq}"
+
+    def _parse(self, token: Optional[str]) -> Optional[int]:
+        epoch, _, seq = (token or "").partition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def publish(self, event: Dict[str, Any]):
+        if event.get("property") is None and self.property_for is not None and event.get("phone"):
+            event = {**event, "property": self.property_for(event["phone"])}
+        self._last = next(self._seq)
+        event = {**event, "seq": self._last}
+        self._log.append(event)
+        for sub in list(self._subs):
+            if not sub.wants(event):
+                continue
+            try:
+                sub.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # drop what it has queued and end its stream; it reconnects from its last id
+                self._subs.discard(sub)
+                while not sub.queue.empty():
+                    sub.queue.get_nowait()
+                sub.queue.put_nowait(None)
+
+    def _replay(self, after: int, sub: _Subscriber) -> Optional[List[Dict[str, Any]]]:
+        """Logged events after seq `after` for `sub`, or None when some of them are gone."""
+        if after > self._last or (self._log and self._log[0]["seq"] > after + 1):
+            return None
+        return [e for e in self._log if e["seq"] > after and sub.wants(e)]
+
+    def _frame(self, event: Dict[str, Any]) -> str:
+        body = {k: v for k, v in event.items() if k not in ("type", "seq")}
+        return f"id: {self.token(event['seq'])}\nevent: {event['type']}\ndata: {dumps_line(body)}\n"
+
+    async def stream(self, phones: Optional[Iterable[str]] = None, prop: Optional[str] = None,
+                     resume: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        SSE frames for one client: `ready` (plus the events missed since `resume`), or `reset`
+        when those are gone, then live events, with a keep-alive comment when idle.
+        """
+        sub = _Subscriber(set(phones) if phones else None, prop, self.queue_size)
+        # subscribe and snapshot the log in one step (no await between): nothing is missed or sent twice
+        self._subs.add(sub)
+        try:
+            after = self._parse(resume) if resume else None
+            missed = self._replay(after, sub) if after is not None else None
+            if missed is not None:
+                # resumed: the replayed frames carry the ids, so a drop mid-replay resumes mid-replay
+                yield f"retry: {FEED_RETRY_MS}\nevent: ready\ndata: {dumps_line({'resumed': len(missed)})}\n"
+                for event in missed:
+                    yield self._frame(event)
+            else:
+                # fresh (or unusable token): start from now; `reset` tells a resuming client to re-fetch
+                kind = "reset" if resume else "ready"
+                yield f"retry: {FEED_RETRY_MS}\nid: {self.token(self._last)}\nevent: {kind}\ndata: {dumps_line({})}\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), FEED_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if event is None:
+                    return  # fell too far behind
+                yield self._frame(event)
+        finally:
+            self._subs.discard(sub)
+
+    def stats(self) -> Dict[str, int]:
+        return {"subscribers": len(self._subs), "logged": len(self._log), "last_seq": self._last}
+
+
+def message_event(phone: str, msg: Dict[str, Any], prop: Optional[str] = None) -> Dict[str, Any]:
+    # main.py's messages are keyed by provider sid, ai_chat.py's by row id
+    return {"sid": msg.get("sid") or msg.get("id"), "phone": phone, "property": prop, "message": msg}
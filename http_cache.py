@@ -0,0 +1,163 @@
+# http_cache.py
+# Conditional GET and response compression for the read endpoints the dashboard keeps
+# re-fetching (/threads, /threads/{phone}, /messages/{sid}). Routes compute a strong ETag from
+# something cheap (a version counter, a last-modified column) *before* loading anything and
+# answer 304 when the client already has it; bodies over COMPRESS_MIN_BYTES go out as br or gzip.
+import gzip, os, uuid
+from typing import Any, Dict, Optional
+
+from fastapi import Request, Response
+from starlette.datastructures import Headers, MutableHeaders
+
+# ------------------ Config ------------------
+COMPRESS_MIN_BYTES      = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))  # smaller bodies are sent as-is
+COMPRESS_GZIP_LEVEL     = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))  # 4-5 is the usual pick for dynamic content
+
+# browsers keep the response but revalidate it (If-None-Match) on every use
+CACHE_CONTROL = "no-cache"
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+CODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def etag(*parts: Any) -> str:
+    return '"' + "-".join(str(p) for p in parts) + '"'
+
+
+def _matching_tag(if_none_match: Optional[str], tag: str) -> Optional[str]:
+    """The client's entity tag that matches `tag` (ignoring W/ and our -br / -gzip suffix), if any."""
+    if not if_none_match:
+        return None
+    if if_none_match.strip() == "*":
+        return tag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        opaque = candidate[2:] if candidate.startswith("W/") else candidate
+        for coding in CODINGS:
+            if opaque.endswith(f'-{coding}"'):
+                opaque = opaque[: -len(coding) - 2] + '"'
+                break
+        if opaque == tag:
+            return candidate
+    return None
+
+
+def not_modified(request: Request, response: Response, tag: str) -> Optional[Response]:
+    """
+    Put the validators on `response` (the route's 200) and return a 304 to send instead
+    when the client's copy is current. Call it before building the body.
+    """
+    response.headers["ETag"] = tag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    matched = _matching_tag(request.headers.get("if-none-match"), tag)
+    if matched is None:
+        return None
+    # echo the variant the client holds (a compressed 200 carried a suffixed tag)
+    return Response(status_code=304, headers={"ETag": matched, "Cache-Control": CACHE_CONTROL,
+                                              "Vary": "Accept-Encoding"})
+
+
+class Versions:
+    """
+    In-process change counters per key, plus one across all keys, for data that lives in this
+    process. Tags carry a per-process epoch, so a tag issued before a restart never matches.
+    """
+
+    def __init__(self):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.total = 0
+        self._by_key: Dict[str, int] = {}
+
+    def bump(self, key: str):
+        self._by_key[key] = self._by_key.get(key, 0) + 1
+        self.total += 1
+
+    def tag(self, key: Optional[str] = None) -> str:
+        if key is None:
+            return etag(self.epoch, "all", self.total)
+        return etag(self.epoch, self._by_key.get(key, 0))
+
+
+# ------------------ Compression ------------------
+
+def _accepted(accept_encoding: str) -> Optional[str]:
+    """Best coding we can produce that the client takes (q=0 means refused)."""
+    offered = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        offered[name.strip()] = q
+    for coding in CODINGS:
+        if offered.get(coding, offered.get("*", 0)) > 0:
+            return coding
+    return None
+
+
+def _compressible(content_type: str) -> bool:
+    content_type = content_type.split(";")[0].strip()
+    if content_type == "text/event-stream":
+        return False
+    return content_type.startswith("text/") or content_type in ("application/json", "application/x-ndjson")
+
+
+def compress(coding: str, body: bytes) -> bytes:
+    if coding == "br":
+        return brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware:
+    """
+    br / gzip for complete JSON and text bodies of at least `minimum_size` bytes. Streamed
+    responses (SSE, NDJSON export) pass through untouched, so they are never buffered here.
+    A compressed response's ETag gets a -br / -gzip suffix: it is a different byte sequence.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        coding = _accepted(Headers(scope=scope).get("accept-encoding", ""))
+        start: Optional[Dict[str, Any]] = None
+
+        async def send_wrapper(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message  # held until we see whether the body is complete
+                return
+            if message["type"] != "http.response.body" or start is None:
+                return await send(message)
+            held, start = start, None
+            headers = MutableHeaders(raw=held["headers"])
+            body = message.get("body", b"")
+            if not _compressible(headers.get("content-type", "")) or "content-encoding" in headers:
+                await send(held)
+                return await send(message)
+            headers.add_vary_header("Accept-Encoding")
+            if coding is None or message.get("more_body", False) or len(body) < self.minimum_size:
+                await send(held)
+                return await send(message)
+            body = compress(coding, body)
+            headers["Content-Encoding"] = coding
+            headers["Content-Length"] = str(len(body))
+            tag = headers.get("etag")
+            if tag and tag.endswith('"'):
+                headers["ETag"] = f'{tag[:-1]}-{coding}"'
+            await send(held)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,241 @@
+# incidents.py
+# Near-duplicate tenant reports. Every inbound body gets a hashed n-gram vector; an in-memory
+# index per property keeps the last INCIDENT_WINDOW seconds of them. Reports close enough to a
+# recent one join its incident (the PM sees one burst pipe, not ten texts), and a very close
+# match to an already classified report lets main.py reuse that classification instead of
+# asking the LLM again. Nothing is persisted: after a restart the index refills as texts arrive.
+import copy, itertools, os, re, threading, time, zlib
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# ------------------ Config ------------------
+INCIDENT_DIM        = int(os.getenv("INCIDENT_DIM", "2048"))          # hashed feature space
+INCIDENT_WINDOW     = float(os.getenv("INCIDENT_WINDOW", "21600"))    # seconds a report stays matchable
+INCIDENT_MATCH      = float(os.getenv("INCIDENT_MATCH", "0.4"))      # cosine to join an incident
+INCIDENT_REUSE      = float(os.getenv("INCIDENT_REUSE", "0.75"))      # cosine to reuse a classification (0 disables)
+INCIDENT_MAX_ENTRIES = int(os.getenv("INCIDENT_MAX_ENTRIES", "2000")) # per property, oldest dropped first
+
+_CHAR_N = 4
+_TOKEN = re.compile(r"[a-z0-9]+")
+# function words only add similarity between unrelated texts
+_STOPWORDS = frozenset(
+    "a an and are at be been but by can do for from has have i im in is it its me my of on or our please "
+    "so that the there this to was we with you your".split()
+)
+_PRIORITY_RANK = {"low": 0, "normal": 1, "high": 2, "critical": 3}
+
+
+# ------------------ Embedding ------------------
+
+def embed(text: Optional[str], dim: int = INCIDENT_DIM) -> Optional[np.ndarray]:
+    """
+    Unit-length float32 vector of word unigrams + bigrams and character 4-grams, feature-hashed
+    with a hash-derived sign so collisions cancel out on average. None for text without words.
+    """
+    words = [w for w in _TOKEN.findall((text or "").lower()) if w not in _STOPWORDS]
+    if not words:
+        return None
+    joined = f" {' '.join(words)} "
+    features = [f"w:{w}" for w in words]
+    features += [f"b:{a} {b}" for a, b in zip(words, words[1:])]
+    features += [joined[i:i + _CHAR_N] for i in range(len(joined) - _CHAR_N + 1)]
+    hashes = np.fromiter((zlib.crc32(f.encode("utf-8")) for f in features), dtype=np.uint32, count=len(features))
+    signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+    # words carry more meaning than any single 4-gram
+    weights = np.ones(len(features), dtype=np.float32)
+    weights[:len(words)] = 2.0
+    vec = np.zeros(dim, dtype=np.float32)
+    np.add.at(vec, hashes % dim, signs * weights)
+    norm = float(np.linalg.norm(vec))
+    return vec / norm if norm else None
+
+
+# ------------------ Index ------------------
+
+class _Partition:
+    """Vectors of one property's recent reports, oldest first, in a growable matrix."""
+
+    def __init__(self, dim: int):
+        self.vecs = np.zeros((64, dim), dtype=np.float32)
+        self.entries: List[Dict[str, Any]] = []
+
+    def append(self, vec: np.ndarray, entry: Dict[str, Any], max_entries: int):
+        n = len(self.entries)
+        if n == max_entries:
+            # make room a tenth at a time so a full partition doesn't shift the matrix on every report
+            k = max(1, max_entries // 10)
+            self.drop(k)
+            n -= k
+        if n == len(self.vecs):
+            grown = np.zeros((min(2 * n, max_entries), self.vecs.shape[1]), dtype=np.float32)
+            grown[:n] = self.vecs
+            self.vecs = grown
+        self.vecs[n] = vec
+        self.entries.append(entry)
+
+    def drop(self, k: int):
+        """Forget the k oldest reports."""
+        if k <= 0:
+            return
+        n = len(self.entries)
+        self.vecs[:n - k] = self.vecs[k:n]
+        del self.entries[:k]
+
+    def expire(self, cutoff: float):
+        k = 0
+        for e in self.entries:
+            if e["at"] >= cutoff:
+                break
+            k += 1
+        self.drop(k)
+
+    def similarities(self, vec: np.ndarray) -> np.ndarray:
+        return self.vecs[:len(self.entries)] @ vec
+
+
+class IncidentIndex:
+    """
+    property -> recent reports, plus the incidents they were grouped into. Keys are message
+    sids (or ids); the index is small and bounded, so lookups by key scan the partition.
+    """
+
+    def __init__(self, window: float = INCIDENT_WINDOW, match: float = INCIDENT_MATCH,
+                 reuse: float = INCIDENT_REUSE, max_entries: int = INCIDENT_MAX_ENTRIES, dim: int = INCIDENT_DIM):
+        self.window = window
+        self.match = match
+        self.reuse_threshold = reuse
+        self.max_entries = max_entries
+        self.dim = dim
+        self._partitions: Dict[str, _Partition] = {}
+        self._incidents: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()   # oldest activity first
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.stats = {"indexed": 0, "grouped": 0, "reused": 0}
+
+    def _expire(self, now: float):
+        cutoff = now - self.window
+        for prop in list(self._partitions):
+            part = self._partitions[prop]
+            part.expire(cutoff)
+            if not part.entries:
+                del self._partitions[prop]
+        while self._incidents:
+            inc = next(iter(self._incidents.values()))
+            if inc["_at"] >= cutoff:
+                break
+            self._incidents.popitem(last=False)
+
+    def add(self, key: str, prop: str, phone: str, text: Optional[str],
+            created_at: Optional[datetime] = None, now: Optional[float] = None) -> Optional[str]:
+        """Index one inbound report; returns the id of the incident it joined or opened (None for no text)."""
+        vec = embed(text, self.dim)
+        if vec is None:
+            return None
+        now = time.time() if now is None else now
+        created_at = created_at or datetime.utcnow()
+        with self._lock:
+            self._expire(now)
+            part = self._partitions.get(prop)
+            if part is None:
+                part = self._partitions[prop] = _Partition(self.dim)
+            incident = None
+            if part.entries:
+                sims = part.similarities(vec)
+                best = int(np.argmax(sims))
+                if sims[best] >= self.match:
+                    incident = self._incidents.get(part.entries[best]["incident"])
+            if incident is None:
+                incident = {
+                    "id": f"INC{next(self._ids)}", "property": prop, "first_at": created_at,
+                    "summary": text.strip(), "category": None, "priority": None, "phones": [], "sids": [],
+                }
+            else:
+                self.stats["grouped"] += 1
+            incident["last_at"] = max(created_at, incident.get("last_at") or created_at)
+            incident["_at"] = now
+            incident["sids"].append(key)
+            if phone not in incident["phones"]:
+                incident["phones"].append(phone)
+            self._incidents[incident["id"]] = incident
+            self._incidents.move_to_end(incident["id"])
+            part.append(vec, {"key": key, "phone": phone, "at": now, "incident": incident["id"], "obj": None},
+                        self.max_entries)
+            self.stats["indexed"] += 1
+            return incident["id"]
+
+    def _find(self, key: str, prop: str) -> Tuple[Optional[_Partition], int]:
+        part = self._partitions.get(prop)
+        if part is not None:
+            for i in range(len(part.entries) - 1, -1, -1):
+                if part.entries[i]["key"] == key:
+                    return part, i
+        return None, -1
+
+    def classified(self, key: str, prop: str, obj: Dict[str, Any]):
+        """Remember a report's classification; its incident takes the most urgent priority seen."""
+        with self._lock:
+            part, i = self._find(key, prop)
+            if part is None:
+                return
+            entry = part.entries[i]
+            entry["obj"] = copy.deepcopy(obj)
+            incident = self._incidents.get(entry["incident"])
+            if incident is not None:
+                if _PRIORITY_RANK.get(obj.get("priority"), -1) >= _PRIORITY_RANK.get(incident["priority"], -1):
+                    incident["category"], incident["priority"] = obj.get("category"), obj.get("priority")
+
+    def reusable(self, key: str, prop: str) -> Optional[Tuple[str, float, Dict[str, Any]]]:
+        """
+        (key, similarity, classification) of the closest already classified report from
+        another phone, when it is at least INCIDENT_REUSE similar to report `key`.
+        """
+        if not self.reuse_threshold:
+            return None
+        with self._lock:
+            part, i = self._find(key, prop)
+            if part is None:
+                return None
+            phone = part.entries[i]["phone"]
+            sims = part.similarities(part.vecs[i])
+            for j in np.argsort(-sims):
+                if sims[j] < self.reuse_threshold:
+                    break
+                other = part.entries[j]
+                if other["obj"] is not None and other["phone"] != phone:
+                    self.stats["reused"] += 1
+                    return other["key"], float(sims[j]), copy.deepcopy(other["obj"])
+            return None
+
+    def incidents(self, prop: Optional[str] = None, min_reports: int = 1, limit: int = 100) -> List[Dict[str, Any]]:
+        """Open incidents, most recently active first."""
+        with self._lock:
+            self._expire(time.time())
+            out = []
+            for inc in reversed(self._incidents.values()):
+                if (prop is None or inc["property"] == prop) and len(inc["sids"]) >= min_reports:
+                    out.append({k: (list(v) if isinstance(v, list) else v) for k, v in inc.items() if k != "_at"}
+                               | {"reports": len(inc["sids"])})
+                    if len(out) >= limit:
+                        break
+            return out
+
+    def size(self) -> Dict[str, int]:
+        return {"reports": sum(len(p.entries) for p in self._partitions.values()), "incidents": len(self._incidents)}
+
+
+def adapt(obj: Dict[str, Any], ctx: Dict[str, Any], duplicate_of: str) -> Dict[str, Any]:
+    """
+    Another tenant's classification, re-addressed to this one: entities carry this
+    contact's details and the reply's name / unit are swapped for theirs.
+    """
+    reply = obj.get("reply") or ""
+    entities = dict(obj.get("entities") or {})
+    for field in ("tenant_name", "unit"):
+        old, new = entities.get(field), ctx.get(field)
+        if old and new and old != new:
+            reply = re.sub(rf"\b{re.escape(str(old))}\b", str(new), reply)
+    entities.update({k: ctx.get(k) for k in ("tenant_name", "unit", "address")}, duplicate_of=duplicate_of)
+    return {**obj, "entities": entities, "reply": reply}
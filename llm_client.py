@@ -0,0 +1,173 @@
+# llm_client.py
+import asyncio, json, math, os, time
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+import httpx
+
+import metrics
+from llm_dispatch import INTERACTIVE, RETRY_ERRORS, RETRY_STATUSES, dispatcher, estimate_tokens
+
+# ------------------ Pool Config ------------------
+# One keep-alive pool per process, shared by main.call_groq and ai_chat.call_groq.
+LLM_HTTP2            = os.getenv("LLM_HTTP2", "1") == "1"
+LLM_MAX_CONNECTIONS  = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE    = int(os.getenv("LLM_MAX_KEEPALIVE", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))
+LLM_CONNECT_TIMEOUT  = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT     = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _http2_available() -> bool:
+    # httpx only speaks HTTP/2 when the optional `h2` package is installed
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def build_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(
+        connect=LLM_CONNECT_TIMEOUT,
+        read=LLM_READ_TIMEOUT,
+        write=LLM_CONNECT_TIMEOUT,
+        pool=LLM_CONNECT_TIMEOUT,
+    )
+    return httpx.AsyncClient(
+        http2=LLM_HTTP2 and _http2_available(),
+        limits=limits,
+        timeout=timeout,
+    )
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Return the shared pooled client. Created lazily so scripts that never
+    run the app lifespan (benchmarks, REPL) still work.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = build_client()
+    return _client
+
+
+async def shutdown():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+# ------------------ Completions ------------------
+
+class LLMUnavailable(Exception):
+    """The provider kept answering 429 / 5xx (or refusing connections) through every retry."""
+
+    def __init__(self, status: Optional[int], retry_after: float):
+        super().__init__(f"LLM provider unavailable ({status or 'connection failed'})")
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+
+async def post_chat(url: str, headers: Dict[str, str], payload: Dict[str, Any],
+                    priority: int = INTERACTIVE) -> Tuple[httpx.Response, Dict[str, Any]]:
+    """
+    One non-streamed completion through the dispatcher. Returns a pair: the httpx response
+    and its parsed JSON body, which is {} unless the status is 2xx; read the reply and its
+    usage from the body. Every attempt is timed; raises LLMUnavailable once retries are
+    exhausted.
+    """
+    client = get_client()
+    model = payload.get("model", "")
+    tokens = estimate_tokens(payload.get("messages") or [])
+    data: Dict[str, Any] = {}
+
+    async def attempt() -> httpx.Response:
+        nonlocal data
+        started = time.perf_counter()
+        try:
+            r = await client.post(url, headers=headers, json=payload)
+        except httpx.HTTPError:
+            metrics.observe_llm(model, started, "error")
+            raise
+        data = r.json() if r.is_success else {}
+        metrics.observe_llm(model, started, r.status_code, data.get("usage"))
+        return r
+
+    try:
+        r = await dispatcher.send(attempt, priority, tokens)
+    except RETRY_ERRORS as e:
+        raise LLMUnavailable(None, dispatcher.cooldown()) from e
+    if r.status_code in RETRY_STATUSES:
+        raise LLMUnavailable(r.status_code, dispatcher.cooldown())
+    dispatcher.settle(tokens, data.get("usage"))
+    return r, data
+
+
+# ------------------ Streaming ------------------
+
+async def stream_chat(url: str, headers: Dict[str, str], payload: Dict[str, Any],
+                      priority: int = INTERACTIVE) -> AsyncIterator[str]:
+    """
+    Yield content deltas from an OpenAI-compatible `stream: true` completion.
+    Closing or cancelling the generator closes the upstream response, which
+    aborts the provider request.
+    """
+    client = get_client()
+    model = payload.get("model", "")
+    tokens = estimate_tokens(payload.get("messages") or [])
+    started = time.perf_counter()
+    status: Any = "error"
+    usage: Optional[Dict[str, Any]] = None
+    first = True
+    opener = lambda: client.stream("POST", url, headers=headers, json={**payload, "stream": True})
+    try:
+        async with dispatcher.stream(opener, priority, tokens) as r:
+            status = r.status_code
+            if r.status_code >= 400:
+                body = (await r.aread()).decode("utf-8", errors="replace")
+                raise httpx.HTTPStatusError(f"{r.status_code}: {body}", request=r.request, response=r)
+            async for line in r.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    chunk = json.loads(data)
+                except ValueError:
+                    continue
+                # OpenAI puts usage on the last chunk, Groq under x_groq
+                usage = chunk.get("usage") or (chunk.get("x_groq") or {}).get("usage") or usage
+                delta = ((chunk.get("choices") or [{}])[0].get("delta") or {}).get("content")
+                if delta:
+                    if first:
+                        metrics.LLM_FIRST_TOKEN.observe(time.perf_counter() - started, model)
+                        first = False
+                    yield delta
+    except (GeneratorExit, asyncio.CancelledError):
+        status = "cancelled"  # client went away
+        raise
+    finally:
+        dispatcher.settle(tokens, usage)
+        metrics.observe_llm(model, started, status, usage)
+
+
+def sse(data: Any, event: Optional[str] = None) -> str:
+    # one Server-Sent Events frame with a JSON payload
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
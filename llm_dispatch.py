@@ -0,0 +1,250 @@
+# llm_dispatch.py
+# Every LLM call in both apps waits its turn here: requests/min and tokens/min token buckets,
+# a cap on calls in flight, strict priority order among waiters (an emergency classification
+# goes before PM chat, which goes before bulk re-triage), and retries with jittered exponential
+# backoff on 429 / 5xx / connection failures. A 429 pauses the whole dispatcher, honoring
+# Retry-After, because the provider's limits are per API key rather than per request.
+import asyncio, email.utils, heapq, itertools, os, random, time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncContextManager, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+import metrics
+
+# ------------------ Config ------------------
+LLM_RPM             = float(os.getenv("LLM_RPM", "0"))            # requests per minute (0 = unlimited)
+LLM_TPM             = float(os.getenv("LLM_TPM", "0"))            # tokens per minute (0 = unlimited)
+LLM_BUCKET_SECONDS  = float(os.getenv("LLM_BUCKET_SECONDS", "60")) # burst the buckets allow, in seconds of refill
+LLM_CONCURRENCY     = int(os.getenv("LLM_CONCURRENCY", "32"))     # calls in flight; streams hold theirs until done
+LLM_MAX_RETRIES     = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE    = float(os.getenv("LLM_BACKOFF_BASE", "0.5")) # seconds, doubled per attempt, full jitter
+LLM_BACKOFF_MAX     = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+LLM_MAX_RETRY_AFTER = float(os.getenv("LLM_MAX_RETRY_AFTER", "60"))  # a longer Retry-After fails the call instead
+# tokens/min accounting: estimated before the call (prompt chars / 4 + this), corrected from `usage` after
+LLM_COMPLETION_ESTIMATE = int(os.getenv("LLM_COMPLETION_ESTIMATE", "300"))
+IMAGE_TOKEN_ESTIMATE    = 1000
+
+URGENT, INTERACTIVE, BACKGROUND, BULK = range(4)
+PRIORITY_NAMES = ("urgent", "interactive", "background", "bulk")
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# failures where the request never reached the model; read timeouts are not retried (they already took LLM_READ_TIMEOUT)
+RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, httpx.RemoteProtocolError)
+
+QUEUE_WAIT = metrics.REGISTRY.histogram(
+    "llm_queue_wait_seconds", "Time LLM calls waited for a dispatch slot, by priority.", ("priority",),
+)
+RETRIES = metrics.REGISTRY.counter(
+    "llm_retries_total", "LLM calls retried, by the status (or 'connect') that caused it.", ("reason",),
+)
+
+
+def estimate_tokens(messages: List[Dict[str, Any]]) -> int:
+    chars, images = 0, 0
+    for m in messages:
+        content = m.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                chars += len(part.get("text") or "")
+            else:
+                images += 1
+    return chars // 4 + images * IMAGE_TOKEN_ESTIMATE + LLM_COMPLETION_ESTIMATE
+
+
+def retry_after(r: httpx.Response) -> Optional[float]:
+    """Seconds from a Retry-After header (delta-seconds or HTTP date), if any."""
+    value = r.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """`per_minute` units, refilled continuously, holding at most `seconds` worth. 0 = unlimited."""
+
+    def __init__(self, per_minute: float, seconds: float = LLM_BUCKET_SECONDS):
+        self.rate = per_minute / 60.0
+        self.capacity = self.rate * seconds
+        self.level = self.capacity
+        self.at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.at) * self.rate)
+        self.at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        if not self.capacity:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)  # an oversized request waits for a full bucket, not forever
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float, now: float):
+        # may go negative: a call that used more than estimated delays the ones after it
+        if self.capacity:
+            self._refill(now)
+            self.level -= amount
+
+
+class LLMDispatcher:
+    def __init__(self, rpm: float = LLM_RPM, tpm: float = LLM_TPM, concurrency: int = LLM_CONCURRENCY,
+                 max_retries: int = LLM_MAX_RETRIES):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._waiters: List[list] = []   # heap of [priority, seq, future, tokens]
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.stats = {"dispatched": 0, "retried": 0, "rate_limited": 0, "failed": 0}
+
+    # ------------------ slots ------------------
+
+    def _pump(self):
+        """Hand out slots to the best waiters while every limit allows; otherwise wake up when one will."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._waiters:
+            _, _, fut, tokens = self._waiters[0]
+            if fut.done():  # cancelled while queued
+                heapq.heappop(self._waiters)
+                continue
+            if self.concurrency and self.in_flight >= self.concurrency:
+                return  # release() pumps again
+            now = time.monotonic()
+            wait = max(self.paused_until - now, self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._pump)
+                return
+            heapq.heappop(self._waiters)
+            self.requests.take(1, now)
+            self.tokens.take(tokens, now)
+            self.in_flight += 1
+            self.stats["dispatched"] += 1
+            fut.set_result(None)
+
+    async def acquire(self, priority: int = INTERACTIVE, tokens: int = 0):
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [priority, next(self._seq), fut, tokens])
+        started = time.perf_counter()
+        self._pump()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()  # granted just as the caller went away
+            raise
+        QUEUE_WAIT.observe(time.perf_counter() - started, PRIORITY_NAMES[priority])
+
+    def release(self):
+        self.in_flight -= 1
+        self._pump()
+
+    def settle(self, estimate: int, usage: Optional[Dict[str, Any]]):
+        """Correct the tokens/min bucket once the provider reports what a call really used."""
+        if self.tokens.capacity and usage and usage.get("total_tokens"):
+            self.tokens.take(usage["total_tokens"] - estimate, time.monotonic())
+
+    def cooldown(self) -> float:
+        """Seconds until calls are let out again after a 429 (at least the base backoff)."""
+        return max(self.paused_until - time.monotonic(), LLM_BACKOFF_BASE)
+
+    def depth(self) -> Dict[str, int]:
+        waiting = dict.fromkeys(PRIORITY_NAMES, 0)
+        for priority, _, fut, _ in self._waiters:
+            if not fut.done():
+                waiting[PRIORITY_NAMES[priority]] += 1
+        return {**waiting, "in_flight": self.in_flight}
+
+    # ------------------ retries ------------------
+
+    def _retry_delay(self, attempt: int, r: Optional[httpx.Response], error: Optional[Exception]) -> Optional[float]:
+        """Seconds to sleep before retrying this outcome, or None to hand it to the caller as-is."""
+        if error is None and r.status_code not in RETRY_STATUSES:
+            return None
+        wait = retry_after(r) if r is not None else None
+        if attempt >= self.max_retries or (wait or 0) > LLM_MAX_RETRY_AFTER:
+            self.stats["failed"] += 1
+            return None
+        self.stats["retried"] += 1
+        RETRIES.inc("connect" if r is None else r.status_code)
+        delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+        if r is not None and r.status_code == 429:
+            # hold every queued call, then let them out in priority order (jitter spreads out other processes)
+            self.stats["rate_limited"] += 1
+            pause = wait + random.uniform(0, LLM_BACKOFF_BASE) if wait is not None else delay
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+            return 0.0
+        return max(delay, wait or 0.0)
+
+    async def send(self, send: Callable[[], Awaitable[httpx.Response]], priority: int = INTERACTIVE,
+                   tokens: int = 0) -> httpx.Response:
+        """
+        Run `send` (one provider request) in a slot, retrying 429 / 5xx / connection failures.
+        Returns the last response, which is still a 429 / 5xx when retries ran out; re-raises
+        the last connection error.
+        """
+        attempt = 0
+        while True:
+            await self.acquire(priority, tokens)
+            r, error = None, None
+            try:
+                r = await send()
+            except RETRY_ERRORS as e:
+                error = e
+            finally:
+                self.release()
+            delay = self._retry_delay(attempt, r, error)
+            if delay is None:
+                if error is not None:
+                    raise error
+                return r
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def stream(self, open_stream: Callable[[], AsyncContextManager[httpx.Response]],
+                     priority: int = INTERACTIVE, tokens: int = 0) -> AsyncIterator[httpx.Response]:
+        """
+        send() for a streamed response: retried only before the caller sees it, and the
+        slot is held until the caller is done reading.
+        """
+        attempt = 0
+        while True:
+            await self.acquire(priority, tokens)
+            handed = False
+            try:
+                async with open_stream() as r:
+                    delay = self._retry_delay(attempt, r, None)
+                    if delay is None:
+                        handed = True
+                        yield r
+                        return
+            except RETRY_ERRORS as e:
+                if handed:
+                    raise
+                delay = self._retry_delay(attempt, None, e)
+                if delay is None:
+                    raise
+            finally:
+                self.release()
+            attempt += 1
+            await asyncio.sleep(delay)
+
+
+dispatcher = LLMDispatcher()
+metrics.REGISTRY.gauge("llm_dispatch", "LLM calls waiting per priority, and in flight.", dispatcher.depth, label="state")
@@ -1,29 +1,65 @@
 # main.py
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import APIRouter, FastAPI, HTTPException, Body, Header, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware  # NEW: Import CORS middleware
-from pydantic import BaseModel, Field, validator, HttpUrl
-from typing import Optional, Dict, List, Any
-import httpx, os, json, uuid, asyncio
+from pydantic import BaseModel, Field, ValidationError, validator, HttpUrl
+from typing import Optional, Dict, List, Any, Tuple
+import os, json, uuid, asyncio, hashlib, logging, re, time
 from dotenv import load_dotenv
-from collections import defaultdict
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager, aclosing
 from datetime import datetime
 
+import analytics
+import llm_client
+import metrics
+from coalescer import BurstCoalescer
+from events import EventBus
+from feed import FEED_TOPICS, ChangeFeed, message_event
+from http_cache import CompressionMiddleware, Versions, not_modified
+from analytics import GROUP_DIMS, Rollups, message_delta, waiting_since
+from classify_cache import ClassificationCache, make_key
+from incidents import IncidentIndex, adapt
+from llm_dispatch import BACKGROUND, BULK, INTERACTIVE, URGENT
+from contacts import CONTACT_CACHE_SIZE, CONTACTS_BULK_CHUNK, bulk_format, iter_contact_rows
+from ndjson import EXPORT_BATCH, IMPORT_BATCH, NDJSON_MEDIA_TYPE, BulkReport, dumps_line, iter_ndjson, parse_datetime
+from media import media_store
+from message_store import LRUCache, STORE_HISTORY_CACHE_SIZE, STORE_THREAD_CACHE_SIZE, open_store
+from search import match_expr
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, encode_cursor, decode_cursor
+
 
 # ------------------ Env / Config ------------------
 
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
+# Put it in .env or set it in your shell. Checked per LLM call, so the app imports without it.
 API_KEY = os.getenv("LLM_API_KEY")
-if not API_KEY:
-    raise RuntimeError("LLM_API_KEY not set. Put it in .env or set it in your shell.")
 
 MODEL = os.getenv("LLM_MODEL", "llama-3.1-8b-instant")
+# Larger model that low-confidence / unparsable / ask_clarify classifications escalate to ("" disables)
+ESCALATION_MODEL = os.getenv("LLM_ESCALATION_MODEL", "llama-3.3-70b-versatile")
 VISION_MODEL = "llava-1.5-7b-4096-preview"
-URL   = "https://api.groq.com/openai/v1/chat/completions"
+URL   = os.getenv("LLM_URL", "https://api.groq.com/openai/v1/chat/completions")
 
 USE_FAKE_TWILIO = os.getenv("USE_FAKE_TWILIO", "1") == "1"
 APP_BASE_URL    = os.getenv("APP_BASE_URL", "http://localhost:8000")
 FROM_NUMBER     = os.getenv("TWILIO_FROM_NUMBER", "+15550000000")
+FAKE_TWILIO_DELAY_MS = float(os.getenv("FAKE_TWILIO_DELAY_MS", "50"))  # between simulated status callbacks
+
+# Conversation memory budget (~4 chars per token). Turns beyond it are folded into a rolling summary.
+HISTORY_CHAR_BUDGET = int(os.getenv("HISTORY_CHAR_BUDGET", "4000"))
+SUMMARY_CHAR_BUDGET = int(os.getenv("SUMMARY_CHAR_BUDGET", "1000"))
+SUMMARY_TURN_CHARS  = 160
+
+# Webhook auto-classification runs in the background; texts from one phone arriving within
+# the window are classified together (never later than MAX_WAIT after the first one)
+CLASSIFY_WORKERS          = int(os.getenv("CLASSIFY_WORKERS", "4"))
+COALESCE_WINDOW_MS        = float(os.getenv("COALESCE_WINDOW_MS", "1500"))
+COALESCE_MAX_WAIT_MS      = float(os.getenv("COALESCE_MAX_WAIT_MS", "6000"))
 
 SYSTEM = (
     "You are PropAI, a property-management assistant.\n"
@@ -56,10 +92,47 @@ PM_SYSTEM = (
     "If asked to generate an image, ask for confirmation before proceeding.\n"
 )
 
+
 ALLOWED_CATS = {"maintenance", "rent", "general", "emergency", "other"}
 ALLOWED_PRI  = {"low", "normal", "high", "critical"}
 ALLOWED_ACT  = {"route_to_pm", "auto_reply", "escalate", "ask_clarify"}
 
+OPTOUT_KEYWORDS = {"STOP", "STOPALL", "UNSUBSCRIBE", "CANCEL", "END", "QUIT"}
+OPTIN_KEYWORDS  = {"START", "YES", "UNSTOP"}
+# Phrases that mean danger on their own. Bare words like "fire" or "flood" also turn up in
+# "fire alarm keeps chirping" or "flood light is out", so those are only hints: the LLM decides.
+HAZARD_TERMS    = ["gas leak", "leaking gas", "smell gas", "smells like gas", "carbon monoxide",
+                   "on fire", "caught fire", "burning smell"]
+HAZARD_HINTS    = ["fire", "flood", "flooded", "flooding", "smoke", "sparks"]
+SPAM_TERMS      = [
+    "limited-time offer", "limited time offer", "act now", "click here", "click the link",
+    "you've won", "you have won", "free gift", "gift card", "claim your", "pre-approved",
+    "lowest rates", "save on solar", "crypto", "bitcoin",
+]
+
+# /classify/batch fan-out
+CLASSIFY_BATCH_CONCURRENCY     = int(os.getenv("CLASSIFY_BATCH_CONCURRENCY", "8"))
+CLASSIFY_BATCH_MAX_CONCURRENCY = int(os.getenv("CLASSIFY_BATCH_MAX_CONCURRENCY", "32"))
+CLASSIFY_BATCH_MAX_ITEMS       = int(os.getenv("CLASSIFY_BATCH_MAX_ITEMS", "1000"))
+
+# Rule-based results at or above this confidence skip the LLM entirely
+FAST_PATH_THRESHOLD = float(os.getenv("FAST_PATH_THRESHOLD", "0.9"))
+
+# Model cascade: MODEL answers first; its answer is re-asked of ESCALATION_MODEL when the
+# validated confidence is below the threshold for its category (CASCADE_POLICY, e.g.
+# '{"emergency": 0.9, "other": 0}'), when its JSON is unusable, or when it wants to ask_clarify.
+CASCADE_THRESHOLD  = float(os.getenv("CASCADE_THRESHOLD", "0.7"))
+CASCADE_POLICY: Dict[str, float] = {"emergency": 0.85, "rent": 0.75, **json.loads(os.getenv("CASCADE_POLICY") or "{}")}
+CASCADE_ON_CLARIFY = os.getenv("CASCADE_ON_CLARIFY", "1") == "1"
+CASCADE_LOG_SIZE   = int(os.getenv("CASCADE_LOG_SIZE", "500"))
+CASCADE_LOG_PATH   = os.getenv("CASCADE_LOG_PATH")  # optional NDJSON file of every decision, for offline tuning
+
+# Bumps whenever the models, cascade policy or classification prompt change, so cached answers never leak across versions
+PROMPT_VERSION = hashlib.sha256(
+    f"{MODEL}\n{ESCALATION_MODEL}\n{json.dumps(CASCADE_POLICY, sort_keys=True)}\n"
+    f"{CASCADE_THRESHOLD}\n{CASCADE_ON_CLARIFY}\n{SYSTEM}".encode("utf-8")
+).hexdigest()[:12]
+
 # ------------------ Models (existing) ------------------
 
 class Context(BaseModel):
@@ -102,6 +175,19 @@ class ClassifyResponse(BaseModel):
             return 0.5
         return min(max(v, 0.0), 1.0)
 
+class ClassifyBatchRequest(BaseModel):
+    items: List[ClassifyRequest]
+    concurrency: Optional[int] = Field(None, ge=1, description="Max LLM calls in flight (capped server-side)")
+
+class ClassifyBatchItem(BaseModel):
+    index: int
+    ok: bool
+    result: Optional[ClassifyResponse] = None
+    error: Optional[str] = None
+
+class ClassifyBatchResponse(BaseModel):
+    results: List[ClassifyBatchItem]
+
 # ------------------ PM Chat Models ------------------
 
 class PmChatRequest(BaseModel):
@@ -154,6 +240,35 @@ class ThreadSummary(BaseModel):
     last_message: Optional[str] = None
     last_status: Optional[str] = None
     count: int
+    last_at: Optional[datetime] = None
+
+# Newest-first pages. Pass next_cursor as ?before= for older items, prev_cursor as ?after= for newer ones.
+class ThreadPage(BaseModel):
+    items: List[StoredMessage]
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+class ThreadListPage(BaseModel):
+    items: List[ThreadSummary]
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+class SearchHit(BaseModel):
+    sid: str
+    phone: str
+    direction: str
+    body: Optional[str] = None
+    ai_reply: Optional[str] = None
+    category: Optional[str] = None
+    priority: Optional[str] = None
+    status: Optional[str] = None
+    created_at: datetime
+    snippet: Optional[str] = None  # best-matching fragment, hits wrapped in <mark></mark>
+    score: float                   # bm25, lower is better
+
+class SearchPage(BaseModel):
+    items: List[SearchHit]
+    next_cursor: Optional[str] = None
 
 # ------------------ App + Memory ------------------
 
@@ -162,60 +277,217 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import os
 
-app = FastAPI(title="PropAI")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # the pooled LLM client is built on the first call and closed here
+    if not API_KEY:
+        log.warning("LLM_API_KEY not set; classification and /pm_chat will fail until it is")
+    # opening the store may migrate / backfill it: off the event loop, before the first request
+    await asyncio.to_thread(store.open)
+    await asyncio.to_thread(classify_cache.open)
+    STORE["optouts"].update(store.load_optouts())
+    classify_queue.start()
+    store.start()
+    metrics.start_profiler()
+    try:
+        yield
+    finally:
+        metrics.stop_profiler()
+        await classify_queue.stop()
+        await store.stop()  # flush buffered writes
+        await classify_cache.aclose()
+        await media_store.aclose()
+        await llm_client.shutdown()
+
+# Routes register on `router`; create_app() builds the app around it (`app` below is what uvicorn serves)
+router = APIRouter()
 
 # CORS (keep what you had, or this version)
 FRONTEND_ORIGIN = os.getenv("FRONTEND_ORIGIN")
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[o for o in [FRONTEND_ORIGIN, "http://localhost:3000", "http://127.0.0.1:3000"] if o],
-    allow_origin_regex=r"https://.*\.vercel\.app",
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
 
-@app.get("/healthz", include_in_schema=False)
+def create_app() -> FastAPI:
+    app = FastAPI(title="PropAI", lifespan=lifespan)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=[o for o in [FRONTEND_ORIGIN, "http://localhost:3000", "http://127.0.0.1:3000"] if o],
+        allow_origin_regex=r"https://.*\.vercel\.app",
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.add_middleware(CompressionMiddleware)
+    # request latency middleware + /metrics (and /metrics/profile when PROFILER_INTERVAL_MS is set)
+    metrics.install(app)
+    app.include_router(router)
+    # include other routers here
+    # from ai_chat import router as chat_router
+    # app.include_router(chat_router, prefix="/api")
+    return app
+
+@router.get("/healthz", include_in_schema=False)
 def healthz():
     return {"ok": True}
 
-# include your routers AFTER app is created
-# from ai_chat import router as chat_router
-# app.include_router(chat_router, prefix="/api")
-
-# Full in-memory conversation history: { "TenantName:Unit" : [ {role, content}, ... ] }
-chat_histories: Dict[str, List[Dict[str, str]]] = defaultdict(list)
+# Durable backing store for everything below (STORE_BACKEND=sqlite|memory, see message_store.py).
+# Nothing touches the database here: the lifespan opens it, or the first read / write does.
+store = open_store()
+
+def _load_conversation(conv_id: str) -> List[Dict[str, str]]:
+    row = store.load_conversation(conv_id)
+    if not row:
+        return []
+    if row["summary"]:
+        chat_summaries[conv_id] = row["summary"]
+    return row["turns"]
+
+def _thread_key(m: StoredMessage) -> Tuple[datetime, str]:
+    # threads are kept in (created_at, sid) order; it is also their page keyset
+    return m.created_at, m.sid
+
+def _load_thread(phone: str) -> List[StoredMessage]:
+    msgs = sorted((StoredMessage(**r) for r in store.load_thread(phone)), key=_thread_key)
+    for m in msgs:
+        STORE["messages"][m.sid] = m
+    return msgs
+
+def _forget_thread(phone: str, msgs: List[StoredMessage]):
+    for m in msgs:
+        STORE["messages"].pop(m.sid, None)
+    _history_pos.pop(phone, None)
+
+# Bounded conversation history: { "TenantName:Unit" : [ {role, content}, ... ] }, recent ones in memory
+chat_histories: Dict[str, List[Dict[str, str]]] = LRUCache(
+    STORE_HISTORY_CACHE_SIZE if store.persistent else 0, _load_conversation,
+    can_evict=lambda conv_id: not store.conversation_dirty(conv_id),
+    on_evict=lambda conv_id, _: chat_summaries.pop(conv_id, None),
+)
+# Rolling summary of turns folded out of chat_histories: { "TenantName:Unit" : "role: text\n..." }
+chat_summaries: Dict[str, str] = {}
+# phone -> how much of STORE["threads"][phone] is already in its conversation history
+_history_pos: Dict[str, int] = {}
 
-# Phone threads & messages
+# Phone threads & messages. Threads are an LRU over the store; messages indexes the cached threads.
 STORE: Dict[str, Any] = {
     "messages": {},         # sid -> StoredMessage
-    "threads": defaultdict(list),   # phone -> [StoredMessage]
-    "optouts": set(),       # phone numbers that texted STOP
+    "threads": LRUCache(    # phone -> [StoredMessage]
+        STORE_THREAD_CACHE_SIZE if store.persistent else 0, _load_thread,
+        can_evict=lambda phone: not store.thread_dirty(phone), on_evict=_forget_thread,
+    ),
+    "optouts": set(),                   # phone numbers that texted STOP (loaded in the lifespan)
     "from_number": FROM_NUMBER,
-    "contacts": {},         # phone -> Context (so webhooks have context)
+    "contacts": LRUCache(   # phone -> Context (so webhooks have context), read through from the store
+        CONTACT_CACHE_SIZE if store.persistent else 0, store.load_contact,
+        can_evict=lambda phone: not store.contact_dirty(phone),
+    ),
 }
 
+def _get_message(sid: str) -> Optional[StoredMessage]:
+    msg = STORE["messages"].get(sid)
+    if msg is None:
+        phone = store.phone_for_sid(sid)
+        if phone is not None:
+            STORE["threads"][phone]  # loads and indexes the thread
+            msg = STORE["messages"].get(sid)
+    return msg
+
+def _property_for(phone: str) -> str:
+    return analytics.property_of(STORE["contacts"].get(phone))
+
+# Bumped on every message write: the ETags of /threads, /threads/{phone} and /messages/{sid}
+thread_versions = Versions()
+
+def _phone_of(msg: StoredMessage) -> str:
+    return msg.to if msg.direction == "outbound" else msg.from_
+
+def _save_message(msg: StoredMessage):
+    phone = _phone_of(msg)
+    store.save_message(phone, msg)
+    thread_versions.bump(phone)
+
+# Content-addressed classification cache (thread + context + PROMPT_VERSION)
+classify_cache = ClassificationCache()
+
+# Recent inbound reports per property, grouped into incidents (near-duplicates reuse classifications)
+incident_index = IncidentIndex()
+
 def _conv_id(ctx: Context) -> str:
     return f"{ctx.tenant_name}:{ctx.unit}"
 
 def _thread_id_from_phone(phone: str) -> str:
     return phone
 
+# ------------------ Conversation History ------------------
+
+def _fold_into_summary(conv_id: str, turns: List[Dict[str, str]]):
+    # extractive summary: one clipped line per folded turn, newest kept when over budget
+    lines = [chat_summaries.get(conv_id, "")]
+    for m in turns:
+        text = m["content"]
+        if len(text) > SUMMARY_TURN_CHARS:
+            text = text[:SUMMARY_TURN_CHARS].rstrip() + "…"
+        lines.append(f"{m['role']}: {text}")
+    summary = "\n".join(l for l in lines if l)
+    if len(summary) > SUMMARY_CHAR_BUDGET:
+        summary = summary[-SUMMARY_CHAR_BUDGET:]
+        summary = summary.split("\n", 1)[-1]  # drop the partial first line
+    chat_summaries[conv_id] = summary
+
+def _append_history(conv_id: str, role: str, content: str):
+    turns = chat_histories[conv_id]
+    turns.append({"role": role, "content": content})
+    total = sum(len(m["content"]) for m in turns)
+    folded = []
+    # always keep the newest turn, even if it alone exceeds the budget
+    while len(turns) > 1 and total > HISTORY_CHAR_BUDGET:
+        old = turns.pop(0)
+        total -= len(old["content"])
+        folded.append(old)
+    if folded:
+        _fold_into_summary(conv_id, folded)
+    store.save_conversation(conv_id, turns, chat_summaries.get(conv_id))
+
+def _new_user_turns(conv_id: str, thread: List[str]) -> List[str]:
+    """
+    Clients resend the whole chronological thread; return only the messages
+    after the longest run that already ends our recorded user turns.
+    """
+    prior = [m["content"] for m in chat_histories.get(conv_id, []) if m["role"] == "user"]
+    for k in range(min(len(prior), len(thread)), 0, -1):
+        tail = prior[-k:]
+        for j in range(len(thread) - k, -1, -1):
+            if thread[j:j + k] == tail:
+                return thread[j + k:]
+    return thread
+
+def _history_prompt(conv_id: str) -> str:
+    recent = "\n".join(f"{m['role']}: {m['content']}" for m in chat_histories[conv_id])
+    summary = chat_summaries.get(conv_id)
+    if summary:
+        return f"Summary of earlier conversation:\n{summary}\n\nRecent conversation:\n{recent}"
+    return f"Full conversation so far:\n{recent}"
+
 # ------------------ LLM Helpers (existing) ------------------
 
-async def call_groq(messages: List[Dict], model: str = MODEL) -> str:
+def _llm_headers() -> Dict[str, str]:
+    if not API_KEY:
+        raise HTTPException(status_code=500, detail="LLM_API_KEY not set.")
+    return {"Authorization": f"Bearer {API_KEY}", "Content-Type": "application/json"}
+
+async def call_groq(messages: List[Dict], model: str = MODEL, priority: int = INTERACTIVE) -> str:
     payload = {
         "model": model,
         "messages": messages,
         "temperature": 0.2,
         "top_p": 0.9,
-        "response_format": {"type": "json_object"} if model == MODEL else None,  # No JSON for vision
+        "response_format": {"type": "json_object"} if model != VISION_MODEL else None,  # No JSON for vision
     }
-    headers = {"Authorization": f"Bearer {API_KEY}", "Content-Type": "application/json"}
-    async with httpx.AsyncClient(timeout=60) as client:
-        r = await client.post(URL, headers=headers, json=payload)
-        r.raise_for_status()
-        return r.json()["choices"][0]["message"]["content"]
+    headers = _llm_headers()
+    try:
+        r, data = await llm_client.post_chat(URL, headers, payload, priority)
+    except llm_client.LLMUnavailable as e:
+        raise HTTPException(status_code=503, detail="LLM provider is busy, try again shortly.", headers=e.headers) from e
+    r.raise_for_status()
+    return data["choices"][0]["message"]["content"]
 
 def repair_json(raw: str, ctx: Context) -> Dict:
     # Strip common wrappers and parse
@@ -223,6 +495,7 @@ def repair_json(raw: str, ctx: Context) -> Dict:
     try:
         obj = json.loads(s)
     except Exception as e:
+        metrics.REPAIR_JSON_FAILURES.inc()
         raise HTTPException(status_code=502, detail=f"LLM returned invalid JSON: {e}")
 
     # Ensure required keys exist with defaults
@@ -246,61 +519,272 @@ def repair_json(raw: str, ctx: Context) -> Dict:
 
     # Emergency auto-guard (extra safety)
     lower_blob = (json.dumps(ent, ensure_ascii=False) + " " + json.dumps(obj, ensure_ascii=False)).lower()
-    hazard_terms = ["gas leak", "smell gas", "flood", "flooding", "fire", "burning smell", "carbon monoxide"]
-    if any(term in lower_blob for term in hazard_terms):
+    if any(term in lower_blob for term in HAZARD_TERMS):
         obj["category"] = "emergency"
         obj["priority"] = "critical"
         obj["action"] = "escalate"
 
     return obj
 
+# ------------------ Model Cascade ------------------
+
+# Recent decisions (newest last) and running totals, served by /classify/cascade
+CASCADE_LOG: deque = deque(maxlen=CASCADE_LOG_SIZE)
+CASCADE_STATS: Dict[str, int] = defaultdict(int)
+CASCADE_DECISIONS = metrics.REGISTRY.counter(
+    "classify_cascade_total", "Cascade decisions by outcome and first-tier category.", ("decision", "category"),
+)
+
+def _escalation_reason(obj: Optional[Dict[str, Any]]) -> Optional[str]:
+    if obj is None:
+        return "invalid_json"
+    if CASCADE_ON_CLARIFY and obj["action"] == "ask_clarify":
+        return "ask_clarify"
+    if obj["confidence"] < CASCADE_POLICY.get(obj["category"], CASCADE_THRESHOLD):
+        return "low_confidence"
+    return None
+
+def _record_cascade(entry: Dict[str, Any]):
+    CASCADE_LOG.append(entry)
+    CASCADE_STATS[entry["decision"]] += 1
+    CASCADE_DECISIONS.inc(entry["decision"], entry.get("category") or "none")
+    if CASCADE_LOG_PATH:
+        with open(CASCADE_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+async def _validated(msgs: List[Dict], ctx: Context, model: str, priority: int) -> Dict[str, Any]:
+    # repair_json + ClassifyResponse validators, so thresholds see the clamped confidence/allowed labels
+    obj = repair_json(await call_groq(msgs, model=model, priority=priority), ctx)
+    try:
+        checked = ClassifyResponse(**obj)
+    except ValidationError as e:
+        metrics.REPAIR_JSON_FAILURES.inc()
+        raise HTTPException(status_code=502, detail=f"LLM returned an invalid classification: {e}")
+    return {**obj, **checked.dict(include={"category", "priority", "action", "confidence"})}
+
+async def cascade_classify(msgs: List[Dict], ctx: Context, priority: int = INTERACTIVE) -> Dict[str, Any]:
+    """
+    Classify with MODEL, escalating to ESCALATION_MODEL when the first answer
+    does not clear the policy. Every call records one decision.
+    """
+    started = time.perf_counter()
+    first: Optional[Dict[str, Any]] = None
+    try:
+        first = await _validated(msgs, ctx, MODEL, priority)
+    except HTTPException as e:
+        if not ESCALATION_MODEL or e.status_code != 502:
+            raise
+    reason = _escalation_reason(first)
+    entry: Dict[str, Any] = {
+        "at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "model": MODEL,
+        "category": first and first["category"],
+        "action": first and first["action"],
+        "confidence": first and first["confidence"],
+        "threshold": CASCADE_POLICY.get(first["category"], CASCADE_THRESHOLD) if first else None,
+        "reason": reason,
+    }
+    if reason is None or not ESCALATION_MODEL:
+        _record_cascade({**entry, "decision": "accepted", "latency_ms": round((time.perf_counter() - started) * 1000, 1)})
+        return first
+
+    # a possible emergency is re-checked ahead of everything else
+    if first and first["category"] == "emergency":
+        priority = URGENT
+    try:
+        final = await _validated(msgs, ctx, ESCALATION_MODEL, priority)
+    except Exception as e:
+        _record_cascade({**entry, "decision": "escalation_failed", "error": str(e)[:200],
+                         "latency_ms": round((time.perf_counter() - started) * 1000, 1)})
+        if first is None:
+            raise
+        return first  # the cheap answer beats no answer
+    _record_cascade({
+        **entry, "decision": "escalated", "escalated_to": ESCALATION_MODEL,
+        "final_category": final["category"], "final_action": final["action"], "final_confidence": final["confidence"],
+        "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+    })
+    return final
+
+# ------------------ Rule-based Fast Path ------------------
+
+def _alternation(terms) -> str:
+    # longest first so "flooding" wins over "flood"
+    return "|".join(re.escape(t) for t in sorted(terms, key=len, reverse=True))
+
+# One compiled matcher for every rule; the named group that fired identifies the rule.
+# A bare YES is only an opt-in for numbers that already opted out, so it is left to the LLM here;
+# START / UNSTOP only settle a message that actually resubscribed someone (see _fast_path).
+FAST_PATH_RE = re.compile(
+    rf"(?P<optout>\A\s*(?:{_alternation(OPTOUT_KEYWORDS)})\s*[.!]*\s*\Z)"
+    rf"|(?P<optin>\A\s*(?:{_alternation(OPTIN_KEYWORDS - {'YES'})})\s*[.!]*\s*\Z)"
+    rf"|(?P<hazard>\b(?:{_alternation(HAZARD_TERMS)})\b)"
+    rf"|(?P<spam>\b(?:{_alternation(SPAM_TERMS)})\b)",
+    re.IGNORECASE,
+)
+HAZARD_HINT_RE = re.compile(rf"\b(?:{_alternation(HAZARD_HINTS)})\b", re.IGNORECASE)
+
+# How /classify and webhook classifications were answered: fast-path rule, cache, near-duplicate or LLM
+CLASSIFY_STATS: Dict[str, Any] = {"total": 0, "llm": 0, "cache": 0, "similar": 0, "rules": defaultdict(int)}
+
+def fast_classify(text: str, ctx: Context):
+    """
+    Deterministic pre-classifier. Returns (rule, obj) where obj has the
+    ClassifyResponse fields, or (None, None) when no rule matches.
+    """
+    hits: Dict[str, set] = defaultdict(set)
+    for m in FAST_PATH_RE.finditer(text or ""):
+        hits[m.lastgroup].add(m.group(0).strip().lower())
+    if not hits:
+        return None, None
+
+    entities: Dict[str, Any] = {"tenant_name": ctx.tenant_name, "unit": ctx.unit, "address": ctx.address}
+    if "optout" in hits:
+        rule, obj = "optout", {
+            "category": "other", "priority": "low", "action": "auto_reply", "confidence": 0.99,
+            "reply": "You're unsubscribed and won't receive more messages. Reply START to resubscribe.",
+        }
+    elif "optin" in hits:
+        rule, obj = "optin", {
+            "category": "other", "priority": "low", "action": "auto_reply", "confidence": 0.99,
+            "reply": "You're resubscribed and will receive messages again.",
+        }
+    elif "hazard" in hits:
+        entities["hazard"] = sorted(hits["hazard"])
+        hotline = ctx.hotline or "our maintenance hotline"
+        rule, obj = "hazard", {
+            "category": "emergency", "priority": "critical", "action": "escalate", "confidence": 0.95,
+            "reply": f"If you are in immediate danger, leave the unit and call 911, then call {hotline}. We're escalating this now.",
+        }
+    else:
+        # one spam phrase is suggestive, two or more is conclusive
+        rule, obj = "spam", {
+            "category": "other", "priority": "low", "action": "route_to_pm",
+            "confidence": round(min(0.6 + 0.15 * len(hits["spam"]), 0.95), 2),
+            "reply": "Thanks—this number is for tenant requests only.",
+        }
+    obj["entities"] = entities
+    return rule, obj
+
+def _fast_path(text: str, ctx: Context, resubscribed: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    The rule-based answer when it is confident enough to skip the LLM. `resubscribed` says the
+    message took its sender off the opt-out list; a START from anyone else is not an opt-in.
+    """
+    rule, obj = fast_classify(text, ctx)
+    if obj is None or obj["confidence"] < FAST_PATH_THRESHOLD:
+        return None
+    if rule == "optin" and not resubscribed:
+        return None
+    CLASSIFY_STATS["total"] += 1
+    CLASSIFY_STATS["rules"][rule] += 1
+    return obj
+
+def _webhook_priority(text: str) -> int:
+    # hazard wording the rules didn't settle on their own still goes ahead of everything else;
+    # a bare "fire" / "flood" may be nothing, so it only gets ahead of the background backlog
+    if any(m.lastgroup == "hazard" for m in FAST_PATH_RE.finditer(text)):
+        return URGENT
+    if HAZARD_HINT_RE.search(text):
+        return INTERACTIVE
+    return BACKGROUND
+
+def _count_classification(source: str):
+    CLASSIFY_STATS["total"] += 1
+    CLASSIFY_STATS[source] += 1
+
 # ------------------ PM Chat Route ------------------
 
-@app.post("/pm_chat", response_model=PmChatResponse)
-async def pm_chat(req: PmChatRequest = Body(...)):
+async def _pm_chat_messages(req: PmChatRequest):
     if not req.message.strip() and not req.image_url:
         raise HTTPException(status_code=400, detail="Message or image_url required.")
 
     model = VISION_MODEL if req.image_url else MODEL
 
     if req.image_url:
+        # fetched once, downscaled and inlined (or the cached description of it), see media.py
         user_content = [
             {"type": "text", "text": req.message},
-            {"type": "image_url", "image_url": {"url": req.image_url}},
+            *await media_store.image_parts(req.image_url, model, call_groq),
         ]
     else:
         user_content = req.message
 
     msgs = [
-        {"role": "system", "content": PM_SYSTEM + f"\n\nContext (use if relevant): {req.context.json()}"},
+        {"role": "system", "content": PM_SYSTEM + f"\n\nContext (use if relevant): {req.context.model_dump_json()}"},
         {"role": "user", "content": user_content},
     ]
+    return model, msgs
+
+@router.post("/pm_chat", response_model=PmChatResponse)
+async def pm_chat(req: PmChatRequest = Body(...)):
+    model, msgs = await _pm_chat_messages(req)
 
     try:
         reply = await call_groq(msgs, model=model)
+    except HTTPException:
+        raise  # 503 + Retry-After when the provider stays rate limited
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"LLM error: {str(e)}")
 
     return PmChatResponse(reply=reply)
 
+@router.post("/pm_chat/stream")
+async def pm_chat_stream(request: Request, req: PmChatRequest = Body(...)):
+    """
+    Same as /pm_chat, relayed token-by-token as Server-Sent Events:
+    `data: {"delta": ...}` frames, then `event: done` with the full reply
+    (or `event: error`). The upstream request is dropped if the client leaves.
+    """
+    model, msgs = await _pm_chat_messages(req)
+    payload = {"model": model, "messages": msgs, "temperature": 0.2, "top_p": 0.9}
+    headers = _llm_headers()
+
+    async def events():
+        parts: List[str] = []
+        try:
+            async with aclosing(llm_client.stream_chat(URL, headers, payload)) as deltas:
+                async for delta in deltas:
+                    if await request.is_disconnected():
+                        return
+                    parts.append(delta)
+                    yield llm_client.sse({"delta": delta})
+        except Exception as e:
+            yield llm_client.sse({"detail": f"LLM error: {str(e)}"}, event="error")
+            return
+        yield llm_client.sse({"reply": "".join(parts)}, event="done")
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=llm_client.SSE_HEADERS)
+
 # ------------------ Existing Routes ------------------
 
-@app.post("/classify", response_model=ClassifyResponse)
-async def classify(req: ClassifyRequest = Body(...)):
+async def _classify(req: ClassifyRequest, fresh: bool = False, priority: int = INTERACTIVE) -> Dict[str, Any]:
     if not req.thread or not any((m or "").strip() for m in req.thread):
         raise HTTPException(status_code=400, detail="`thread` must contain at least one non-empty message.")
 
     conv_id = _conv_id(req.context)
+    thread = [m.strip() for m in req.thread if m and m.strip()]
 
-    for msg in req.thread:
-        if msg and msg.strip():
-            chat_histories[conv_id].append({"role": "user", "content": msg.strip()})
+    fast = _fast_path(thread[-1], req.context)
+    if fast is not None:
+        for msg in _new_user_turns(conv_id, thread):
+            _append_history(conv_id, "user", msg)
+        _append_history(conv_id, "assistant", fast["reply"])
+        return fast
 
-    history_text = "\n".join(f"{m['role']}: {m['content']}" for m in chat_histories[conv_id])
+    cache_key = make_key(req.thread, req.context.model_dump(), PROMPT_VERSION)
+    if not fresh:
+        cached = await classify_cache.get(cache_key)
+        if cached is not None:
+            _count_classification("cache")
+            return cached
+
+    for msg in _new_user_turns(conv_id, thread):
+        _append_history(conv_id, "user", msg)
 
     user_content = (
-        f"Full conversation so far:\n{history_text}\n\n"
-        f"Context (REQUIRED JSON):\n{req.context.json()}\n\n"
+        f"{_history_prompt(conv_id)}\n\n"
+        f"Context (REQUIRED JSON):\n{req.context.model_dump_json()}\n\n"
         "IMPORTANT:\n- Output STRICT JSON only."
     )
     msgs = [
@@ -308,18 +792,108 @@ async def classify(req: ClassifyRequest = Body(...)):
         {"role": "user", "content": user_content},
     ]
 
-    raw = await call_groq(msgs)
-    obj = repair_json(raw, req.context)
+    obj = await cascade_classify(msgs, req.context, priority)
+    _count_classification("llm")
+    classify_cache.set(cache_key, obj)
+
+    _append_history(conv_id, "assistant", obj["reply"])
+    return obj
+
+@router.post("/classify", response_model=ClassifyResponse)
+async def classify(
+    req: ClassifyRequest = Body(...),
+    fresh: bool = Query(False, description="Bypass the classification cache and ask the LLM again"),
+):
+    return ClassifyResponse(**await _classify(req, fresh))
+
+@router.post("/classify/batch", response_model=ClassifyBatchResponse)
+async def classify_batch(
+    req: ClassifyBatchRequest = Body(...),
+    fresh: bool = Query(False, description="Bypass the classification cache for every item"),
+    stream: bool = Query(False, description="Stream results as NDJSON, in input order"),
+):
+    """
+    Classify many threads with at most `concurrency` LLM calls in flight.
+    Identical items are classified once; each item gets its own result or error.
+    """
+    if len(req.items) > CLASSIFY_BATCH_MAX_ITEMS:
+        raise HTTPException(400, f"At most {CLASSIFY_BATCH_MAX_ITEMS} items per batch.")
+    limit = min(req.concurrency or CLASSIFY_BATCH_CONCURRENCY, CLASSIFY_BATCH_MAX_CONCURRENCY)
+    sem = asyncio.Semaphore(limit)
+    # items of the same conversation run in order so their shared history stays coherent
+    conv_locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    async def run_one(item: ClassifyRequest) -> Dict[str, Any]:
+        async with conv_locks[_conv_id(item.context)], sem:
+            return await _classify(item, fresh, BULK)
+
+    tasks: Dict[str, asyncio.Task] = {}
+    order: List[asyncio.Task] = []
+    for item in req.items:
+        key = make_key(item.thread, item.context.model_dump(), PROMPT_VERSION)
+        if key not in tasks:
+            tasks[key] = asyncio.create_task(run_one(item))
+        order.append(tasks[key])
+
+    async def result(i: int, task: asyncio.Task) -> ClassifyBatchItem:
+        try:
+            return ClassifyBatchItem(index=i, ok=True, result=ClassifyResponse(**await task))
+        except HTTPException as e:
+            return ClassifyBatchItem(index=i, ok=False, error=str(e.detail))
+        except Exception as e:
+            return ClassifyBatchItem(index=i, ok=False, error=f"LLM error: {str(e)}")
+
+    if not stream:
+        return ClassifyBatchResponse(results=[await result(i, t) for i, t in enumerate(order)])
 
-    chat_histories[conv_id].append({"role": "assistant", "content": obj["reply"]})
+    async def lines():
+        try:
+            for i, t in enumerate(order):
+                yield (await result(i, t)).model_dump_json() + "\n"
+        finally:
+            # client went away mid-stream: stop the remaining LLM calls
+            for t in tasks.values():
+                t.cancel()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@router.get("/classify/cache/stats")
+def classify_cache_stats():
+    return {**classify_cache.stats(), "version": PROMPT_VERSION}
+
+@router.get("/classify/stats")
+def classify_stats():
+    total = CLASSIFY_STATS["total"]
+    return {
+        "total": total,
+        "llm": CLASSIFY_STATS["llm"],
+        "cache": CLASSIFY_STATS["cache"],
+        "similar": CLASSIFY_STATS["similar"],
+        "rules": dict(CLASSIFY_STATS["rules"]),
+        "llm_free_share": ((total - CLASSIFY_STATS["llm"]) / total) if total else 0.0,
+        "fast_path_threshold": FAST_PATH_THRESHOLD,
+    }
 
-    return ClassifyResponse(**obj)
+@router.get("/classify/cascade")
+def classify_cascade(recent: int = Query(50, ge=0, le=1000)):
+    """Cascade policy, decision totals and the most recent decisions (for threshold tuning)."""
+    decided = sum(CASCADE_STATS.values())
+    return {
+        "model": MODEL,
+        "escalation_model": ESCALATION_MODEL or None,
+        "default_threshold": CASCADE_THRESHOLD,
+        "policy": CASCADE_POLICY,
+        "escalate_on_clarify": CASCADE_ON_CLARIFY,
+        "decisions": dict(CASCADE_STATS),
+        "escalation_rate": (CASCADE_STATS["escalated"] / decided) if decided else 0.0,
+        "recent": list(CASCADE_LOG)[-recent:] if recent else [],
+    }
 
-@app.get("/")
+@router.get("/")
 def health():
     return {"ok": True, "model": MODEL, "fake_twilio": USE_FAKE_TWILIO}
 
-@app.get("/examples")
+@router.get("/examples")
 def examples():
     base_ctx = {
         "tenant_name": "John Doe",
@@ -353,36 +927,120 @@ def examples():
         }
     }
 
-@app.get("/history/{tenant}/{unit}")
-def get_history(tenant: str, unit: str):
+@router.get("/history/{tenant}/{unit}")
+async def get_history(tenant: str, unit: str):
+    """The recent turns, as before; turns folded out of them are at /history/.../summary."""
+    return chat_histories.get(f"{tenant}:{unit}", [])
+
+@router.get("/history/{tenant}/{unit}/summary")
+async def get_history_summary(tenant: str, unit: str):
     conv_id = f"{tenant}:{unit}"
-    return chat_histories.get(conv_id, [])
+    return {
+        "summary": chat_summaries.get(conv_id),
+        "messages": chat_histories.get(conv_id, []),
+    }
 
 # ------------------ Contacts (map phone -> Context) ------------------
 
-@app.post("/contacts/upsert")
-def upsert_contact(phone: str, context: Context):
+@router.post("/contacts/upsert")
+async def upsert_contact(phone: str, context: Context):
     """
     Register/overwrite the Context for a tenant phone number so
     /twilio/incoming can auto-classify with the right details.
     """
-    STORE["contacts"][phone] = context.dict()
+    STORE["contacts"][phone] = context.model_dump()
+    store.save_contact(phone, STORE["contacts"][phone])
     return {"ok": True}
 
+async def _write_contacts(rows):
+    await store.write_contacts(rows)
+    for phone, contact in rows:
+        if store.persistent:
+            STORE["contacts"].pop(phone, None)  # invalidate; the next read loads the new row
+        else:
+            STORE["contacts"][phone] = contact
+
+@router.post("/contacts/bulk")
+async def bulk_contacts(
+    request: Request,
+    format: Optional[str] = Query(None, pattern="^(csv|ndjson)$", description="Defaults from Content-Type"),
+):
+    """
+    Upsert many contacts from a streamed CSV (header row) or NDJSON body with
+    phone, tenant_name, unit, address and optional hotline/portal_url/property_name.
+    Rows are written CONTACTS_BULK_CHUNK at a time, one transaction each;
+    bad rows are reported and skipped.
+    """
+    fmt = bulk_format(request.headers.get("content-type"), format)
+    report = BulkReport(done="upserted", key="phone")
+    chunk = []
+    async for line_no, phone, contact, error in iter_contact_rows(request.stream(), fmt):
+        report.rows += 1
+        if error:
+            report.error(line_no, error, phone)
+            continue
+        chunk.append((phone, contact))
+        if len(chunk) >= CONTACTS_BULK_CHUNK:
+            await _write_contacts(chunk)
+            report.done += len(chunk)
+            chunk = []
+    if chunk:
+        await _write_contacts(chunk)
+        report.done += len(chunk)
+    return report.result()
+
 # ------------------ Fake Twilio (inbound, outbound, status) ------------------
 
+# In-process event bus. "message.status" fires on every applied status transition
+# with {sid, phone, status, previous, source}; "message.created" and "message.classified"
+# carry {sid, phone, message}.
+bus = EventBus()
+
+# Dashboard change feed (GET /events) over everything on the bus
+feed = ChangeFeed(_property_for)
+for _topic in FEED_TOPICS:
+    bus.subscribe(_topic, feed.publish)
+
+# Lifecycle order; callbacks can arrive out of order, so a message never moves backwards
+# (e.g. a late "sent" after "delivered"). Unknown statuses are always applied.
+STATUS_RANK = {
+    "accepted": 0, "queued": 0, "sending": 1, "sent": 2, "receiving": 1, "received": 2,
+    "delivered": 3, "undelivered": 3, "failed": 3, "read": 4,
+}
+
+async def set_message_status(sid: str, status: str, source: str = "internal") -> bool:
+    msg = _get_message(sid)
+    if msg is None:
+        return False
+    previous = msg.status
+    if status == previous:
+        return False
+    old_rank, new_rank = STATUS_RANK.get(previous), STATUS_RANK.get(status)
+    if old_rank is not None and new_rank is not None and new_rank < old_rank:
+        return False
+    msg.status = status
+    _save_message(msg)
+    phone = _phone_of(msg)
+    await bus.publish("message.status", {
+        "sid": sid, "phone": phone, "status": status, "previous": previous, "source": source,
+    })
+    return True
+
+# keep references so fire-and-forget tasks are not garbage-collected mid-flight
+_background_tasks: set = set()
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
 async def _simulate_status_callbacks(msg_sid: str):
-    # tiny simulation of send->delivered callbacks back to our own /twilio/status
-    await asyncio.sleep(0.05)
-    await _post_local("/twilio/status", {"MessageSid": msg_sid, "MessageStatus": "sent", "SmsStatus": "sent"})
-    await asyncio.sleep(0.05)
-    await _post_local("/twilio/status", {"MessageSid": msg_sid, "MessageStatus": "delivered", "SmsStatus": "delivered"})
-
-async def _post_local(path: str, json_body: Dict[str, Any]):
-    # internal http (avoids net; uses ASGI client)
-    from fastapi.testclient import TestClient
-    client = TestClient(app)
-    client.post(path, json=json_body)
+    # tiny simulation of the provider's queued -> sent -> delivered callbacks
+    await asyncio.sleep(FAKE_TWILIO_DELAY_MS / 1000)
+    await set_message_status(msg_sid, "sent", source="fake_twilio")
+    await asyncio.sleep(FAKE_TWILIO_DELAY_MS / 1000)
+    await set_message_status(msg_sid, "delivered", source="fake_twilio")
 
 def _store_outbound(to: str, body: Optional[str], media_urls: Optional[List[HttpUrl]], metadata: Optional[Dict[str, Any]]) -> StoredMessage:
     sid = f"SM{uuid.uuid4().hex[:30]}"
@@ -396,11 +1054,18 @@ def _store_outbound(to: str, body: Optional[str], media_urls: Optional[List[Http
         status="queued",
         metadata=metadata or {},
     )
+    thread = STORE["threads"][to]
+    since = waiting_since(thread)
+    if since is not None:
+        delta = Rollups()
+        delta.add_response(since, _property_for(to), (msg.created_at - since).total_seconds())
+        store.bump_rollups(delta)
+    insort(thread, msg, key=_thread_key)
     STORE["messages"][sid] = msg
-    STORE["threads"][to].append(msg)
+    _save_message(msg)
     return msg
 
-def _store_inbound(payload: WebhookInbound) -> StoredMessage:
+def _store_inbound(payload: WebhookInbound, metadata: Optional[Dict[str, Any]] = None) -> StoredMessage:
     sid = payload.MessageSid or f"SM{uuid.uuid4().hex[:30]}"
     msg = StoredMessage(
         sid=sid,
@@ -410,18 +1075,29 @@ def _store_inbound(payload: WebhookInbound) -> StoredMessage:
         body=payload.Body,
         media_urls=[str(payload.MediaUrl0)] if payload.MediaUrl0 else [],
         status=payload.SmsStatus or "received",
-        metadata={},
+        metadata=dict(metadata or {}),
     )
+    prop = _property_for(payload.From)
+    incident = incident_index.add(sid, prop, payload.From, payload.Body, msg.created_at)
+    if incident:
+        msg.metadata["incident"] = incident
+    insort(STORE["threads"][payload.From], msg, key=_thread_key)
     STORE["messages"][sid] = msg
-    STORE["threads"][payload.From].append(msg)
+    _save_message(msg)
+    store.bump_rollups(message_delta(prop, None, msg))
     return msg
 
-def _apply_opt_out_logic(text: str, sender: str):
+def _apply_opt_out_logic(text: str, sender: str) -> bool:
+    """Update the opt-out list; True when this message resubscribed `sender`."""
     t = (text or "").strip().upper()
-    if t in {"STOP", "STOPALL", "UNSUBSCRIBE", "CANCEL", "END", "QUIT"}:
+    if t in OPTOUT_KEYWORDS:
         STORE["optouts"].add(sender)
-    if t in {"START", "YES", "UNSTOP"} and sender in STORE["optouts"]:
+        store.save_optout(sender, True)
+    if t in OPTIN_KEYWORDS and sender in STORE["optouts"]:
         STORE["optouts"].discard(sender)
+        store.save_optout(sender, False)
+        return True
+    return False
 
 async def _auto_classify_and_attach(phone: str, new_msg: StoredMessage):
     # find context: from contact book
@@ -431,6 +1107,8 @@ async def _auto_classify_and_attach(phone: str, new_msg: StoredMessage):
         return
 
     ctx = Context(**ctx_dict)
+    # the thread may have been evicted and reloaded since the message was queued
+    new_msg = _get_message(new_msg.sid) or new_msg
 
     # Build conversation for this phone for the LLM
     # Use only tenant (user) messages for the history that the LLM sees
@@ -439,16 +1117,48 @@ async def _auto_classify_and_attach(phone: str, new_msg: StoredMessage):
     if not thread_texts:
         return
 
-    # Call your existing /classify pipeline directly
+    # Append incrementally: only inbound messages not yet in the history
+    # (the phone's backlog the first time, afterwards the latest burst)
     conv_id = _conv_id(ctx)
-    for t in thread_texts:
-        if t.strip():
-            chat_histories[conv_id].append({"role": "user", "content": t.strip()})
+    thread = STORE["threads"][phone]
+    pos = _history_pos.get(phone)
+    if pos is None:
+        # first look at this phone since start/eviction: skip what a persisted history already holds
+        new_texts = _new_user_turns(conv_id, [t.strip() for t in thread_texts])
+    else:
+        new_texts = [m.body.strip() for m in thread[pos:] if m.direction == "inbound" and (m.body or "").strip()]
+    for text in new_texts:
+        _append_history(conv_id, "user", text)
+    _history_pos[phone] = len(thread)
+
+    # obvious messages (STOP, hazards, spam) never reach the LLM
+    obj = _fast_path(new_msg.body or "", ctx, resubscribed=bool(new_msg.metadata.get("resubscribed")))
+    if obj is not None:
+        _append_history(conv_id, "assistant", obj["reply"])
+        await _attach_classification(new_msg, obj)
+        return
+
+    cache_key = make_key(thread_texts, ctx.model_dump(), PROMPT_VERSION)
+    obj = await classify_cache.get(cache_key)
+    if obj is not None:
+        _count_classification("cache")
+        await _attach_classification(new_msg, obj)
+        return
 
-    history_text = "\n".join(f"{m['role']}: {m['content']}" for m in chat_histories[conv_id])
+    # another tenant at the same property just reported the same thing: answer like we answered them
+    similar = incident_index.reusable(new_msg.sid, _property_for(phone))
+    if similar is not None:
+        sid, _, obj = similar
+        obj = adapt(obj, ctx.model_dump(), sid)
+        _count_classification("similar")
+        _append_history(conv_id, "assistant", obj["reply"])
+        await _attach_classification(new_msg, obj)
+        return
+
+    # Call your existing /classify pipeline directly
     user_content = (
-        f"Full conversation so far:\n{history_text}\n\n"
-        f"Context (REQUIRED JSON):\n{json.dumps(ctx.dict())}\n\n"
+        f"{_history_prompt(conv_id)}\n\n"
+        f"Context (REQUIRED JSON):\n{json.dumps(ctx.model_dump())}\n\n"
         "IMPORTANT:\n- Output STRICT JSON only."
     )
     msgs = [
@@ -456,62 +1166,147 @@ async def _auto_classify_and_attach(phone: str, new_msg: StoredMessage):
         {"role": "user", "content": user_content},
     ]
 
-    raw = await call_groq(msgs)
-    obj = repair_json(raw, ctx)
+    obj = await cascade_classify(msgs, ctx, _webhook_priority(new_msg.body or ""))
+    _count_classification("llm")
+    classify_cache.set(cache_key, obj)
     # save assistant reply into history
-    chat_histories[conv_id].append({"role": "assistant", "content": obj["reply"]})
+    _append_history(conv_id, "assistant", obj["reply"])
+
+    await _attach_classification(new_msg, obj)
 
+async def _attach_classification(new_msg: StoredMessage, obj: Dict[str, Any]):
     # attach classification to the *latest inbound* message (new_msg)
+    before = new_msg.copy()
     new_msg.category   = obj["category"]
     new_msg.priority   = obj["priority"]
     new_msg.action     = obj["action"]
     new_msg.confidence = float(obj.get("confidence", 0.5))
     new_msg.entities   = obj.get("entities") or {}
     new_msg.ai_reply   = obj.get("reply")
+    _save_message(new_msg)
+    prop = _property_for(new_msg.from_)
+    # move the message from its unclassified (or previous) rollup bucket to the new one
+    store.bump_rollups(message_delta(prop, before, new_msg))
+    incident_index.classified(new_msg.sid, prop, obj)
+    await bus.publish("message.classified", message_event(new_msg.from_, new_msg.model_dump(), prop))
+
+# Background, per-phone serialized and debounced webhook classification
+classify_queue = BurstCoalescer(
+    _auto_classify_and_attach,
+    window=COALESCE_WINDOW_MS / 1000,
+    max_wait=COALESCE_MAX_WAIT_MS / 1000,
+    workers=CLASSIFY_WORKERS,
+)
 
-@app.post("/twilio/incoming")
+# in-memory sizes and queue depth, read only when /metrics is scraped
+metrics.REGISTRY.gauge("store_messages", "Messages of the threads cached in STORE.", lambda: len(STORE["messages"]))
+metrics.REGISTRY.gauge("store_threads", "Phone threads cached in STORE.", lambda: len(STORE["threads"]))
+metrics.REGISTRY.gauge("store_pending_writes", "Rows buffered for the next store flush.",
+                       lambda: store.stats().get("pending", 0))
+metrics.REGISTRY.gauge("store_contacts", "Contacts cached in STORE.", lambda: len(STORE["contacts"]))
+metrics.REGISTRY.gauge("store_optouts", "Numbers that opted out.", lambda: len(STORE["optouts"]))
+metrics.REGISTRY.gauge("chat_histories_conversations", "Conversations with in-memory history.",
+                       lambda: len(chat_histories))
+metrics.REGISTRY.gauge("chat_histories_turns", "Turns held across all conversation histories.",
+                       lambda: sum(len(t) for t in list(chat_histories.values())))
+metrics.REGISTRY.gauge("classify_queue_depth", "Phones waiting for or running background classification.",
+                       classify_queue.depth)
+metrics.REGISTRY.gauge("classify_cache_entries", "Entries in the in-memory classification cache.",
+                       lambda: classify_cache.stats()["size"])
+metrics.REGISTRY.gauge("incident_index", "Reports and open incidents in the near-duplicate index.",
+                       incident_index.size, label="kind")
+metrics.REGISTRY.gauge("change_feed", "Change feed subscribers and logged events.", feed.stats, label="kind")
+metrics.REGISTRY.gauge("background_tasks", "Fire-and-forget tasks in flight.", lambda: len(_background_tasks))
+metrics.REGISTRY.gauge("classifications", "Classifications answered, by source.", lambda: {
+    "llm": CLASSIFY_STATS["llm"], "cache": CLASSIFY_STATS["cache"], "similar": CLASSIFY_STATS["similar"],
+    **{f"rule:{k}": v for k, v in CLASSIFY_STATS["rules"].items()},
+}, label="source")
+
+@router.post("/twilio/incoming")
 async def incoming_webhook(payload: WebhookInbound):
     """
     Simulate Twilio inbound webhook (tenant -> you).
     In fake mode you can pass an optional 'context' to register the contact on the fly.
     """
     if payload.context:
-        STORE["contacts"][payload.From] = payload.context.dict()
+        STORE["contacts"][payload.From] = payload.context.model_dump()
+        store.save_contact(payload.From, STORE["contacts"][payload.From])
 
-    _apply_opt_out_logic(payload.Body or "", payload.From)
+    resubscribed = _apply_opt_out_logic(payload.Body or "", payload.From)
 
-    msg = _store_inbound(payload)
+    msg = _store_inbound(payload, {"resubscribed": True} if resubscribed else None)
+    await bus.publish("message.created", message_event(payload.From, msg.model_dump()))
 
-    # auto-classify (only if we have a Context)
-    await _auto_classify_and_attach(payload.From, msg)
+    # auto-classify in the background (only if we have a Context) so Twilio gets its 200 right away;
+    # rule matches (STOP, hazards) skip the debounce window
+    queued = STORE["contacts"].get(payload.From) is not None
+    if queued:
+        urgent = bool(FAST_PATH_RE.search(payload.Body or ""))
+        classify_queue.submit(payload.From, msg, immediate=urgent)
 
-    return {"ok": True, "sid": msg.sid}
+    return {"ok": True, "sid": msg.sid, "queued": queued}
 
-@app.post("/sms/send", response_model=StoredMessage)
+@router.post("/sms/send", response_model=StoredMessage)
 async def send_sms(req: OutboundMessageRequest):
     if req.to in STORE["optouts"]:
         raise HTTPException(400, "Recipient has opted out (STOP).")
 
-    msg = _store_outbound(req.to, req.body, req.metadata)
+    msg = _store_outbound(req.to, req.body, req.media_urls, req.metadata)
+    await bus.publish("message.created", message_event(req.to, msg.model_dump()))
 
     # simulate status callbacks
-    asyncio.create_task(_simulate_status_callbacks(msg.sid))
+    _spawn(_simulate_status_callbacks(msg.sid))
     return msg
 
-@app.post("/twilio/status")
-def status_webhook(payload: Dict[str, Any]):
+@router.post("/twilio/status")
+async def status_webhook(payload: Dict[str, Any]):
     sid = payload.get("MessageSid")
     status = payload.get("MessageStatus") or payload.get("SmsStatus")
-    if not sid or sid not in STORE["messages"]:
+    if not sid or _get_message(sid) is None:
         raise HTTPException(400, "Unknown MessageSid")
-    STORE["messages"][sid].status = status
+    if status:
+        await set_message_status(sid, status, source="twilio")
     return {"ok": True}
 
 # ------------------ Thread APIs (frontend-friendly) ------------------
 
-@app.get("/threads", response_model=List[ThreadSummary])
-def list_threads():
+def _cursor_key(cursor: str, sort: str = "recent") -> Tuple[Any, str]:
+    """A thread cursor's (naive UTC datetime or count, id); 400 for anything else."""
+    value, key = decode_cursor(cursor, as_datetime=sort == "recent")
+    if sort == "recent":
+        valid = isinstance(value, datetime) and value.tzinfo is None
+    else:
+        valid = isinstance(value, int) and not isinstance(value, bool)
+    if not valid or not isinstance(key, str):
+        raise HTTPException(400, "Invalid cursor")
+    return value, key
+
+@router.get("/threads", response_model=ThreadListPage)
+async def list_threads(
+    request: Request,
+    response: Response,
+    sort: str = Query("recent", pattern="^(recent|count)$"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+):
+    # tag taken before reading: a write racing this request makes the next one refetch
+    unchanged = not_modified(request, response, thread_versions.tag())
+    if unchanged:
+        return unchanged
     out: List[ThreadSummary] = []
+    # threads not in memory come from the store's rollup; cached ones (possibly unflushed) win.
+    # Only the SQLite read leaves the loop: the caches are walked here, where they are written.
+    for row in await asyncio.to_thread(store.thread_summaries):
+        if row["phone"] not in STORE["threads"]:
+            out.append(ThreadSummary(
+                id=_thread_id_from_phone(row["phone"]),
+                participant=row["phone"],
+                last_message=row["last_message"],
+                last_status=row["last_status"],
+                count=row["count"],
+                last_at=row["last_at"],
+            ))
     for phone, msgs in STORE["threads"].items():
         if not msgs:
             continue
@@ -521,17 +1316,288 @@ def list_threads():
             participant=phone,
             last_message=(last.body or (last.ai_reply or None)),
             last_status=last.status,
-            count=len(msgs)
+            count=len(msgs),
+            last_at=last.created_at,
         ))
-    return sorted(out, key=lambda t: t.count, reverse=True)
 
-@app.get("/threads/{phone}", response_model=List[StoredMessage])
-def get_thread(phone: str):
-    return STORE["threads"].get(phone, [])
+    # keyset on (last_at, id) or (count, id), newest/largest first
+    if sort == "recent":
+        key = lambda t: (t.last_at, t.id)
+    else:
+        key = lambda t: (t.count, t.id)
+    out.sort(key=key, reverse=True)
+    b = _cursor_key(before, sort) if before else None
+    a = _cursor_key(after, sort) if after else None
+    if a:
+        newer = [t for t in out if key(t) > a]
+        page = newer[-limit:]
+        has_older = bool(page) and key(out[-1]) < key(page[-1])  # `out` is newest first
+    else:
+        rest = [t for t in out if key(t) < b] if b else out
+        page, has_older = rest[:limit], len(rest) > limit
 
-@app.get("/messages/{sid}", response_model=StoredMessage)
-def get_message(sid: str):
-    msg = STORE["messages"].get(sid)
+    return ThreadListPage(
+        items=page,
+        next_cursor=encode_cursor(*key(page[-1])) if page and has_older else None,
+        prev_cursor=encode_cursor(*key(page[0])) if page else after,
+    )
+
+@router.get("/threads/{phone}", response_model=ThreadPage)
+async def get_thread(
+    phone: str,
+    request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+):
+    unchanged = not_modified(request, response, thread_versions.tag(phone))
+    if unchanged:
+        return unchanged
+    msgs = STORE["threads"].get(phone, [])
+    # threads are sorted by (created_at, sid), so a page boundary is a bisect on that key:
+    # it stays on the same message when an import slots older ones in ahead of it
+    if after:
+        lo = bisect_right(msgs, _cursor_key(after), key=_thread_key)
+        hi = min(lo + limit, len(msgs))
+    else:
+        hi = bisect_left(msgs, _cursor_key(before), key=_thread_key) if before else len(msgs)
+        lo = max(hi - limit, 0)
+    page = msgs[lo:hi][::-1]
+
+    return ThreadPage(
+        items=page,
+        next_cursor=encode_cursor(*_thread_key(msgs[lo])) if page and lo > 0 else None,
+        prev_cursor=encode_cursor(*_thread_key(msgs[hi - 1])) if page else after,
+    )
+
+@router.get("/search", response_model=SearchPage)
+async def search_messages(
+    q: str = Query(..., min_length=1, description='Words must all appear; "a phrase", prefix*'),
+    category: Optional[str] = None,
+    priority: Optional[str] = None,
+    phone: Optional[str] = None,
+    since: Optional[datetime] = Query(None, description="created_at >= since (UTC)"),
+    until: Optional[datetime] = Query(None, description="created_at < until (UTC)"),
+    sort: str = Query("rank", pattern="^(rank|recent)$"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    before: Optional[str] = None,
+):
+    """
+    Full-text search over message bodies and AI replies (SQLite FTS5). Pass
+    next_cursor as ?before= for the next page. Sees writes once the store has
+    flushed them (STORE_FLUSH_INTERVAL_MS).
+    """
+    if not store.searchable:
+        raise HTTPException(501, "Search needs STORE_BACKEND=sqlite with FTS5")
+    if not match_expr(q):
+        raise HTTPException(400, "q has no searchable words")
+    hits, last = await asyncio.to_thread(
+        store.search, q, limit, sort, phone=phone, category=category, priority=priority, since=since, until=until,
+        before=decode_cursor(before, as_datetime=sort == "recent"),
+    )
+    return SearchPage(items=hits, next_cursor=encode_cursor(*last) if last else None)
+
+@router.get("/events")
+async def change_feed(
+    phone: Optional[List[str]] = Query(None, description="Only these threads (repeatable)"),
+    property_name: Optional[str] = Query(None, alias="property"),
+    resume: Optional[str] = Query(None, description="Resume token (the last event id seen)"),
+    last_event_id: Optional[str] = Header(None),
+):
+    """
+    Server-Sent Events for the dashboard instead of re-fetching /threads:
+    message.created, message.classified and message.status, each with an id to
+    resume from. EventSource resumes on its own via Last-Event-ID; a `reset`
+    event means the missed events are gone and the client should re-fetch.
+    """
+    return StreamingResponse(feed.stream(phone, property_name, resume or last_event_id),
+                             media_type="text/event-stream", headers=llm_client.SSE_HEADERS)
+
+# ------------------ Analytics ------------------
+
+@router.get("/analytics")
+async def get_analytics(
+    bucket: str = Query("day", pattern="^(day|week|month)$"),
+    group_by: str = Query(",".join(GROUP_DIMS), description="Comma-separated subset of property,category,priority"),
+    since: Optional[datetime] = Query(None, description="From this day (UTC)"),
+    until: Optional[datetime] = Query(None, description="Before this day (UTC)"),
+    property_name: Optional[str] = Query(None, alias="property"),
+    category: Optional[str] = None,
+    priority: Optional[str] = None,
+):
+    """
+    Inbound message counts and average classification confidence per period, plus
+    reply times per period (and property), read from the incremental rollups.
+    """
+    dims = [g.strip() for g in group_by.split(",") if g.strip()]
+    unknown = [g for g in dims if g not in GROUP_DIMS]
+    if unknown:
+        raise HTTPException(400, f"Unknown group_by {', '.join(unknown)}")
+    message_rows, response_rows = await store.rollup_rows(since, until)
+    return analytics.aggregate(message_rows, response_rows, bucket, dims,
+                               {"property": property_name, "category": category, "priority": priority})
+
+# ------------------ Incidents ------------------
+
+@router.get("/incidents")
+def list_incidents(
+    property_name: Optional[str] = Query(None, alias="property"),
+    min_reports: int = Query(2, ge=1, description="1 also lists reports nobody else has sent"),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """
+    Open incidents (near-duplicate inbound reports at one property within INCIDENT_WINDOW),
+    most recently active first, with the most urgent classification among their reports.
+    """
+    return {"items": incident_index.incidents(property_name, min_reports, limit), **incident_index.stats}
+
+@router.get("/store/stats")
+async def store_stats():
+    return {
+        **store.stats(),
+        "cached_threads": len(STORE["threads"]),
+        "cached_messages": len(STORE["messages"]),
+        "cached_contacts": len(STORE["contacts"]),
+        "cached_conversations": len(chat_histories),
+    }
+
+@router.get("/messages/{sid}", response_model=StoredMessage)
+async def get_message(sid: str, request: Request, response: Response):
+    msg = _get_message(sid)
     if not msg:
         raise HTTPException(404, "Not found")
-    return msg
\ No newline at end of file
+    return not_modified(request, response, thread_versions.tag(_phone_of(msg))) or msg
+
+# ------------------ NDJSON export / import ------------------
+
+def _matches(msg: StoredMessage, since: Optional[datetime], until: Optional[datetime], category: Optional[str]) -> bool:
+    return ((since is None or msg.created_at >= since) and (until is None or msg.created_at < until)
+            and (category is None or msg.category == category))
+
+async def _message_batches(phone, since, until, category):
+    if store.persistent:
+        await store.flush()  # everything acknowledged so far is in the export
+        batches = store.iter_messages(phone, since, until, category, EXPORT_BATCH)
+        try:
+            while True:
+                batch = await asyncio.to_thread(next, batches, None)
+                if batch is None:
+                    return
+                yield batch
+        finally:
+            batches.close()
+    else:
+        batch = []
+        for p in ([phone] if phone else list(STORE["threads"])):
+            for m in list(STORE["threads"].get(p, [])):
+                if _matches(m, since, until, category):
+                    batch.append({"phone": p, **m.model_dump()})
+                    if len(batch) >= EXPORT_BATCH:
+                        yield batch
+                        batch = []
+        if batch:
+            yield batch
+
+@router.get("/export/messages")
+async def export_messages(
+    phone: Optional[str] = None,
+    since: Optional[datetime] = Query(None, description="created_at >= since (UTC)"),
+    until: Optional[datetime] = Query(None, description="created_at < until (UTC)"),
+    category: Optional[str] = None,
+):
+    """
+    Stream messages with their classifications as NDJSON, one StoredMessage plus
+    `phone` per line, EXPORT_BATCH rows per cursor fetch. Memory stays flat
+    however many rows match; the output feeds straight back into /import/messages.
+    """
+    async def lines():
+        async for batch in _message_batches(phone, since, until, category):
+            yield "".join(dumps_line(row) for row in batch)
+
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE,
+                             headers={"Content-Disposition": 'attachment; filename="messages.ndjson"'})
+
+def _import_row(obj: Dict[str, Any]) -> StoredMessage:
+    direction = obj.get("direction") or "inbound"
+    if direction not in ("inbound", "outbound"):
+        raise ValueError("direction must be inbound|outbound")
+    # the thread key is the tenant's number: `to` of outbound, `from_` of inbound messages
+    phone = obj.get("phone") or obj.get("to" if direction == "outbound" else "from_")
+    if not phone:
+        raise ValueError("phone required")
+    return StoredMessage(**{
+        **obj,
+        "sid": obj.get("sid") or f"SM{uuid.uuid4().hex[:30]}",
+        "direction": direction,
+        "to": phone if direction == "outbound" else (obj.get("to") or FROM_NUMBER),
+        "from_": phone if direction == "inbound" else (obj.get("from_") or FROM_NUMBER),
+        "status": obj.get("status") or ("received" if direction == "inbound" else "queued"),
+        "created_at": parse_datetime(obj.get("created_at")) or datetime.utcnow(),
+        "metadata": obj.get("metadata") or {},
+        "media_urls": obj.get("media_urls") or [],
+    })
+
+def _merge_into_thread(phone: str, msgs: List[StoredMessage]) -> Dict[str, StoredMessage]:
+    # imported rows replace same-sid messages in place; new ones slot in by created_at
+    thread = STORE["threads"][phone]
+    known = len(thread)
+    by_sid = {m.sid: m for m in thread}
+    replaced = {m.sid: by_sid[m.sid] for m in msgs if m.sid in by_sid}
+    by_sid.update((m.sid, m) for m in msgs)
+    thread[:] = sorted(by_sid.values(), key=_thread_key)
+    for m in msgs:
+        STORE["messages"][m.sid] = m
+    if phone in _history_pos:
+        # history replay stays at the messages it had not reached yet
+        _history_pos[phone] += len(thread) - known
+    return replaced
+
+async def _write_messages(rows: List[tuple]):
+    await store.write_messages(rows)  # a persistent store also moves their rollups
+    touched: Dict[str, List[StoredMessage]] = defaultdict(list)
+    for phone, msg in rows:
+        touched[phone].append(msg)
+    for phone, msgs in touched.items():
+        thread_versions.bump(phone)
+        # persistent: only threads already in memory need the rows; the rest load on demand
+        if not store.persistent:
+            replaced = _merge_into_thread(phone, msgs)
+            prop = _property_for(phone)
+            for m in msgs:
+                store.bump_rollups(message_delta(prop, replaced.get(m.sid), m))
+        elif phone in STORE["threads"]:
+            _merge_into_thread(phone, msgs)
+
+@router.post("/import/messages")
+async def import_messages(request: Request):
+    """
+    Ingest an NDJSON body of messages (the /export/messages format). Rows are
+    upserted by sid (a new sid is assigned when missing), IMPORT_BATCH per
+    transaction, and thread rollups are refreshed per batch; bad lines are
+    reported and skipped.
+    """
+    report = BulkReport(done="imported", key="sid")
+    await store.flush()  # imported rows supersede anything buffered for the same sid
+    chunk: List[tuple] = []
+    async for line_no, obj, error in iter_ndjson(request.stream()):
+        report.rows += 1
+        if error:
+            report.error(line_no, error)
+            continue
+        try:
+            msg = _import_row(obj)
+        except (ValueError, ValidationError) as e:
+            report.error(line_no, str(e), obj.get("sid"))
+            continue
+        chunk.append((_phone_of(msg), msg))
+        if len(chunk) >= IMPORT_BATCH:
+            await _write_messages(chunk)
+            report.done += len(chunk)
+            chunk = []
+    if chunk:
+        await _write_messages(chunk)
+        report.done += len(chunk)
+    return report.result()
+
+app = create_app()
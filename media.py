@@ -0,0 +1,280 @@
+# media.py
+# Image pipeline for the vision path of /pm_chat in main.py and ai_chat.py: fetch each URL once,
+# keep a downscaled JPEG by content hash, send it inline, and cache the vision model's
+# description per (image, model) so follow-up questions about the same photo skip the pixels.
+import asyncio, base64, hashlib, io, ipaddress, logging, os
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+import llm_client
+import metrics
+from llm_dispatch import BULK
+
+try:  # optional: without Pillow images are passed through unresized (still fetched once, inline)
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover
+    Image = ImageOps = None
+
+log = logging.getLogger(__name__)
+
+# ------------------ Config ------------------
+MEDIA_DIR              = os.getenv("MEDIA_DIR", "./media_cache")
+MEDIA_MAX_BYTES        = int(os.getenv("MEDIA_MAX_BYTES", str(15 * 1024 * 1024)))  # refuse larger downloads
+MEDIA_MAX_SIDE         = int(os.getenv("MEDIA_MAX_SIDE", "1024"))     # longest edge after downscaling, px
+MEDIA_JPEG_QUALITY     = int(os.getenv("MEDIA_JPEG_QUALITY", "82"))
+MEDIA_FETCH_TIMEOUT    = float(os.getenv("MEDIA_FETCH_TIMEOUT", "10"))
+MEDIA_URL_CACHE_SIZE   = int(os.getenv("MEDIA_URL_CACHE_SIZE", "2000"))  # url -> hash entries kept in memory
+MEDIA_MAX_REDIRECTS    = int(os.getenv("MEDIA_MAX_REDIRECTS", "3"))
+# Image URLs come from tenants and chat users, so by default we only fetch from public addresses
+# (no loopback, private, link-local or metadata endpoints). 1 lifts that for local development.
+MEDIA_ALLOW_PRIVATE    = os.getenv("MEDIA_ALLOW_PRIVATE", "0") == "1"
+# Answer follow-ups about an already-described image from the cached description instead of the pixels
+MEDIA_REUSE_DESCRIPTION = os.getenv("MEDIA_REUSE_DESCRIPTION", "1") == "1"
+
+DESCRIBE_PROMPT = (
+    "Describe this image for a property manager in a few sentences: what room or area it shows, "
+    "visible damage or hazards (water, mold, cracks, fire, pests), fixtures and appliances involved, "
+    "and any readable text. Facts only, no advice."
+)
+
+# formats the vision APIs accept as-is (only used untouched when Pillow is missing)
+_EXT = {"image/jpeg": ".jpg", "image/png": ".png", "image/webp": ".webp", "image/gif": ".gif"}
+
+
+class MediaError(Exception):
+    pass
+
+
+def _model_key(model: str) -> str:
+    return hashlib.sha1(model.encode("utf-8")).hexdigest()[:12]
+
+
+class MediaStore:
+    """
+    Content-addressed files under `root`:
+      <sha256 of the original bytes>.jpg            downscaled image sent to the model
+      <sha256>.<model key>.txt                      that model's description of it
+    plus in-memory url -> hash and description LRUs. Concurrent requests for the
+    same URL share one download.
+    """
+
+    def __init__(self, root: str = MEDIA_DIR, max_side: int = MEDIA_MAX_SIDE, quality: int = MEDIA_JPEG_QUALITY,
+                 allow_private: bool = MEDIA_ALLOW_PRIVATE):
+        self.root = root
+        self.max_side = max_side
+        self.quality = quality
+        self.allow_private = allow_private
+        self._urls: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()   # url -> (hash, mime)
+        self._descriptions: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._describing: Dict[Tuple[str, str], asyncio.Task] = {}
+        self.stats = {"fetches": 0, "url_hits": 0, "file_hits": 0, "bytes_in": 0, "bytes_out": 0,
+                      "described": 0, "description_hits": 0, "errors": 0}
+
+    # ------------------ files ------------------
+
+    def _path(self, digest: str, suffix: str) -> str:
+        return os.path.join(self.root, digest[:2], f"{digest}{suffix}")
+
+    def _write(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)  # readers never see a partial file
+
+    def _downscale(self, raw: bytes) -> bytes:
+        with Image.open(io.BytesIO(raw)) as im:
+            im = ImageOps.exif_transpose(im)  # phone photos are often rotated via EXIF only
+            if im.mode not in ("RGB", "L"):
+                # flatten transparency onto white; JPEG has no alpha
+                rgba = im.convert("RGBA")
+                im = Image.new("RGB", im.size, (255, 255, 255))
+                im.paste(rgba, mask=rgba.getchannel("A"))
+            im.thumbnail((self.max_side, self.max_side), Image.LANCZOS)
+            out = io.BytesIO()
+            im.save(out, "JPEG", quality=self.quality, optimize=True, progressive=True)
+            return out.getvalue()
+
+    def _process(self, raw: bytes, mime: str) -> Tuple[str, str]:
+        digest = hashlib.sha256(raw).hexdigest()
+        out_mime = "image/jpeg" if Image is not None else mime
+        if out_mime not in _EXT:
+            raise MediaError(f"unsupported content type {mime!r}")
+        path = self._path(digest, _EXT[out_mime])
+        if os.path.exists(path):
+            self.stats["file_hits"] += 1
+            return digest, out_mime
+        if Image is None:
+            data = raw
+        else:
+            try:
+                data = self._downscale(raw)
+            except Exception as e:  # truncated or not an image after all
+                raise MediaError(f"unreadable image: {e}") from e
+        self._write(path, data)
+        self.stats["bytes_out"] += len(data)
+        return digest, out_mime
+
+    def _read(self, digest: str, mime: str) -> bytes:
+        with open(self._path(digest, _EXT[mime]), "rb") as f:
+            return f.read()
+
+    # ------------------ fetching ------------------
+
+    async def _check_url(self, url: str):
+        """Refuse anything but http(s) to public addresses (every address the host resolves to)."""
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise MediaError(f"unsupported URL {url[:80]!r}")
+        if self.allow_private:
+            return
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(
+                parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+        except OSError as e:
+            raise MediaError(f"cannot resolve {parts.hostname}: {e}") from e
+        for *_, sockaddr in infos:
+            ip = ipaddress.ip_address(sockaddr[0].split("%")[0])
+            if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped:
+                ip = ip.ipv4_mapped
+            if not ip.is_global or ip.is_multicast:
+                raise MediaError(f"{parts.hostname} resolves to a non-public address ({ip})")
+
+    async def _download(self, url: str) -> Tuple[bytes, str]:
+        client = llm_client.get_client()
+        # redirects are followed by hand so every hop goes through _check_url
+        for _ in range(MEDIA_MAX_REDIRECTS + 1):
+            await self._check_url(url)
+            async with client.stream("GET", url, timeout=MEDIA_FETCH_TIMEOUT, follow_redirects=False) as r:
+                if r.is_redirect:
+                    url = str(r.url.join(r.headers["location"]))
+                    continue
+                r.raise_for_status()
+                mime = r.headers.get("content-type", "").split(";")[0].strip().lower()
+                if mime and not mime.startswith("image/"):
+                    raise MediaError(f"not an image ({mime})")
+                if int(r.headers.get("content-length") or 0) > MEDIA_MAX_BYTES:
+                    raise MediaError("image too large")
+                chunks, size = [], 0
+                async for chunk in r.aiter_bytes():
+                    size += len(chunk)
+                    if size > MEDIA_MAX_BYTES:
+                        raise MediaError("image too large")
+                    chunks.append(chunk)
+            self.stats["fetches"] += 1
+            self.stats["bytes_in"] += size
+            return b"".join(chunks), mime
+        raise MediaError("too many redirects")
+
+    async def _load(self, url: str) -> Tuple[str, str]:
+        if url.startswith("data:"):
+            header, _, payload = url.partition(",")
+            raw = base64.b64decode(payload) if header.endswith(";base64") else payload.encode("utf-8")
+            mime = header[5:].split(";")[0]
+        else:
+            raw, mime = await self._download(url)
+        return await asyncio.to_thread(self._process, raw, mime)
+
+    async def resolve(self, url: str) -> Tuple[str, str]:
+        """(content hash, mime) for `url`, downloading and downscaling only the first time."""
+        key = url
+        if len(url) > 2048:  # data: URLs: don't keep the payload around as a key
+            key = "sha256:" + hashlib.sha256(url.encode("utf-8")).hexdigest()
+        hit = self._urls.get(key)
+        if hit:
+            self._urls.move_to_end(key)
+            self.stats["url_hits"] += 1
+            return hit
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = self._inflight[key] = asyncio.ensure_future(self._load(url))
+            fut.add_done_callback(lambda _: self._inflight.pop(key, None))
+        try:
+            hit = await asyncio.shield(fut)
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        self._urls[key] = hit
+        while len(self._urls) > MEDIA_URL_CACHE_SIZE:
+            self._urls.popitem(last=False)
+        return hit
+
+    async def data_url(self, digest: str, mime: str) -> str:
+        data = await asyncio.to_thread(self._read, digest, mime)
+        return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+
+    # ------------------ descriptions ------------------
+
+    def description(self, digest: str, model: str) -> Optional[str]:
+        key = (digest, model)
+        text = self._descriptions.get(key)
+        if text is None:
+            path = self._path(digest, f".{_model_key(model)}.txt")
+            if not os.path.exists(path):
+                return None
+            with open(path, encoding="utf-8") as f:
+                text = self._descriptions[key] = f.read()
+        self._descriptions.move_to_end(key)
+        while len(self._descriptions) > MEDIA_URL_CACHE_SIZE:
+            self._descriptions.popitem(last=False)
+        return text
+
+    async def _describe(self, digest: str, mime: str, model: str, call: Callable[..., Awaitable[str]]):
+        image = await self.data_url(digest, mime)
+        text = (await call([{"role": "user", "content": [
+            {"type": "text", "text": DESCRIBE_PROMPT},
+            {"type": "image_url", "image_url": {"url": image}},
+        ]}], model=model, priority=BULK) or "").strip()
+        if text:
+            self._descriptions[(digest, model)] = text
+            await asyncio.to_thread(self._write, self._path(digest, f".{_model_key(model)}.txt"), text.encode("utf-8"))
+            self.stats["described"] += 1
+
+    def describe_later(self, digest: str, mime: str, model: str, call: Callable[..., Awaitable[str]]):
+        """Describe the image in the background (once per image and model) for later questions."""
+        key = (digest, model)
+        if key in self._describing or self.description(digest, model) is not None:
+            return
+        task = asyncio.create_task(self._describe(digest, mime, model, call))
+        self._describing[key] = task
+
+        def done(t: asyncio.Task):
+            self._describing.pop(key, None)
+            if not t.cancelled() and t.exception() is not None:
+                log.warning("describing %s failed: %s", digest[:12], t.exception())
+
+        task.add_done_callback(done)
+
+    async def image_parts(self, url: str, model: str, call: Callable[..., Awaitable[str]],
+                          fallback: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        User-message content parts standing in for `url`: the cached description when
+        the model has already seen this image, else the downscaled image inline (and a
+        background description for next time). On any fetch/decode failure the
+        `fallback` part is used (default: the raw URL, as before).
+        """
+        try:
+            digest, mime = await self.resolve(url)
+        except (MediaError, httpx.HTTPError, OSError, ValueError) as e:
+            log.info("media fetch for %s failed, passing the URL on: %s", url[:80], e)
+            return [fallback or {"type": "image_url", "image_url": {"url": url}}]
+        if MEDIA_REUSE_DESCRIPTION:
+            text = self.description(digest, model)
+            if text is not None:
+                self.stats["description_hits"] += 1
+                return [{"type": "text", "text": f"Attached photo (described earlier): {text}"}]
+            self.describe_later(digest, mime, model, call)
+        return [{"type": "image_url", "image_url": {"url": await self.data_url(digest, mime)}}]
+
+    async def aclose(self):
+        for task in list(self._describing.values()):
+            task.cancel()
+        await asyncio.gather(*self._describing.values(), return_exceptions=True)
+
+
+media_store = MediaStore()
+metrics.REGISTRY.gauge("media_cache", "Vision media pipeline counters.", lambda: media_store.stats, label="kind")
@@ -0,0 +1,677 @@
+# message_store.py
+# Storage backends for main.py's STORE. The SQLite backend reuses the `messages` / `contacts`
+# schema of prop_ai.db (in its own file, data/store.db by default) and writes behind: saves are buffered (latest state per key) and flushed
+# in one transaction off the request path.
+import asyncio, json, logging, os, sqlite3, threading, time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+import analytics
+import metrics
+from analytics import Rollups
+from contacts import CONTACT_FIELDS
+from search import build_search, ensure_fts, page
+
+log = logging.getLogger(__name__)
+
+# ------------------ Config ------------------
+STORE_BACKEND            = os.getenv("STORE_BACKEND", "sqlite")          # sqlite | memory
+STORE_DB                 = os.getenv("STORE_DB", "./data/store.db")  # untracked; never the committed prop_ai.db
+STORE_FLUSH_INTERVAL_MS  = float(os.getenv("STORE_FLUSH_INTERVAL_MS", "250"))  # max time a write sits in memory; 0 = asap
+STORE_FLUSH_BATCH        = int(os.getenv("STORE_FLUSH_BATCH", "500"))     # flush early once this many keys are pending
+STORE_RETRY_MAX_MS       = float(os.getenv("STORE_RETRY_MAX_MS", "30000"))  # a failed flush retries after 0.5s, doubling up to this
+STORE_THREAD_CACHE_SIZE  = int(os.getenv("STORE_THREAD_CACHE_SIZE", "1000"))   # phone threads kept in memory
+STORE_HISTORY_CACHE_SIZE = int(os.getenv("STORE_HISTORY_CACHE_SIZE", "1000"))  # conversation histories kept in memory
+
+_TS = "%Y-%m-%d %H:%M:%S.%f"  # SQLAlchemy's SQLite DATETIME format, so ai_chat.py reads the same rows
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contacts (
+    phone VARCHAR NOT NULL PRIMARY KEY, tenant_name VARCHAR NOT NULL, unit VARCHAR NOT NULL,
+    address VARCHAR NOT NULL, hotline VARCHAR, portal_url VARCHAR, property_name VARCHAR,
+    created_at DATETIME, updated_at DATETIME
+);
+CREATE INDEX IF NOT EXISTS ix_contacts_phone ON contacts (phone);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER NOT NULL PRIMARY KEY, phone VARCHAR NOT NULL, direction VARCHAR(8) NOT NULL,
+    "to" VARCHAR, from_ VARCHAR, body TEXT, media_urls JSON NOT NULL, status VARCHAR,
+    created_at DATETIME, ai_reply TEXT, category VARCHAR, priority VARCHAR, action VARCHAR,
+    confidence FLOAT, entities JSON
+);
+CREATE INDEX IF NOT EXISTS ix_messages_phone ON messages (phone);
+CREATE INDEX IF NOT EXISTS ix_messages_phone_created_at ON messages (phone, created_at);
+CREATE TABLE IF NOT EXISTS thread_summaries (
+    phone VARCHAR NOT NULL PRIMARY KEY, last_message TEXT, last_status VARCHAR,
+    count INTEGER NOT NULL, last_at DATETIME
+);
+CREATE INDEX IF NOT EXISTS ix_thread_summaries_last_at_phone ON thread_summaries (last_at, phone);
+CREATE INDEX IF NOT EXISTS ix_thread_summaries_count_phone ON thread_summaries (count, phone);
+CREATE TABLE IF NOT EXISTS optouts (phone VARCHAR NOT NULL PRIMARY KEY, created_at DATETIME);
+CREATE TABLE IF NOT EXISTS conversations (
+    conv_id VARCHAR NOT NULL PRIMARY KEY, turns JSON NOT NULL, summary TEXT, updated_at DATETIME
+);
+"""
+
+UPSERT_MESSAGE = (
+    'INSERT INTO messages (sid, phone, direction, "to", from_, body, media_urls, status, created_at, '
+    "ai_reply, category, priority, action, confidence, entities, metadata) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(sid) DO UPDATE SET body = excluded.body, media_urls = excluded.media_urls, "
+    "status = excluded.status, ai_reply = excluded.ai_reply, category = excluded.category, "
+    "priority = excluded.priority, action = excluded.action, confidence = excluded.confidence, "
+    "entities = excluded.entities, metadata = excluded.metadata"
+)
+UPSERT_CONTACT = (
+    "INSERT INTO contacts (phone, tenant_name, unit, address, hotline, portal_url, property_name, "
+    "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(phone) DO UPDATE SET tenant_name = excluded.tenant_name, unit = excluded.unit, "
+    "address = excluded.address, hotline = excluded.hotline, portal_url = excluded.portal_url, "
+    "property_name = excluded.property_name, updated_at = excluded.updated_at"
+)
+UPSERT_CONVERSATION = (
+    "INSERT INTO conversations (conv_id, turns, summary, updated_at) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(conv_id) DO UPDATE SET turns = excluded.turns, summary = excluded.summary, "
+    "updated_at = excluded.updated_at"
+)
+# same rollup ai_chat.rebuild_thread_summaries computes, for one phone
+REFRESH_SUMMARY = (
+    "INSERT OR REPLACE INTO thread_summaries (phone, count, last_at, last_status, last_message) "
+    "SELECT :phone, COUNT(*), MAX(created_at), "
+    " (SELECT s.status FROM messages s WHERE s.phone = :phone ORDER BY s.created_at DESC, s.id DESC LIMIT 1), "
+    " (SELECT COALESCE(NULLIF(s.body, ''), NULLIF(s.ai_reply, '')) FROM messages s "
+    "  WHERE s.phone = :phone AND COALESCE(NULLIF(s.body, ''), NULLIF(s.ai_reply, '')) IS NOT NULL "
+    "  ORDER BY s.created_at DESC, s.id DESC LIMIT 1) "
+    "FROM messages WHERE phone = :phone"
+)
+
+
+def _ts(dt: Optional[datetime]) -> Optional[str]:
+    return dt.strftime(_TS) if dt else None
+
+
+def _dt(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+SELECT_MESSAGE = (
+    'SELECT sid, phone, direction, "to", from_, body, media_urls, status, created_at, ai_reply, '
+    "category, priority, action, confidence, entities, metadata FROM messages"
+)
+
+
+def _message_dict(r: tuple) -> Dict[str, Any]:
+    return {
+        "sid": r[0], "phone": r[1], "direction": r[2], "to": r[3] or "", "from_": r[4] or "", "body": r[5],
+        "media_urls": json.loads(r[6] or "[]"), "status": r[7], "created_at": _dt(r[8]),
+        "ai_reply": r[9], "category": r[10], "priority": r[11], "action": r[12], "confidence": r[13],
+        "entities": json.loads(r[14]) if r[14] else None, "metadata": json.loads(r[15] or "{}"),
+    }
+
+
+def _message_row(phone: str, msg: Any) -> tuple:
+    return (
+        msg.sid, phone, msg.direction, msg.to, msg.from_, msg.body, json.dumps(list(msg.media_urls)),
+        msg.status, _ts(msg.created_at), msg.ai_reply, msg.category, msg.priority, msg.action,
+        msg.confidence, json.dumps(msg.entities) if msg.entities is not None else None,
+        json.dumps(msg.metadata or {}),
+    )
+
+
+# ------------------ LRU ------------------
+
+class LRUCache(OrderedDict):
+    """
+    Read-through LRU. A missing key is loaded with `load(key)`; `cache[key]` keeps
+    the result (like a defaultdict), `cache.get(key)` only keeps non-empty ones.
+    Entries for which `can_evict(key)` is false (unflushed writes) are never dropped,
+    so `maxsize` is a soft bound; 0 means unbounded. Lookups and eviction hold a lock,
+    so a read-through from a worker thread cannot interleave with one on the event loop.
+    """
+
+    def __init__(self, maxsize: int, load: Callable[[Any], Any],
+                 can_evict: Callable[[Any], bool] = lambda key: True,
+                 on_evict: Callable[[Any, Any], None] = lambda key, value: None):
+        super().__init__()
+        self.maxsize = maxsize
+        self._load = load
+        self._can_evict = can_evict
+        self._on_evict = on_evict
+        self._lock = threading.RLock()
+
+    def __getitem__(self, key):
+        with self._lock:
+            if key in self:
+                self.move_to_end(key)
+                return super().__getitem__(key)
+            value = self._load(key)
+            self[key] = value
+            self._evict(keep=key)
+            return value
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self:
+                return self[key]
+            value = self._load(key)
+            if not value:
+                return default
+            self[key] = value
+            self._evict(keep=key)
+            return value
+
+    def _evict(self, keep=None):
+        with self._lock:
+            excess = len(self) - self.maxsize
+            if not self.maxsize or excess <= 0:
+                return
+            victims = []
+            for key in self:  # oldest first
+                if len(victims) >= excess:
+                    break
+                if key != keep and self._can_evict(key):  # the caller is about to use `keep`
+                    victims.append(key)
+            for key in victims:
+                self._on_evict(key, OrderedDict.pop(self, key))
+
+
+# ------------------ Backends ------------------
+
+class MemoryStore:
+    """Nothing survives a restart; caches are unbounded (the original behaviour)."""
+
+    persistent = False
+    searchable = False
+
+    def __init__(self):
+        self._rollups = Rollups()  # analytics totals (pending deltas for persistent stores)
+
+    def load_contact(self, phone: str) -> Optional[Dict[str, Any]]:
+        return None
+
+    def load_optouts(self) -> Set[str]:
+        return set()
+
+    def load_thread(self, phone: str) -> List[Dict[str, Any]]:
+        return []
+
+    def phone_for_sid(self, sid: str) -> Optional[str]:
+        return None
+
+    def load_conversation(self, conv_id: str) -> Optional[Dict[str, Any]]:
+        return None
+
+    def thread_summaries(self) -> List[Dict[str, Any]]:
+        return []
+
+    def search(self, q: str, limit: int, sort: str = "rank", **filters) -> Tuple[List[Dict[str, Any]], Optional[tuple]]:
+        return [], None
+
+    def save_message(self, phone: str, msg: Any):
+        pass
+
+    def save_contact(self, phone: str, ctx: Dict[str, Any]):
+        pass
+
+    def save_optout(self, phone: str, opted_out: bool):
+        pass
+
+    def save_conversation(self, conv_id: str, turns: List[Dict[str, str]], summary: Optional[str]):
+        pass
+
+    def bump_rollups(self, delta: Rollups):
+        self._rollups.merge(delta)
+
+    async def rollup_rows(self, since: Optional[datetime] = None, until: Optional[datetime] = None):
+        """(message rows, response rows) of the analytics tables for days in [since, until)."""
+        lo, hi = (since.date().isoformat() if since else ""), (until.date().isoformat() if until else "~")
+        keep = lambda day: lo <= day < hi
+        return ([r for r in self._rollups.message_rows() if keep(r[0])],
+                [r for r in self._rollups.response_rows() if keep(r[0])])
+
+    def thread_dirty(self, phone: str) -> bool:
+        return False
+
+    def conversation_dirty(self, conv_id: str) -> bool:
+        return False
+
+    def contact_dirty(self, phone: str) -> bool:
+        return False
+
+    async def write_contacts(self, rows: List[Tuple[str, Dict[str, Any]]]):
+        pass
+
+    async def write_messages(self, rows: List[Tuple[str, Any]]):
+        pass
+
+    def open(self):
+        pass
+
+    def start(self):
+        pass
+
+    async def flush(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "memory", "persistent": False}
+
+
+class SQLiteStore(MemoryStore):
+    """
+    Reads go straight to SQLite on the caller's thread, through a connection of that
+    thread's own: under WAL a reader never waits for the flusher or for another
+    reader, so a read-through on the event loop (an LRU miss) costs one indexed
+    lookup. Scans (search, thread summaries, rollups) run on worker threads.
+    Writes are kept as the latest row per key and flushed by a background task every
+    `flush_interval` seconds, or as soon as `batch` keys are pending, with one
+    executemany per table in a single transaction on a worker thread. A failed
+    flush is put back and retried with backoff.
+    """
+
+    persistent = True
+
+    def __init__(self, path: str = STORE_DB, flush_interval: float = STORE_FLUSH_INTERVAL_MS / 1000,
+                 batch: int = STORE_FLUSH_BATCH):
+        super().__init__()
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch = batch
+        self._open_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        # connected and migrated by open(): from the app lifespan, or by the first read or write
+        self._reader: Optional[sqlite3.Connection] = None
+        self._local = threading.local()  # per-thread reader connections
+        self._writer: Optional[sqlite3.Connection] = None
+
+        # pending writes: key -> row, latest wins
+        self._messages: Dict[str, tuple] = {}
+        self._contacts: Dict[str, tuple] = {}
+        self._optouts: Dict[str, bool] = {}
+        self._conversations: Dict[str, tuple] = {}
+        self._dirty_phones: Set[str] = set()
+        self._inflight_phones: Set[str] = set()
+        self._inflight_convs: Set[str] = set()
+        self._inflight_contacts: Set[str] = set()
+
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None  # the flusher's; set by start()
+        self._wake: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+
+        self.flushes = 0
+        self.rows_written = 0
+        self.flush_errors = 0
+        self.last_flush_ms = 0.0
+        self._retry_s = 0.0  # current backoff after failed flushes
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def open(self):
+        """Connect and migrate (schema, FTS index, rollup backfill). Idempotent; may take a while."""
+        with self._open_lock:
+            if self._reader is None:
+                conn = self._connect()
+                self._migrate(conn)
+                self._reader = conn
+
+    def _migrate(self, conn: sqlite3.Connection):
+        conn.executescript(SCHEMA)
+        cols = {r[1] for r in conn.execute("PRAGMA table_info(messages)")}
+        # main.py addresses messages by provider sid and keeps free-form metadata
+        if "sid" not in cols:
+            conn.execute("ALTER TABLE messages ADD COLUMN sid VARCHAR")
+        if "metadata" not in cols:
+            conn.execute("ALTER TABLE messages ADD COLUMN metadata JSON")
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_messages_sid ON messages (sid)")
+        self.searchable = ensure_fts(conn)
+        conn.executescript(analytics.SCHEMA)
+        has_rollups = conn.execute("SELECT 1 FROM rollup_messages LIMIT 1").fetchone()
+        if not has_rollups and conn.execute("SELECT 1 FROM messages LIMIT 1").fetchone():
+            analytics.rebuild_sqlite(conn)  # backfill databases that predate the rollups
+
+    def _query(self, sql: str, params=()) -> List[sqlite3.Row]:
+        if self._reader is None:
+            self.open()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        started = time.perf_counter()
+        rows = conn.execute(sql, params).fetchall()
+        metrics.STORE_QUERY_LATENCY.observe(time.perf_counter() - started, sql.lstrip().split(None, 1)[0].upper())
+        return rows
+
+    # ------------------ reads ------------------
+
+    def load_contact(self, phone: str) -> Optional[Dict[str, Any]]:
+        rows = self._query(f"SELECT {', '.join(CONTACT_FIELDS)} FROM contacts WHERE phone = ?", (phone,))
+        return dict(zip(CONTACT_FIELDS, rows[0])) if rows else None
+
+    def load_optouts(self) -> Set[str]:
+        return {r[0] for r in self._query("SELECT phone FROM optouts")}
+
+    def load_thread(self, phone: str) -> List[Dict[str, Any]]:
+        # rows written by ai_chat.py have no sid and are not part of main's threads
+        rows = self._query(f"{SELECT_MESSAGE} WHERE phone = ? AND sid IS NOT NULL ORDER BY created_at, id", (phone,))
+        return [_message_dict(r) for r in rows]
+
+    def iter_messages(self, phone: Optional[str] = None, since: Optional[datetime] = None,
+                      until: Optional[datetime] = None, category: Optional[str] = None,
+                      batch: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Lists of up to `batch` message dicts in insertion order, read through a cursor on
+        a private connection (one consistent WAL snapshot; the shared reader is not held).
+        Pending writes are not included: flush() first.
+        """
+        where, params = ["sid IS NOT NULL"], []
+        for clause, value in (("phone = ?", phone), ("created_at >= ?", _ts(since)),
+                              ("created_at < ?", _ts(until)), ("category = ?", category)):
+            if value is not None:
+                where.append(clause)
+                params.append(value)
+        conn = self._connect()
+        try:
+            cur = conn.execute(f"{SELECT_MESSAGE} WHERE {' AND '.join(where)} ORDER BY id", params)
+            while True:
+                rows = cur.fetchmany(batch)
+                if not rows:
+                    return
+                yield [_message_dict(r) for r in rows]
+        finally:
+            conn.close()
+
+    def phone_for_sid(self, sid: str) -> Optional[str]:
+        rows = self._query("SELECT phone FROM messages WHERE sid = ?", (sid,))
+        return rows[0][0] if rows else None
+
+    def load_conversation(self, conv_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._query("SELECT turns, summary FROM conversations WHERE conv_id = ?", (conv_id,))
+        if not rows:
+            return None
+        return {"turns": json.loads(rows[0][0]), "summary": rows[0][1]}
+
+    def thread_summaries(self) -> List[Dict[str, Any]]:
+        rows = self._query("SELECT phone, last_message, last_status, count, last_at FROM thread_summaries")
+        return [{"phone": r[0], "last_message": r[1], "last_status": r[2], "count": r[3], "last_at": _dt(r[4])}
+                for r in rows]
+
+    def search(self, q: str, limit: int, sort: str = "rank", **filters) -> Tuple[List[Dict[str, Any]], Optional[tuple]]:
+        """One page of full-text hits over main's messages (see search.build_search for `filters`)."""
+        sql, params = build_search(q, sort=sort, limit=limit, where=("m.sid IS NOT NULL",), sid=True, **filters)
+        return page(self._query(sql, params), limit, sort)
+
+    async def rollup_rows(self, since: Optional[datetime] = None, until: Optional[datetime] = None):
+        await self.flush()
+        where, params = [], []
+        if since:
+            where.append("day >= ?")
+            params.append(since.date().isoformat())
+        if until:
+            where.append("day < ?")
+            params.append(until.date().isoformat())
+        clause = f" WHERE {' AND '.join(where)}" if where else ""
+        return (await asyncio.to_thread(self._query, analytics.SELECT_MESSAGES + clause, params),
+                await asyncio.to_thread(self._query, analytics.SELECT_RESPONSES + clause, params))
+
+    # ------------------ buffered writes ------------------
+
+    def save_message(self, phone: str, msg: Any):
+        self._messages[msg.sid] = _message_row(phone, msg)
+        self._dirty_phones.add(phone)
+        self._schedule()
+
+    def save_contact(self, phone: str, ctx: Dict[str, Any]):
+        now = _ts(datetime.utcnow())
+        self._contacts[phone] = (phone, *(ctx.get(k) for k in CONTACT_FIELDS), now, now)
+        self._schedule()
+
+    def save_optout(self, phone: str, opted_out: bool):
+        self._optouts[phone] = opted_out
+        self._schedule()
+
+    def save_conversation(self, conv_id: str, turns: List[Dict[str, str]], summary: Optional[str]):
+        self._conversations[conv_id] = (
+            conv_id, json.dumps(turns, ensure_ascii=False), summary, _ts(datetime.utcnow()),
+        )
+        self._schedule()
+
+    def bump_rollups(self, delta: Rollups):
+        if delta:
+            self._rollups.merge(delta)
+            self._schedule()
+
+    def thread_dirty(self, phone: str) -> bool:
+        return phone in self._dirty_phones or phone in self._inflight_phones
+
+    def conversation_dirty(self, conv_id: str) -> bool:
+        return conv_id in self._conversations or conv_id in self._inflight_convs
+
+    def contact_dirty(self, phone: str) -> bool:
+        return phone in self._contacts or phone in self._inflight_contacts
+
+    async def write_contacts(self, rows: List[Tuple[str, Dict[str, Any]]]):
+        """Upsert a chunk of contacts in one transaction now, superseding buffered single upserts."""
+        now = _ts(datetime.utcnow())
+        batch = []
+        for phone, ctx in rows:
+            self._contacts.pop(phone, None)
+            batch.append((phone, *(ctx.get(k) for k in CONTACT_FIELDS), now, now))
+        await asyncio.to_thread(self._write_contacts, batch)
+
+    def _write_contacts(self, batch: List[tuple]):
+        self._transaction(lambda conn: conn.executemany(UPSERT_CONTACT, batch))
+        self.rows_written += len(batch)
+
+    async def write_messages(self, rows: List[Tuple[str, Any]]):
+        """Upsert a chunk of (phone, message) by sid in one transaction now and refresh their threads' rollups."""
+        batch = []
+        for phone, msg in rows:
+            self._messages.pop(msg.sid, None)
+            batch.append(_message_row(phone, msg))
+        await asyncio.to_thread(self._write_messages, batch)
+
+    def _write_messages(self, batch: List[tuple]):
+        def work(conn: sqlite3.Connection):
+            # rollups: take replaced inbound rows back out, count the new ones (reply times need a rebuild)
+            delta = Rollups()
+            old, props = [], {}
+            phones = list({row[1] for row in batch})
+            for i in range(0, len(batch), 500):
+                sids = [row[0] for row in batch[i:i + 500]]
+                old += conn.execute(
+                    "SELECT phone, direction, created_at, category, priority, confidence FROM messages "
+                    f"WHERE sid IN ({', '.join('?' * len(sids))})", sids,
+                ).fetchall()
+            for i in range(0, len(phones), 500):
+                chunk = phones[i:i + 500]
+                for phone, property_name, address in conn.execute(
+                    f"SELECT phone, property_name, address FROM contacts WHERE phone IN ({', '.join('?' * len(chunk))})", chunk,
+                ):
+                    props[phone] = analytics.property_of({"property_name": property_name, "address": address})
+            for rows, sign in ((old, -1), ([(r[1], r[2], r[8], r[10], r[11], r[13]) for r in batch], 1)):
+                for phone, direction, created_at, category, priority, confidence in rows:
+                    if direction == "inbound":
+                        delta.add_message(created_at, props.get(phone, analytics.NO_PROPERTY),
+                                          category, priority, confidence, sign)
+            conn.executemany(UPSERT_MESSAGE, batch)
+            analytics.write_sqlite(conn, delta)
+            conn.executemany(REFRESH_SUMMARY, [{"phone": p} for p in {row[1] for row in batch}])
+
+        self._transaction(work)
+        self.rows_written += len(batch)
+
+    def _pending(self) -> int:
+        return (len(self._messages) + len(self._contacts) + len(self._optouts) + len(self._conversations)
+                + len(self._rollups))
+
+    def _schedule(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if self._task is not None and loop is not self._loop:
+            # called from a worker thread: asyncio events are not thread-safe, let the loop wake the flusher
+            self._loop.call_soon_threadsafe(self._schedule)
+            return
+        if self._task is None:
+            if loop is None:
+                # no event loop (scripts, shell) and no flusher to race with: write through
+                self._write(self._swap())
+                self._inflight_phones.clear()
+                self._inflight_convs.clear()
+                self._inflight_contacts.clear()
+                return
+            self.start()
+        self._wake.set()
+        if self._pending() >= self.batch:
+            self._full.set()
+
+    # ------------------ flushing ------------------
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wake, self._full, self._flush_lock = asyncio.Event(), asyncio.Event(), asyncio.Lock()
+        if self._pending():
+            self._wake.set()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            if self.flush_interval > 0:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._wake.clear()
+            self._full.clear()
+            await self.flush()
+
+    def _swap(self) -> Dict[str, Any]:
+        batch = {
+            "messages": self._messages, "contacts": self._contacts,
+            "optouts": self._optouts, "conversations": self._conversations, "rollups": self._rollups,
+        }
+        self._inflight_phones |= self._dirty_phones
+        self._inflight_convs |= set(self._conversations)
+        self._inflight_contacts |= set(self._contacts)
+        self._messages, self._contacts, self._optouts, self._conversations = {}, {}, {}, {}
+        self._rollups = Rollups()
+        self._dirty_phones = set()
+        return batch
+
+    def _restore(self, batch: Dict[str, Any]):
+        # put a failed batch back without clobbering anything newer
+        for name in ("messages", "contacts", "optouts", "conversations"):
+            pending = getattr(self, f"_{name}")
+            for key, row in batch[name].items():
+                pending.setdefault(key, row)
+        self._rollups.merge(batch["rollups"])  # deltas add up in any order
+        self._dirty_phones |= {row[1] for row in batch["messages"].values()}
+
+    def _transaction(self, work: Callable[[sqlite3.Connection], None]):
+        # one writer connection, shared by the flusher and bulk imports
+        self.open()  # the schema has to exist before the first write
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self._connect()
+            conn = self._writer
+            started = time.perf_counter()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                work(conn)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            metrics.STORE_WRITE_LATENCY.observe(time.perf_counter() - started)
+
+    def _write(self, batch: Dict[str, Any]):
+        if not any(batch.values()):
+            return
+        started = time.perf_counter()
+        optouts = batch["optouts"]
+        now = _ts(datetime.utcnow())
+
+        def work(conn: sqlite3.Connection):
+            conn.executemany(UPSERT_MESSAGE, batch["messages"].values())
+            conn.executemany(UPSERT_CONTACT, batch["contacts"].values())
+            conn.executemany("INSERT OR IGNORE INTO optouts (phone, created_at) VALUES (?, ?)",
+                             [(p, now) for p, out in optouts.items() if out])
+            conn.executemany("DELETE FROM optouts WHERE phone = ?", [(p,) for p, out in optouts.items() if not out])
+            conn.executemany(UPSERT_CONVERSATION, batch["conversations"].values())
+            phones = {row[1] for row in batch["messages"].values()}
+            conn.executemany(REFRESH_SUMMARY, [{"phone": p} for p in phones])
+            analytics.write_sqlite(conn, batch["rollups"])
+
+        self._transaction(work)
+        self.flushes += 1
+        self.rows_written += sum(len(v) for v in batch.values())
+        self.last_flush_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    async def flush(self):
+        """Write everything pending now (also used on shutdown)."""
+        if self._flush_lock is None:
+            self._write(self._swap())
+            self._inflight_phones.clear()
+            self._inflight_convs.clear()
+            self._inflight_contacts.clear()
+            return
+        async with self._flush_lock:
+            batch = self._swap()
+            try:
+                await asyncio.to_thread(self._write, batch)
+            except Exception:
+                self.flush_errors += 1
+                self._restore(batch)
+                # a quiet server may see no other write to wake the flusher: schedule the retry
+                self._retry_s = min(max(self._retry_s * 2, 0.5), STORE_RETRY_MAX_MS / 1000)
+                log.exception("store flush failed; retrying in %.1fs", self._retry_s)
+                asyncio.get_running_loop().call_later(self._retry_s, self._wake.set)
+            else:
+                self._retry_s = 0.0
+            finally:
+                self._inflight_phones.clear()
+                self._inflight_convs.clear()
+                self._inflight_contacts.clear()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "sqlite",
+            "persistent": True,
+            "path": self.path,
+            "pending": self._pending(),
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "flush_errors": self.flush_errors,
+            "last_flush_ms": self.last_flush_ms,
+            "flush_interval_ms": self.flush_interval * 1000,
+        }
+
+
+def open_store():
+    if STORE_BACKEND == "memory":
+        return MemoryStore()
+    if STORE_BACKEND == "sqlite":
+        return SQLiteStore()
+    raise RuntimeError(f"Unknown STORE_BACKEND {STORE_BACKEND!r} (expected sqlite or memory)")
@@ -0,0 +1,299 @@
+# metrics.py
+# Dependency-free Prometheus text-format metrics, shared by main.py and ai_chat.py.
+# Hot-path cost is one perf_counter pair and a dict update; gauges are only computed at scrape time.
+import os, sys, threading, time
+from bisect import bisect_left
+from collections import Counter as _Tally, defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+
+# ------------------ Config ------------------
+# Opt-in stack sampler for the event-loop thread (0 = off)
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "0"))
+PROFILER_MAX_DEPTH   = int(os.getenv("PROFILER_MAX_DEPTH", "40"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DB_BUCKETS      = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(v: Any) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[Any, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+# ------------------ Metric types ------------------
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labels)
+        self._values: Dict[Tuple, float] = defaultdict(float)
+
+    def inc(self, *labels: Any, amount: float = 1.0):
+        self._values[labels] += amount
+
+    def samples(self):
+        for key, v in self._values.items():
+            yield self.name, _labels(self.labelnames, key), v
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        # per label set: [count per bucket (+Inf last), sum]
+        self._series: Dict[Tuple, List] = {}
+
+    def observe(self, value: float, *labels: Any):
+        s = self._series.get(labels)
+        if s is None:
+            s = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        s[0][bisect_left(self.buckets, value)] += 1
+        s[1] += value
+
+    def samples(self):
+        for key, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, n in zip((*self.buckets, "+Inf"), counts):
+                cumulative += n
+                yield f"{self.name}_bucket", _labels(self.labelnames, key, f'le="{bound}"'), cumulative
+            yield f"{self.name}_sum", _labels(self.labelnames, key), total
+            yield f"{self.name}_count", _labels(self.labelnames, key), cumulative
+
+
+class Gauge:
+    """Read at scrape time from `fn`, which returns a number or {label value: number}."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable[[], Any], label: Optional[str] = None):
+        self.name, self.help, self.fn = name, help, fn
+        self.labelnames = (label,) if label else ()
+
+    def samples(self):
+        value = self.fn()
+        if isinstance(value, dict):
+            for k, v in value.items():
+                yield self.name, _labels(self.labelnames, (k,)), v
+        else:
+            yield self.name, "", value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+
+    def register(self, metric):
+        # re-registering (module reloads, both apps in one process) keeps the first instance
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Iterable[str] = (), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, fn: Callable[[], Any], label: Optional[str] = None) -> Gauge:
+        self._metrics.pop(name, None)  # the latest callback wins
+        return self.register(Gauge(name, help, fn, label))
+
+    def render(self) -> str:
+        out: List[str] = []
+        for m in self._metrics.values():
+            out.append(f"# HELP {m.name} {m.help}")
+            out.append(f"# TYPE {m.name} {m.kind}")
+            try:
+                for name, labels, value in m.samples():
+                    out.append(f"{name}{labels} {value}")
+            except Exception as e:  # a broken gauge must not take the scrape down
+                out.append(f"# error collecting {m.name}: {_escape(e)}")
+        return "\n".join(out) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_LATENCY = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template.",
+    ("method", "route", "status"),
+)
+
+LLM_LATENCY = REGISTRY.histogram(
+    "llm_request_duration_seconds", "LLM completion latency by model (streams: until the last token).",
+    ("model", "status"),
+)
+LLM_FIRST_TOKEN = REGISTRY.histogram(
+    "llm_first_token_seconds", "Time to the first streamed token by model.", ("model",),
+)
+LLM_TOKENS = REGISTRY.counter(
+    "llm_tokens_total", "Tokens reported in the provider's `usage` field.", ("model", "kind"),
+)
+REPAIR_JSON_FAILURES = REGISTRY.counter(
+    "repair_json_failures_total", "LLM replies that could not be parsed as JSON.",
+)
+DB_QUERY_LATENCY = REGISTRY.histogram(
+    "db_query_duration_seconds", "Database statement latency by statement type.", ("op",), DB_BUCKETS,
+)
+DB_SESSION_LATENCY = REGISTRY.histogram(
+    "db_session_duration_seconds", "How long a request holds a database session.", (), LATENCY_BUCKETS,
+)
+STORE_QUERY_LATENCY = REGISTRY.histogram(
+    "store_query_duration_seconds", "main.py store (SQLite) read latency by statement type.", ("op",), DB_BUCKETS,
+)
+STORE_WRITE_LATENCY = REGISTRY.histogram(
+    "store_write_duration_seconds", "main.py store write transactions (flushes, bulk imports).", (), DB_BUCKETS,
+)
+
+
+# ------------------ Recording helpers ------------------
+
+def observe_llm(model: str, started: float, status: Any, usage: Optional[Dict[str, Any]] = None):
+    LLM_LATENCY.observe(time.perf_counter() - started, model, status)
+    if usage:
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if usage.get(kind):
+                LLM_TOKENS.inc(model, kind.split("_")[0], amount=usage[kind])
+
+
+def instrument_engine(sync_engine):
+    """Time every statement on a SQLAlchemy engine (pass `async_engine.sync_engine` for async ones)."""
+    from sqlalchemy import event
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _stop(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["_query_start"].pop()
+        op = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        DB_QUERY_LATENCY.observe(time.perf_counter() - started, op)
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware (no BaseHTTPMiddleware task hop, streaming untouched).
+    Labels by route template, so /threads/{phone} is one series rather than one per phone.
+    """
+
+    in_flight = 0
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        MetricsMiddleware.in_flight += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            MetricsMiddleware.in_flight -= 1
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_LATENCY.observe(time.perf_counter() - started, scope["method"], route, status[0])
+
+
+REGISTRY.gauge("http_requests_in_flight", "Requests currently being served.", lambda: MetricsMiddleware.in_flight)
+
+
+# ------------------ Sampling profiler ------------------
+
+class StackSampler:
+    """
+    Samples the stack of one thread (the event loop) every `interval` seconds from a
+    daemon thread and keeps collapsed-stack counts, ready for flamegraph.pl / speedscope.
+    """
+
+    def __init__(self, interval: float, max_depth: int = PROFILER_MAX_DEPTH):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks: _Tally = _Tally()
+        self.samples = 0
+        self._target: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._target = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            names: List[str] = []
+            while frame is not None and len(names) < self.max_depth:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+                self.samples += 1
+
+    def collapsed(self, top: int = 0) -> str:
+        items = self.stacks.most_common(top or None)
+        return "".join(f"{stack} {n}\n" for stack, n in items)
+
+
+profiler: Optional[StackSampler] = None
+
+
+def start_profiler():
+    # call from the event-loop thread (app lifespan)
+    global profiler
+    if PROFILER_INTERVAL_MS > 0 and profiler is None:
+        profiler = StackSampler(PROFILER_INTERVAL_MS / 1000)
+        profiler.start()
+
+
+def stop_profiler():
+    global profiler
+    if profiler is not None:
+        profiler.stop()
+        profiler = None
+
+
+# ------------------ Wiring ------------------
+
+def install(app: FastAPI):
+    """Add the timing middleware plus GET /metrics and GET /metrics/profile to `app`."""
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics_endpoint():
+        # on the event loop, like the code that mutates the caches the gauges read
+        return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+    @app.get("/metrics/profile", include_in_schema=False)
+    def profile_endpoint(top: int = 0):
+        if profiler is None:
+            return PlainTextResponse("profiler disabled; set PROFILER_INTERVAL_MS to enable\n", status_code=404)
+        return PlainTextResponse(profiler.collapsed(top))
@@ -0,0 +1,93 @@
+# ndjson.py
+# Streaming NDJSON helpers for bulk endpoints: parse request bodies line by line and
+# serialize rows without building the whole payload in memory.
+import codecs, json, os, time
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+EXPORT_BATCH = int(os.getenv("EXPORT_BATCH", "1000"))   # rows fetched per server-side cursor round trip
+IMPORT_BATCH = int(os.getenv("IMPORT_BATCH", "5000"))   # rows per insert transaction
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, str]]:
+    """(line_no, line) for a streamed UTF-8 body; the last line may lack a newline."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    buf, line_no = "", 0
+    async for chunk in chunks:
+        *lines, buf = (buf + decoder.decode(chunk)).split("\n")
+        for line in lines:
+            line_no += 1
+            yield line_no, line
+    buf += decoder.decode(b"", final=True)
+    if buf:
+        yield line_no + 1, buf
+
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, Optional[Dict[str, Any]], Optional[str]]]:
+    """(line_no, object, error) per non-blank line."""
+    async for line_no, line in iter_lines(chunks):
+        if not line.strip():
+            continue
+        try:
+            obj = json.loads(line)
+        except ValueError as e:
+            yield line_no, None, f"invalid JSON: {e}"
+            continue
+        if not isinstance(obj, dict):
+            yield line_no, None, "expected a JSON object"
+            continue
+        yield line_no, obj, None
+
+
+def _default(v: Any):
+    if isinstance(v, datetime):
+        return v.isoformat()
+    return str(v)
+
+
+def dumps_line(obj: Dict[str, Any]) -> str:
+    return json.dumps(obj, ensure_ascii=False, default=_default) + "\n"
+
+
+def parse_datetime(value: Any) -> Optional[datetime]:
+    """ISO-8601 (a trailing Z is accepted) -> naive UTC datetime, like created_at columns."""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value
+    dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if dt.tzinfo is not None:
+        dt = (dt - dt.utcoffset()).replace(tzinfo=None)
+    return dt
+
+
+class BulkReport:
+    """Counts for one bulk import; `done` / `key` name the success counter and the row key in the result."""
+
+    max_errors = 100
+
+    def __init__(self, done: str = "imported", key: str = "key"):
+        self.done_field, self.key_field = done, key
+        self.started = time.perf_counter()
+        self.rows = 0
+        self.done = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, line_no: int, reason: str, key: Optional[str] = None):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line_no, self.key_field: key, "error": reason})
+
+    def result(self) -> Dict[str, Any]:
+        seconds = time.perf_counter() - self.started
+        return {
+            "ok": self.error_count == 0,
+            "rows": self.rows,
+            self.done_field: self.done,
+            "error_count": self.error_count,
+            "errors": self.errors,
+            "seconds": round(seconds, 3),
+            "rows_per_sec": round(self.rows / seconds, 1) if seconds else 0.0,
+        }
@@ -0,0 +1,30 @@
+# pagination.py
+import base64, json
+from datetime import datetime
+from typing import Any, Optional, Tuple
+
+from fastapi import HTTPException
+
+# Keyset cursors are opaque to clients: base64url(JSON [sort_value, tiebreaker]).
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(value: Any, key: Any) -> str:
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, key], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str], as_datetime: bool = True) -> Optional[Tuple[Any, Any]]:
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, key = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if as_datetime and value is not None:
+            value = datetime.fromisoformat(value)
+        return value, key
+    except Exception:
+        raise HTTPException(400, "Invalid cursor")
@@ -141,15 +141,15 @@ export default function AIChat({ context, phone }: AIChatProps) {
         // document_url: could be added if you upload PDFs to storage first
       };
 
-      console.log(`Sending payload to ${API_BASE}/pm_chat:`, payload);
+      console.log(`Sending payload to ${API_BASE}/pm_chat/stream:`, payload);
 
-      const response = await fetch(`${API_BASE}/pm_chat`, {
+      const response = await fetch(`${API_BASE}/pm_chat/stream`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify(payload),
       });
 
-      if (!response.ok) {
+      if (!response.ok || !response.body) {
         const errorData = await response.json().catch(() => ({}));
         throw new Error(
           errorData.detail ||
@@ -157,8 +157,36 @@ export default function AIChat({ context, phone }: AIChatProps) {
         );
       }
 
-      const { reply } = await response.json();
-      setMessages((prev) => [...prev, { role: "assistant", content: reply }]);
+      // Server-Sent Events: grow an assistant bubble as deltas arrive
+      const setReply = (update: (content: string) => string) =>
+        setMessages((prev) => {
+          const next = [...prev];
+          const last = next[next.length - 1];
+          next[next.length - 1] = { ...last, content: update(last.content) };
+          return next;
+        });
+      setMessages((prev) => [...prev, { role: "assistant", content: "" }]);
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffered = "";
+      for (;;) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffered += decoder.decode(value, { stream: true });
+        let sep: number;
+        while ((sep = buffered.indexOf("\n\n")) >= 0) {
+          const frame = buffered.slice(0, sep);
+          buffered = buffered.slice(sep + 2);
+          const event = /^event: (.*)$/m.exec(frame)?.[1] ?? "message";
+          const data = /^data: (.*)$/m.exec(frame)?.[1];
+          if (!data) continue;
+          const parsed = JSON.parse(data);
+          if (event === "error") throw new Error(parsed.detail);
+          if (event === "done") setReply(() => parsed.reply);
+          else if (parsed.delta) setReply((c) => c + parsed.delta);
+        }
+      }
       clearUpload();
     } catch (err: unknown) {
       console.error("AI communication error:", err);
@@ -2,21 +2,30 @@
 
 import { useEffect, useState } from "react";
 import SectionCard from "@/components/SectionCard";
-import { getThread } from "@/lib/api";
+import { getThread, subscribeThread } from "@/lib/api";
 import type { SmsMsg } from "@/lib/types";
 
 export default function RecentRequests({ phone }: { phone: string }) {
   const [reqs, setReqs] = useState<SmsMsg[]>([]);
 
+  function recent(msgs: SmsMsg[]) {
+    return msgs
+      .filter((m) => m.category)
+      .sort((a, b) => (a.created_at > b.created_at ? -1 : 1))
+      .slice(0, 8);
+  }
+
   async function load() {
-    const all = await getThread(phone);
-    const withCls = all.filter((m) => m.category);
-    setReqs(
-      withCls.sort((a, b) => (a.created_at > b.created_at ? -1 : 1)).slice(0, 8)
-    );
+    setReqs(recent(await getThread(phone)));
   }
   useEffect(() => {
-    if (phone) load();
+    if (!phone) return;
+    load();
+    return subscribeThread(phone, (e) => {
+      if (e.type === "reset") load();
+      else if (e.type === "message.classified")
+        setReqs((prev) => recent([e.message, ...prev.filter((m) => m.sid !== e.sid)]));
+    });
   }, [phone]);
 
   return (
@@ -3,7 +3,7 @@
 import { useEffect, useState } from "react";
 import SectionCard from "@/components/SectionCard";
 import { clsx, pretty } from "@/lib/utils";
-import { getThread } from "@/lib/api";
+import { applyFeedEvent, getThread, subscribeThread } from "@/lib/api";
 import type { SmsMsg } from "@/lib/types";
 
 export default function TextHistory({ phone }: { phone: string }) {
@@ -19,7 +19,12 @@ export default function TextHistory({ phone }: { phone: string }) {
     }
   }
   useEffect(() => {
-    if (phone) load();
+    if (!phone) return;
+    load();
+    // pushed updates instead of polling; a reset means we missed some, so re-fetch
+    return subscribeThread(phone, (e) =>
+      e.type === "reset" ? load() : setMsgs((prev) => applyFeedEvent(prev, e))
+    );
   }, [phone]);
 
   return (
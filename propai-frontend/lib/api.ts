@@ -1,21 +1,25 @@
-import type { ClassifyResult, Context, SmsMsg } from "@/lib/types";
+import type { ClassifyResult, Context, Page, SmsMsg } from "@/lib/types";
 
 const BACKEND_URL =
   process.env.NEXT_PUBLIC_BACKEND_URL || "http://127.0.0.1:8000";
 
-export async function getThread(phone: string): Promise<SmsMsg[]> {
+// Latest page of a thread, returned oldest-first for display.
+export async function getThread(phone: string, limit = 50): Promise<SmsMsg[]> {
   const res = await fetch(
-    `${BACKEND_URL}/threads/${encodeURIComponent(phone)}`
+    `${BACKEND_URL}/threads/${encodeURIComponent(phone)}?limit=${limit}`
   );
   if (!res.ok) return [];
-  return res.json();
+  const page: Page<SmsMsg> = await res.json();
+  return page.items.reverse();
 }
 
 export async function classify(
   thread: string[],
-  context: Context
+  context: Context,
+  fresh = false
 ): Promise<ClassifyResult> {
-  const res = await fetch(`${BACKEND_URL}/classify`, {
+  const qs = fresh ? "?fresh=true" : "";
+  const res = await fetch(`${BACKEND_URL}/classify${qs}`, {
     method: "POST",
     headers: { "Content-Type": "application/json" },
     body: JSON.stringify({ thread, context }),
@@ -23,3 +27,40 @@ export async function classify(
   if (!res.ok) throw new Error(await res.text());
   return res.json();
 }
+
+export type FeedEvent =
+  | { type: "message.created" | "message.classified"; sid: string; phone: string; message: SmsMsg }
+  | { type: "message.status"; sid: string; phone: string; status: string; previous: string }
+  | { type: "reset" };
+
+// Live changes to one thread over Server-Sent Events. EventSource reconnects by itself and
+// resumes after the last event it saw; "reset" means events were missed, so re-fetch.
+export function subscribeThread(
+  phone: string,
+  onEvent: (e: FeedEvent) => void
+): () => void {
+  const source = new EventSource(
+    `${BACKEND_URL}/events?phone=${encodeURIComponent(phone)}`
+  );
+  for (const type of ["message.created", "message.classified", "message.status"]) {
+    source.addEventListener(type, (e) =>
+      onEvent({ type, ...JSON.parse((e as MessageEvent).data) } as FeedEvent)
+    );
+  }
+  source.addEventListener("reset", () => onEvent({ type: "reset" }));
+  return () => source.close();
+}
+
+// Apply a feed event to an oldest-first thread.
+export function applyFeedEvent(msgs: SmsMsg[], e: FeedEvent): SmsMsg[] {
+  if (e.type === "message.created") {
+    return msgs.some((m) => m.sid === e.sid) ? msgs : [...msgs, e.message];
+  }
+  if (e.type === "message.classified") {
+    return msgs.map((m) => (m.sid === e.sid ? e.message : m));
+  }
+  if (e.type === "message.status") {
+    return msgs.map((m) => (m.sid === e.sid ? { ...m, status: e.status } : m));
+  }
+  return msgs;
+}
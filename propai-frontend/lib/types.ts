@@ -25,6 +25,13 @@ export type SmsMsg = {
   ai_reply?: string;
 };
 
+// Newest-first keyset page; next_cursor → ?before=, prev_cursor → ?after=
+export type Page<T> = {
+  items: T[];
+  next_cursor?: string | null;
+  prev_cursor?: string | null;
+};
+
 export type ClassifyResult = {
   category: "maintenance" | "rent" | "general" | "emergency" | "other";
   priority: "low" | "normal" | "high" | "critical";
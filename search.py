@@ -0,0 +1,137 @@
+# search.py
+# SQLite FTS5 index over messages.body / messages.ai_reply, shared by main.py (via message_store)
+# and ai_chat.py. Triggers keep it in sync with every insert, update and delete, whoever writes.
+import logging, os, re, sqlite3
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+SNIPPET_TOKENS     = 12
+# sort=rank without phone/date filters scores only the newest N matches, bounding near-stopword queries (0 = all)
+SEARCH_RANK_WINDOW = int(os.getenv("SEARCH_RANK_WINDOW", "20000"))
+_TS = "%Y-%m-%d %H:%M:%S.%f"  # how both apps store created_at in SQLite
+
+# External-content table: the text lives once, in `messages`; the index holds only postings.
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    body, ai_reply, content='messages', content_rowid='id', tokenize='porter unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, body, ai_reply) VALUES (new.id, new.body, new.ai_reply);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, body, ai_reply) VALUES ('delete', old.id, old.body, old.ai_reply);
+END;
+-- status-only updates (delivery callbacks, upserts that rewrite the same text) leave the index alone
+CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF body, ai_reply ON messages
+WHEN old.body IS NOT new.body OR old.ai_reply IS NOT new.ai_reply BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, body, ai_reply) VALUES ('delete', old.id, old.body, old.ai_reply);
+    INSERT INTO messages_fts (rowid, body, ai_reply) VALUES (new.id, new.body, new.ai_reply);
+END;
+"""
+
+# body matches count double an ai_reply match
+RANK_CONFIG = "INSERT INTO messages_fts (messages_fts, rank) VALUES ('rank', 'bm25(2.0, 1.0)')"
+
+HIT_FIELDS = ("id", "sid", "phone", "direction", "body", "ai_reply", "category", "priority", "status",
+              "created_at", "snippet", "score")
+
+
+def ensure_fts(conn: sqlite3.Connection) -> bool:
+    """Create the index and triggers (building it from existing rows once). False when FTS5 is unavailable."""
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'").fetchone()
+    try:
+        conn.executescript(FTS_SCHEMA)
+    except sqlite3.OperationalError as e:
+        log.warning("full-text search disabled: %s", e)
+        return False
+    if not exists:
+        conn.execute(RANK_CONFIG)
+        conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+        conn.commit()
+    return True
+
+
+def match_expr(q: str) -> str:
+    """
+    User text -> FTS5 query: every word must appear (any column), "quoted phrases"
+    match in order, a trailing * makes a prefix search. Operators are not exposed.
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', q):
+        prefix = word.endswith("*")
+        text = (phrase or word).replace('"', " ").strip("* ")
+        if text:
+            terms.append(f'"{text}"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+def build_search(q: str, *, phone: Optional[str] = None, category: Optional[str] = None,
+                 priority: Optional[str] = None, since: Optional[datetime] = None,
+                 until: Optional[datetime] = None, sort: str = "rank", before: Optional[Tuple[Any, Any]] = None,
+                 limit: int = 50, where: Iterable[str] = (), sid: bool = False) -> Tuple[str, Dict[str, Any]]:
+    """
+    SQL + named params for one page (limit + 1 rows, to detect a next page) in HIT_FIELDS order.
+    `sort` is "rank" (best first) or "recent" (last stored first); `before` is the (score, id)
+    or (created_at, id) of the previous page's last hit. `sid` selects main.py's provider sid
+    column (NULL otherwise).
+    """
+    filters = list(where)
+    params: Dict[str, Any] = {"q": match_expr(q), "limit": limit + 1}
+    for clause, name, value in (
+        ("m.phone = :phone", "phone", phone),
+        ("m.category = :category", "category", category),
+        ("m.priority = :priority", "priority", priority),
+        ("m.created_at >= :since", "since", since.strftime(_TS) if since else None),
+        ("m.created_at < :until", "until", until.strftime(_TS) if until else None),
+    ):
+        if value is not None:
+            filters.append(clause)
+            params[name] = value
+    clauses = ["messages_fts MATCH :q", *filters]
+    if sort == "rank":
+        # bm25 scores are negative; lower is better
+        order = "messages_fts.rank, m.id"
+        if SEARCH_RANK_WINDOW and phone is None and since is None and until is None:
+            # (phone / date filters already scope the search, and the window would only add a scan)
+            # find the window's oldest rowid without scoring (rowid order is native to FTS5), then a
+            # rowid range pushed into FTS5 means only that window of matches gets scored
+            window_filters = "".join(f" AND {c}" for c in filters)
+            clauses.append(
+                "messages_fts.rowid >= COALESCE((SELECT messages_fts.rowid FROM messages_fts "
+                "JOIN messages m ON m.id = messages_fts.rowid "
+                f"WHERE messages_fts MATCH :q{window_filters} "
+                "ORDER BY messages_fts.rowid DESC LIMIT 1 OFFSET :window), 0)"
+            )
+            params["window"] = SEARCH_RANK_WINDOW - 1
+        if before:
+            clauses.append("(messages_fts.rank > :after_v OR (messages_fts.rank = :after_v AND m.id > :after_id))")
+            params["after_v"], params["after_id"] = before
+    else:
+        # newest stored first: rowid order comes straight off the index, so LIMIT stops the scan early
+        order = "messages_fts.rowid DESC"
+        if before:
+            clauses.append("messages_fts.rowid < :after_id")
+            params["after_id"] = before[1]
+    sql = (
+        f"SELECT m.id, {'m.sid' if sid else 'NULL'}, m.phone, m.direction, m.body, m.ai_reply, m.category, "
+        f"m.priority, m.status, m.created_at, snippet(messages_fts, -1, '<mark>', '</mark>', '…', {SNIPPET_TOKENS}), messages_fts.rank "
+        "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+        f"WHERE {' AND '.join(clauses)} ORDER BY {order} LIMIT :limit"
+    )
+    return sql, params
+
+
+def page(rows: List[tuple], limit: int, sort: str) -> Tuple[List[Dict[str, Any]], Optional[Tuple[Any, Any]]]:
+    """Hit dicts for the page, plus the (sort value, id) to continue after, if there is more."""
+    hits = []
+    for r in rows[:limit]:
+        hit = dict(zip(HIT_FIELDS, r))
+        if isinstance(hit["created_at"], str):
+            hit["created_at"] = datetime.fromisoformat(hit["created_at"])
+        hits.append(hit)
+    if len(rows) <= limit or not hits:
+        return hits, None
+    last = hits[-1]
+    return hits, ((last["score"] if sort == "rank" else last["created_at"]), last["id"])
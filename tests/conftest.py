@@ -0,0 +1,11 @@
+# Point both apps at throwaway databases before anything imports them, and keep every
+# test away from the real LLM endpoint and media cache.
+import os, tempfile
+
+_tmp = tempfile.mkdtemp(prefix="prop-ai-tests-")
+os.environ.setdefault("STORE_DB", os.path.join(_tmp, "store.db"))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmp, 'ai_chat.db')}")
+os.environ.setdefault("MEDIA_DIR", os.path.join(_tmp, "media"))
+os.environ.setdefault("LLM_API_KEY", "test")
+os.environ.setdefault("LLM_URL", "http://127.0.0.1:9/unreachable")
+os.environ.setdefault("LLM_MAX_RETRIES", "0")
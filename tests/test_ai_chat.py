@@ -0,0 +1,31 @@
+import asyncio, json
+
+import httpx
+
+import ai_chat
+
+
+def test_create_message_reaches_a_connected_feed_subscriber():
+    phone = "+15557770001"
+
+    async def main():
+        async with ai_chat.app.router.lifespan_context(ai_chat.app):
+            events = ai_chat.feed.stream([phone])
+            assert "event: ready" in await events.__anext__()  # subscribed
+            transport = httpx.ASGITransport(app=ai_chat.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+                r = await c.post("/messages", json={"phone": phone, "direction": "inbound", "body": "door lock is jammed"})
+            frame = await asyncio.wait_for(events.__anext__(), 2)
+            await events.aclose()
+            return r, frame
+
+    r, frame = asyncio.run(main())
+    assert r.status_code == 200
+    created = r.json()
+    assert created["phone"] == phone and created["body"] == "door lock is jammed"
+    lines = dict(line.split(": ", 1) for line in frame.strip().splitlines())
+    assert lines["event"] == "message.created"
+    data = json.loads(lines["data"])
+    assert data["sid"] == created["id"] and data["phone"] == phone
+    assert data["message"]["body"] == "door lock is jammed"
+    assert data["message"]["created_at"] == created["created_at"]
@@ -0,0 +1,63 @@
+import asyncio, os, sqlite3, time
+
+from classify_cache import ClassificationCache, make_key
+
+OBJ = {"category": "maintenance", "priority": "normal", "action": "route_to_pm", "confidence": 0.8,
+       "reply": "Thanks, we'll send someone.", "entities": {"unit": "4B"}}
+
+
+def rows(path):
+    with sqlite3.connect(path) as db:
+        return db.execute("SELECT key, expires_at FROM classify_cache ORDER BY key").fetchall()
+
+
+def test_opens_the_database_lazily(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = ClassificationCache(db_path=path)
+    assert not os.path.exists(path)
+    cache.open()
+    assert rows(path) == []
+
+
+def test_hits_survive_a_restart(tmp_path):
+    path = str(tmp_path / "cache.db")
+    key = make_key(["the  sink is leaking "], {"unit": "4B"}, "v1")
+
+    async def write():
+        cache = ClassificationCache(db_path=path)
+        cache.set(key, OBJ)  # returns before the row is written
+        assert await cache.get(key) == OBJ
+        await cache.aclose()
+
+    async def read():
+        cache = ClassificationCache(db_path=path)
+        hit = await cache.get(make_key(["the sink is leaking"], {"unit": "4B"}, "v1"))
+        await cache.aclose()
+        return hit, cache.stats()
+
+    asyncio.run(write())
+    hit, stats = asyncio.run(read())
+    assert hit == OBJ and stats["hits"] == 1
+
+
+def test_expired_rows_are_deleted(tmp_path):
+    path = str(tmp_path / "cache.db")
+
+    async def main():
+        cache = ClassificationCache(db_path=path, ttl=0.05, purge_interval=0)
+        cache.set("a", OBJ)
+        cache.set("b", OBJ)
+        await cache.aclose()
+        await asyncio.sleep(0.1)
+        fresh = ClassificationCache(db_path=path, ttl=0.05, purge_interval=3600)
+        assert await fresh.get("a") is None  # expired: a miss, and the row goes
+        after_get = rows(path)
+        sweeper = ClassificationCache(db_path=path, ttl=60, purge_interval=0)
+        sweeper.set("c", OBJ)  # a write also sweeps everything that has expired
+        await sweeper.aclose()
+        await fresh.aclose()
+        return after_get, rows(path)
+
+    after_get, after_sweep = asyncio.run(main())
+    assert [k for k, _ in after_get] == ["b"]
+    assert [k for k, _ in after_sweep] == ["c"] and after_sweep[0][1] > time.time()
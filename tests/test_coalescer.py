@@ -0,0 +1,114 @@
+import asyncio
+
+from coalescer import BurstCoalescer
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def recorder(calls, hold=None):
+    async def handler(key, item):
+        calls.append((key, item))
+        if hold is not None and key in hold:
+            await hold[key].wait()
+    return handler
+
+
+def test_burst_is_debounced_to_latest_item():
+    async def main():
+        calls = []
+        c = BurstCoalescer(recorder(calls), window=0.05, max_wait=1.0, workers=2)
+        for i in range(5):
+            c.submit("K", i)
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.02)
+        assert calls == []  # still inside the quiet window
+        await asyncio.sleep(0.1)
+        await c.drain()
+        await c.stop()
+        return calls
+
+    assert run(main()) == [("K", 4)]
+
+
+def test_max_wait_caps_a_steady_stream():
+    async def main():
+        calls = []
+        c = BurstCoalescer(recorder(calls), window=0.05, max_wait=0.15, workers=1)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        i = 0
+        while not calls and loop.time() - started < 1.0:
+            c.submit("K", i)  # never quiet for a full window
+            i += 1
+            await asyncio.sleep(0.02)
+        elapsed = loop.time() - started
+        await c.stop()
+        return calls, elapsed
+
+    calls, elapsed = run(main())
+    assert calls and calls[0][0] == "K"
+    assert elapsed < 0.5
+
+
+def test_immediate_skips_the_window():
+    async def main():
+        calls = []
+        c = BurstCoalescer(recorder(calls), window=10, max_wait=10, workers=1)
+        c.submit("K", 1)
+        c.submit("K", 2, immediate=True)
+        await asyncio.sleep(0.05)
+        await c.stop()
+        return calls
+
+    assert run(main()) == [("K", 2)]
+
+
+def test_key_is_never_handled_concurrently():
+    async def main():
+        calls, active, overlap = [], set(), []
+
+        async def handler(key, item):
+            if key in active:
+                overlap.append(key)
+            active.add(key)
+            calls.append((key, item))
+            await asyncio.sleep(0.05)
+            active.discard(key)
+
+        c = BurstCoalescer(handler, window=0.01, max_wait=0.01, workers=4)
+        c.submit("K", 0)
+        await asyncio.sleep(0.02)  # first run in progress
+        c.submit("K", 1)
+        c.submit("K", 2)
+        await asyncio.sleep(0.2)
+        await c.drain()
+        await c.stop()
+        return calls, overlap
+
+    calls, overlap = run(main())
+    assert overlap == []
+    assert calls == [("K", 0), ("K", 2)]  # the items that arrived mid-run were coalesced
+
+
+def test_key_waiting_for_a_worker_is_not_queued_twice():
+    # regression: with every worker busy, a second submit for a key whose timer had already
+    # fired armed a new timer, so the key was queued twice and the second run got item None
+    async def main():
+        calls = []
+        hold = {"busy": asyncio.Event()}
+        c = BurstCoalescer(recorder(calls, hold), window=0.01, max_wait=0.01, workers=1)
+        c.submit("busy", 0)
+        await asyncio.sleep(0.03)   # the only worker is now stuck on "busy"
+        c.submit("K", 1)
+        await asyncio.sleep(0.03)   # K's timer fired; K sits in the ready queue
+        c.submit("K", 2)
+        await asyncio.sleep(0.03)
+        hold["busy"].set()
+        await asyncio.sleep(0.05)
+        await c.drain()
+        await c.stop()
+        return calls
+
+    assert run(main()) == [("busy", 0), ("K", 2)]
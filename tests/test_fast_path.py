@@ -0,0 +1,35 @@
+import main
+from llm_dispatch import BACKGROUND, INTERACTIVE, URGENT
+
+CTX = main.Context(tenant_name="Ana Ruiz", unit="4B", address="12 Elm St", hotline="555-0100")
+
+
+def test_unambiguous_hazards_skip_the_llm():
+    for text in ("I think there's a gas leak in the kitchen", "CO detector says carbon monoxide!",
+                 "the house is on fire"):
+        obj = main._fast_path(text, CTX)
+        assert obj is not None, text
+        assert (obj["category"], obj["priority"]) == ("emergency", "critical")
+        assert main._webhook_priority(text) == URGENT
+
+
+def test_bare_fire_and_flood_go_to_the_llm():
+    for text in ("fire alarm keeps chirping", "can you replace the flood light bulb?"):
+        assert main._fast_path(text, CTX) is None, text
+        assert main._webhook_priority(text) == INTERACTIVE
+    assert main._webhook_priority("the sink is slow") == BACKGROUND
+
+
+def test_start_is_only_an_opt_in_after_an_opt_out():
+    assert main._fast_path("START", CTX) is None
+    obj = main._fast_path("START", CTX, resubscribed=True)
+    assert obj is not None and "resubscribed" in obj["reply"]
+
+
+def test_opt_out_logic_reports_resubscription():
+    phone = "+15550009999"
+    assert main._apply_opt_out_logic("START", phone) is False
+    assert main._apply_opt_out_logic("STOP", phone) is False
+    assert phone in main.STORE["optouts"]
+    assert main._apply_opt_out_logic("start", phone) is True
+    assert phone not in main.STORE["optouts"]
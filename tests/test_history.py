@@ -0,0 +1,22 @@
+import asyncio
+
+import httpx
+
+import main
+
+
+def test_history_keeps_its_list_contract_and_the_summary_has_its_own_route(monkeypatch):
+    monkeypatch.setattr(main, "HISTORY_CHAR_BUDGET", 20)
+    for i in range(3):
+        main._append_history("Acme:4B", "user", f"message number {i}")
+
+    async def go():
+        async with main.app.router.lifespan_context(main.app):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+                return (await c.get("/history/Acme/4B")).json(), (await c.get("/history/Acme/4B/summary")).json()
+
+    turns, full = asyncio.run(go())
+    assert turns == [{"role": "user", "content": "message number 2"}]
+    assert full["messages"] == turns
+    assert "message number 0" in full["summary"] and "message number 1" in full["summary"]
@@ -0,0 +1,118 @@
+import asyncio, email.utils, time
+
+import httpx
+
+import llm_dispatch
+from llm_dispatch import BACKGROUND, BULK, INTERACTIVE, URGENT, LLMDispatcher, retry_after
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def response(status, **headers):
+    return httpx.Response(status, headers=headers, request=httpx.Request("POST", "http://llm.test/v1"))
+
+
+def test_waiters_are_served_by_priority_then_arrival():
+    async def main():
+        d = LLMDispatcher(concurrency=1)
+        order = []
+        await d.acquire(INTERACTIVE)  # occupy the only slot
+
+        async def call(name, priority):
+            await d.acquire(priority)
+            order.append(name)
+            d.release()
+
+        tasks = []
+        for name, priority in (("bulk", BULK), ("background", BACKGROUND), ("chat-1", INTERACTIVE),
+                               ("urgent", URGENT), ("chat-2", INTERACTIVE)):
+            tasks.append(asyncio.create_task(call(name, priority)))
+            await asyncio.sleep(0)  # queue them in this order
+        assert d.depth() == {"urgent": 1, "interactive": 2, "background": 1, "bulk": 1, "in_flight": 1}
+        d.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert run(main()) == ["urgent", "chat-1", "chat-2", "background", "bulk"]
+
+
+def test_a_cancelled_waiter_does_not_hold_the_queue():
+    async def main():
+        d = LLMDispatcher(concurrency=1)
+        await d.acquire()
+        gone = asyncio.create_task(d.acquire(URGENT))
+        await asyncio.sleep(0)
+        gone.cancel()
+        later = asyncio.create_task(d.acquire(BULK))
+        await asyncio.sleep(0)
+        d.release()
+        await asyncio.wait_for(later, 1)
+        return d.in_flight
+
+    assert run(main()) == 1
+
+
+def test_retry_after_header_formats():
+    assert retry_after(response(429, **{"Retry-After": "7"})) == 7.0
+    date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 25 < retry_after(response(429, **{"Retry-After": date})) <= 30
+    assert retry_after(response(429, **{"Retry-After": "soon"})) is None
+    assert retry_after(response(429)) is None
+
+
+def test_429_pauses_every_caller_for_retry_after(monkeypatch):
+    monkeypatch.setattr(llm_dispatch, "LLM_BACKOFF_BASE", 0.01)
+
+    async def main():
+        d = LLMDispatcher(max_retries=2)
+        replies = [response(429, **{"Retry-After": "0.3"}), response(200)]
+        sent = []
+
+        async def limited():
+            sent.append(time.monotonic())
+            return replies.pop(0)
+
+        async def other():
+            sent.append(time.monotonic())
+            return response(200)
+
+        started = time.monotonic()
+        first = asyncio.create_task(d.send(limited, priority=BULK))
+        await asyncio.sleep(0.05)  # the 429 is in; the dispatcher is paused
+        second = await d.send(other, priority=URGENT)
+        r = await first
+        return started, sent, r, second, d.stats
+
+    started, sent, r, second, stats = run(main())
+    assert r.status_code == 200 and second.status_code == 200
+    assert sent[1] - started >= 0.3  # the other caller waited out the pause too
+    assert sent[2] - started >= 0.3
+    assert stats["rate_limited"] == 1 and stats["retried"] == 1
+
+
+def test_gives_up_when_retry_after_is_too_long_or_retries_run_out(monkeypatch):
+    monkeypatch.setattr(llm_dispatch, "LLM_BACKOFF_BASE", 0.001)
+    monkeypatch.setattr(llm_dispatch, "LLM_MAX_RETRY_AFTER", 5)
+
+    async def main():
+        d = LLMDispatcher(max_retries=2)
+        calls = []
+
+        async def too_long():
+            calls.append("too_long")
+            return response(429, **{"Retry-After": "3600"})
+
+        async def down():
+            calls.append("down")
+            return response(503)
+
+        a = await d.send(too_long)
+        b = await d.send(down)
+        return a, b, calls, d.stats
+
+    a, b, calls, stats = run(main())
+    assert a.status_code == 429 and b.status_code == 503
+    assert calls == ["too_long", "down", "down", "down"]  # 503: the first try plus max_retries
+    assert stats["failed"] == 2
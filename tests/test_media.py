@@ -0,0 +1,170 @@
+import asyncio, io, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from PIL import Image
+
+import llm_client
+import media
+from media import MediaError, MediaStore
+
+
+def png(width, height, color=(200, 40, 40)) -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", (width, height), color).save(out, "PNG")
+    return out.getvalue()
+
+
+LARGE = png(2000, 1000)
+SMALL = png(40, 30, (10, 120, 10))
+
+# path -> (status, headers, body): a stand-in for Twilio's media URLs
+ROUTES = {
+    "/large.png": (200, {"Content-Type": "image/png"}, LARGE),
+    "/same-as-large.png": (200, {"Content-Type": "image/png"}, LARGE),
+    "/small.png": (200, {"Content-Type": "image/png"}, SMALL),
+    "/page.html": (200, {"Content-Type": "text/html"}, b"<html>not a photo</html>"),
+    "/hop": (302, {"Location": "/small.png"}, b""),
+    "/loop": (302, {"Location": "/loop"}, b""),
+    "/internal": (302, {"Location": "http://169.254.169.254/latest/meta-data/"}, b""),
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        status, headers, body = ROUTES.get(self.path, (404, {}, b""))
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return MediaStore(root=str(tmp_path), max_side=256, allow_private=True)
+
+
+def run(coro):
+    async def main():
+        try:
+            return await coro
+        finally:
+            await llm_client.shutdown()  # its pool belongs to this event loop
+    return asyncio.run(main())
+
+
+async def no_call(*args, **kwargs):
+    raise AssertionError("the model should not be called")
+
+
+def test_downscales_to_max_side(server, store):
+    digest, mime = run(store.resolve(f"{server}/large.png"))
+    assert mime == "image/jpeg"
+    with Image.open(store._path(digest, ".jpg")) as im:
+        assert im.format == "JPEG"
+        assert im.size == (256, 128)
+
+
+def test_same_bytes_at_two_urls_are_stored_once(server, store):
+    async def main():
+        a = await store.resolve(f"{server}/large.png")
+        b = await store.resolve(f"{server}/same-as-large.png")
+        again = await store.resolve(f"{server}/large.png")
+        return a, b, again
+
+    a, b, again = run(main())
+    assert a == b == again
+    assert store.stats["fetches"] == 2   # each URL downloaded once
+    assert store.stats["file_hits"] == 1  # the second URL's bytes were already on disk
+    assert store.stats["url_hits"] == 1
+
+
+def test_download_cap(server, store, monkeypatch):
+    monkeypatch.setattr(media, "MEDIA_MAX_BYTES", len(LARGE) - 1)
+    with pytest.raises(MediaError, match="too large"):
+        run(store.resolve(f"{server}/large.png"))
+    assert run(store.resolve(f"{server}/small.png"))[1] == "image/jpeg"
+
+
+def test_rejects_non_image_content_type(server, store):
+    with pytest.raises(MediaError, match="not an image"):
+        run(store.resolve(f"{server}/page.html"))
+
+
+def test_falls_back_to_the_raw_url(server, store):
+    url = f"{server}/page.html"
+    assert run(store.image_parts(url, "vision", no_call)) == [{"type": "image_url", "image_url": {"url": url}}]
+    missing = f"{server}/missing.png"
+    fallback = {"type": "text", "text": "photo unavailable"}
+    assert run(store.image_parts(missing, "vision", no_call, fallback)) == [fallback]
+
+
+def test_reuses_the_description_for_the_same_image(server, store):
+    prompts = []
+
+    async def describe(messages, model, priority):
+        prompts.append(model)
+        return "A bathroom ceiling with a brown water stain."
+
+    async def main():
+        first = await store.image_parts(f"{server}/large.png", "vision", describe)
+        await asyncio.gather(*store._describing.values())
+        # another URL with the same bytes, same model: the description stands in for the pixels
+        second = await store.image_parts(f"{server}/same-as-large.png", "vision", no_call)
+        # a different model has not described it yet
+        third = await store.image_parts(f"{server}/large.png", "other-vision", describe)
+        await asyncio.gather(*store._describing.values())
+        return first, second, third
+
+    first, second, third = run(main())
+    assert first[0]["type"] == "image_url" and first[0]["image_url"]["url"].startswith("data:image/jpeg;base64,")
+    assert second == [{"type": "text", "text": "Attached photo (described earlier): "
+                                               "A bathroom ceiling with a brown water stain."}]
+    assert third[0]["type"] == "image_url"
+    assert prompts == ["vision", "other-vision"]
+    assert store.stats["description_hits"] == 1
+
+
+def test_follows_redirects(server, store):
+    digest, _ = run(store.resolve(f"{server}/hop"))
+    assert digest == run(store.resolve(f"{server}/small.png"))[0]
+    with pytest.raises(MediaError, match="too many redirects"):
+        run(store.resolve(f"{server}/loop"))
+
+
+def test_refuses_non_http_and_private_addresses(server, tmp_path):
+    guarded = MediaStore(root=str(tmp_path), allow_private=False)
+    for url in ("file:///etc/passwd", "ftp://example.com/a.png", f"{server}/small.png",
+                "http://169.254.169.254/latest/meta-data/", "http://[::1]/a.png", "http://10.0.0.7/a.png"):
+        with pytest.raises(MediaError):
+            run(guarded.resolve(url))
+    assert guarded.stats["fetches"] == 0
+
+
+def test_checks_every_redirect_hop(server, store):
+    checked = []
+    check = store._check_url
+
+    async def spy(url):
+        checked.append(url)
+        if "169.254." in url:
+            raise MediaError("non-public address")
+        await check(url)
+
+    store._check_url = spy
+    with pytest.raises(MediaError, match="non-public"):
+        run(store.resolve(f"{server}/internal"))
+    assert checked == [f"{server}/internal", "http://169.254.169.254/latest/meta-data/"]
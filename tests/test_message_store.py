@@ -0,0 +1,201 @@
+import asyncio, threading
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+import analytics
+from contacts import CONTACT_FIELDS
+from message_store import SQLiteStore
+
+T0 = datetime(2024, 5, 1, 9, 0)
+
+
+def message(sid, body="hello", status="received", minutes=0):
+    return SimpleNamespace(
+        sid=sid, direction="inbound", to="+15550000000", from_="+15551110000", body=body,
+        media_urls=[], status=status, created_at=T0 + timedelta(minutes=minutes), ai_reply=None,
+        category=None, priority=None, action=None, confidence=None, entities=None, metadata={},
+    )
+
+
+def sids(store, phone="+1555"):
+    return [m["sid"] for m in store.load_thread(phone)]
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "store.db")
+
+
+def test_writes_are_buffered_until_the_flush_interval(path):
+    async def main():
+        s = SQLiteStore(path, flush_interval=0.1, batch=1000)
+        s.open()
+        s.start()
+        s.save_message("+1555", message("SM1"))
+        s.save_message("+1555", message("SM1", status="delivered"))  # latest row per key wins
+        before = sids(s), s.thread_dirty("+1555")
+        await asyncio.sleep(0.3)
+        after = s.load_thread("+1555"), s.thread_dirty("+1555"), s.stats()
+        await s.stop()
+        return before, after
+
+    (before_sids, dirty), (rows, dirty_after, stats) = asyncio.run(main())
+    assert before_sids == [] and dirty
+    assert [(r["sid"], r["status"]) for r in rows] == [("SM1", "delivered")]
+    assert not dirty_after
+    assert stats["flushes"] == 1 and stats["pending"] == 0
+
+
+def test_a_full_batch_flushes_without_waiting(path):
+    async def main():
+        s = SQLiteStore(path, flush_interval=30, batch=3)
+        s.open()
+        s.start()
+        for i in range(3):
+            s.save_message("+1555", message(f"SM{i}", minutes=i))
+        await asyncio.sleep(0.1)
+        flushed = sids(s)
+        await s.stop()
+        return flushed
+
+    assert asyncio.run(main()) == ["SM0", "SM1", "SM2"]
+
+
+def test_stop_flushes_what_is_pending(path):
+    async def main():
+        s = SQLiteStore(path, flush_interval=30, batch=1000)
+        s.open()
+        s.start()
+        s.save_message("+1555", message("SM1"))
+        s.save_contact("+1555", {k: f"{k} value" for k in CONTACT_FIELDS})
+        s.save_optout("+1666", True)
+        await s.stop()
+
+    asyncio.run(main())
+    reopened = SQLiteStore(path)
+    assert sids(reopened) == ["SM1"]
+    assert reopened.load_contact("+1555") is not None
+    assert reopened.load_optouts() == {"+1666"}
+
+
+def test_a_crash_loses_only_the_unflushed_window(path):
+    async def main():
+        s = SQLiteStore(path, flush_interval=30, batch=1000)
+        s.open()
+        s.start()
+        s.save_message("+1555", message("SM1"))
+        await s.flush()
+        s.save_message("+1555", message("SM2", minutes=1))
+        # the process dies here: no stop(), the flusher task just goes away with the loop
+
+    asyncio.run(main())
+    assert sids(SQLiteStore(path)) == ["SM1"]
+
+
+def test_a_failed_flush_is_rolled_back_and_retried(path, monkeypatch):
+    async def main():
+        s = SQLiteStore(path, flush_interval=30, batch=1000)
+        s.open()
+        s.start()
+        s.save_message("+1555", message("SM1"))
+        write_sqlite = analytics.write_sqlite
+        monkeypatch.setattr(analytics, "write_sqlite", lambda conn, rollups: 1 / 0)  # fails mid-transaction
+        await s.flush()
+        failed = sids(s), s.thread_dirty("+1555"), s.stats()
+        monkeypatch.setattr(analytics, "write_sqlite", write_sqlite)
+        await s.flush()
+        retried = sids(s), s.thread_dirty("+1555")
+        await s.stop()
+        return failed, retried
+
+    (failed_sids, dirty, stats), (retried_sids, dirty_after) = asyncio.run(main())
+    assert failed_sids == []  # the messages written before the failure were rolled back with it
+    assert dirty and stats["flush_errors"] == 1 and stats["pending"] == 1
+    assert retried_sids == ["SM1"] and not dirty_after
+
+
+def test_restore_keeps_rows_written_while_the_batch_was_out(path):
+    async def main():
+        s = SQLiteStore(path, flush_interval=30, batch=1000)
+        s.open()
+        s.start()
+        s.save_message("+1555", message("SM1", status="queued"))
+        s.save_message("+1555", message("SM2", minutes=1))
+        batch = s._swap()  # what a flush takes
+        s.save_message("+1555", message("SM1", status="delivered"))  # arrives mid-flush
+        s._restore(batch)  # and then the flush fails
+        await s.stop()
+
+    asyncio.run(main())
+    rows = SQLiteStore(path).load_thread("+1555")
+    assert [(r["sid"], r["status"]) for r in rows] == [("SM1", "delivered"), ("SM2", "received")]
+
+
+def test_saves_from_worker_threads_reach_the_flusher(path):
+    async def main():
+        s = SQLiteStore(path, flush_interval=0.05, batch=1000)
+        s.open()
+        s.start()
+        threads = [threading.Thread(target=s.save_message, args=("+1555", message(f"SM{i}", minutes=i)))
+                   for i in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        await asyncio.sleep(0.2)
+        flushed = sids(s), s.stats()["flushes"]
+        await s.stop()
+        return flushed
+
+    flushed, flushes = asyncio.run(main())
+    assert flushed == [f"SM{i}" for i in range(5)]
+    assert flushes >= 1
+
+
+def test_a_failed_flush_retries_without_another_write(path, monkeypatch):
+    async def main():
+        s = SQLiteStore(path, flush_interval=0.01, batch=1000)
+        s.open()
+        s.start()
+        write_sqlite, failures = analytics.write_sqlite, []
+
+        def flaky(conn, rollups):
+            if not failures:
+                failures.append(1)
+                raise OSError("disk I/O error")
+            write_sqlite(conn, rollups)
+
+        monkeypatch.setattr(analytics, "write_sqlite", flaky)
+        s.save_message("+1555", message("SM1"))  # the only write this server sees
+        await asyncio.sleep(1.0)  # first retry is due after 0.5s
+        flushed = sids(s), s.stats()
+        await s.stop()
+        return flushed
+
+    flushed, stats = asyncio.run(main())
+    assert flushed == ["SM1"]
+    assert stats["flush_errors"] == 1 and stats["pending"] == 0
+
+
+def test_reads_from_other_threads_use_their_own_connection(path):
+    s = SQLiteStore(path)
+    s.save_message("+1555", message("SM1"))  # no loop: written through
+    seen = []
+    t = threading.Thread(target=lambda: seen.append((sids(s), s._local.conn)))
+    t.start()
+    t.join()
+    assert seen[0][0] == ["SM1"] == sids(s)
+    assert seen[0][1] is not s._local.conn
+
+
+def test_reads_and_writes_are_timed(path):
+    import metrics
+
+    s = SQLiteStore(path)
+    s.save_message("+1555", message("SM1"))  # written through: one write transaction
+    sids(s)
+    text = metrics.REGISTRY.render()
+    assert 'store_query_duration_seconds_count{op="SELECT"}' in text
+    assert "store_write_duration_seconds_count" in text
@@ -0,0 +1,96 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from message_store import SQLiteStore
+
+T0 = datetime(2024, 5, 1, 9, 0)
+
+
+def message(sid, phone, body, minutes):
+    return SimpleNamespace(
+        sid=sid, direction="inbound", to="+15550000000", from_=phone, body=body, media_urls=[],
+        status="received", created_at=T0 + timedelta(minutes=minutes), ai_reply=None, category=None,
+        priority=None, action=None, confidence=None, entities=None, metadata={},
+    )
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = SQLiteStore(str(tmp_path / "store.db"))
+    bodies = ["the boiler is making a loud noise", "boiler pressure is low again",
+              "no hot water, boiler light is red", "boiler boiler boiler please help",
+              "the sink is leaking", "boiler room door is stuck"]
+    for i in range(30):  # many identical bodies: lots of equal bm25 scores to break ties on
+        s.save_message(f"+1555000{i % 3}", message(f"SM{i:03d}", f"+1555000{i % 3}", bodies[i % len(bodies)], i))
+    return s  # no event loop: every save was written through
+
+
+def pages(store, q, limit, sort, **filters):
+    out, before = [], None
+    while True:
+        hits, before = store.search(q, limit, sort, before=before, **filters)
+        out.append(hits)
+        if before is None:
+            return out
+
+
+@pytest.mark.parametrize("sort", ["rank", "recent"])
+@pytest.mark.parametrize("limit", [1, 4, 7, 25])
+def test_pages_cover_every_hit_once_in_order(store, sort, limit):
+    everything, _ = store.search("boiler", 100, sort)
+    paged = [h["sid"] for p in pages(store, "boiler", limit, sort) for h in p]
+    assert paged == [h["sid"] for h in everything]
+    assert len(paged) == len(set(paged)) == 25
+    if sort == "rank":
+        keys = [(h["score"], h["id"]) for h in everything]
+    else:
+        keys = [(-h["id"],) for h in everything]
+    assert keys == sorted(keys)
+
+
+def test_filtered_pages(store):
+    paged = [h for p in pages(store, "boiler", 3, "rank", phone="+15550001") for h in p]
+    assert {h["phone"] for h in paged} == {"+15550001"}
+    assert len(paged) == len({h["sid"] for h in paged}) == len(store.search("boiler", 100, phone="+15550001")[0])
+
+
+def test_recent_pages_do_not_shift_when_new_messages_arrive(store):
+    first, cursor = store.search("boiler", 5, "recent")
+    for i in range(30, 35):
+        store.save_message("+15550000", message(f"SM{i:03d}", "+15550000", "boiler is out", i))
+    rest, before = [], cursor
+    while before is not None:
+        hits, before = store.search("boiler", 5, "recent", before=before)
+        rest += hits
+    seen = [h["sid"] for h in first + rest]
+    assert len(seen) == len(set(seen)) == 25  # the newer messages sit above page one, not inside the walk
+    assert all(h["sid"] < "SM030" for h in rest)
+
+
+def test_rank_cursor_round_trips_through_the_api():
+    import httpx
+    import main
+
+    phone = "+15559990001"
+
+    async def scenario():
+        async with main.app.router.lifespan_context(main.app):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+                for i in range(7):
+                    await c.post("/twilio/incoming", json={"From": phone, "To": "+1", "Body": f"radiator cold {i % 2}"})
+                await main.store.flush()
+                seen, cursor = [], None
+                while True:
+                    params = {"q": "radiator", "phone": phone, "limit": 3, **({"before": cursor} if cursor else {})}
+                    page = (await c.get("/search", params=params)).json()
+                    seen += [h["sid"] for h in page["items"]]
+                    cursor = page["next_cursor"]
+                    if not cursor:
+                        return seen
+
+    seen = asyncio.run(scenario())
+    assert len(seen) == len(set(seen)) == 7
@@ -0,0 +1,108 @@
+import asyncio, json
+
+import httpx
+
+import main
+
+
+def run(scenario):
+    async def go():
+        async with main.app.router.lifespan_context(main.app):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+                return await scenario(c)
+    return asyncio.run(go())
+
+
+async def inbound(c, phone, body):
+    r = await c.post("/twilio/incoming", json={"From": phone, "To": "+15550000000", "Body": body})
+    assert r.status_code == 200
+
+
+async def import_rows(c, rows):
+    body = "".join(json.dumps(row) + "\n" for row in rows)
+    r = await c.post("/import/messages", content=body)
+    assert r.status_code == 200 and r.json()["imported"] == len(rows)
+
+
+def bodies(page):
+    return [m["body"] for m in page["items"]]
+
+
+def test_thread_cursor_survives_an_import_of_older_messages():
+    phone = "+15551230001"
+
+    async def scenario(c):
+        for i in range(5):
+            await inbound(c, phone, f"live {i}")
+        first = (await c.get(f"/threads/{phone}", params={"limit": 2})).json()
+        # backfilled history lands in front of everything the client has paged through
+        await import_rows(c, [{"phone": phone, "direction": "inbound", "body": f"old {i}",
+                               "created_at": f"2020-01-0{i + 1}T00:00:00Z"} for i in range(3)])
+        second = (await c.get(f"/threads/{phone}", params={"limit": 2, "before": first["next_cursor"]})).json()
+        newer = (await c.get(f"/threads/{phone}", params={"limit": 2, "after": second["prev_cursor"]})).json()
+        rest, cursor = [], second["next_cursor"]
+        while cursor:
+            page = (await c.get(f"/threads/{phone}", params={"limit": 2, "before": cursor})).json()
+            rest += bodies(page)
+            cursor = page["next_cursor"]
+        return first, second, newer, rest
+
+    first, second, newer, rest = run(scenario)
+    assert bodies(first) == ["live 4", "live 3"]
+    assert bodies(second) == ["live 2", "live 1"]
+    assert bodies(newer) == ["live 4", "live 3"]
+    assert rest == ["live 0", "old 2", "old 1", "old 0"]
+
+
+def test_thread_rejects_a_positional_cursor():
+    async def scenario(c):
+        cursor = main.encode_cursor(main.datetime(2024, 1, 1), 3)
+        return await c.get("/threads/+15551230002", params={"before": cursor})
+
+    assert run(scenario).status_code == 400
+
+
+def test_thread_list_after_cursor_reports_older_pages():
+    phones = [f"+1555123010{i}" for i in range(3)]
+
+    async def scenario(c):
+        for phone in phones:
+            await inbound(c, phone, "hello")
+            await asyncio.sleep(0.002)  # distinct last_at
+        first = (await c.get("/threads", params={"limit": 2})).json()
+        back = (await c.get("/threads", params={"limit": 1, "after": first["next_cursor"]})).json()
+        newest = (await c.get("/threads", params={"limit": 1, "after": first["prev_cursor"]})).json()
+        oldest_cursor = main.encode_cursor(main.datetime(2000, 1, 1), "")
+        everything = (await c.get("/threads", params={"limit": 200, "after": oldest_cursor})).json()
+        return first, back, newest, everything
+
+    first, back, newest, everything = run(scenario)
+    assert [t["participant"] for t in first["items"]] == phones[::-1][:2]
+    assert [t["participant"] for t in back["items"]] == [phones[2]]
+    assert back["next_cursor"] is not None  # phones[1] and older are still there
+    assert newest["items"] == [] and newest["next_cursor"] is None
+    assert everything["items"] and everything["next_cursor"] is None  # the page reaches the oldest thread
+
+
+def test_thread_list_rejects_bad_cursors():
+    recent = main.encode_cursor(main.datetime(2024, 1, 1), "t1")
+    bad = [
+        "not-a-cursor",
+        main.encode_cursor("2024-01-01T00:00:00+02:00", "t1"),  # timezone-aware
+        main.encode_cursor(main.datetime(2024, 1, 1), 7),      # id of the wrong type
+        main.encode_cursor(12, "t1"),                           # a sort=count cursor
+    ]
+
+    async def scenario(c):
+        statuses = []
+        for cursor in bad:
+            for param in ("before", "after"):
+                statuses.append((await c.get("/threads", params={param: cursor})).status_code)
+        statuses.append((await c.get("/threads", params={"sort": "count", "after": recent})).status_code)
+        ok = (await c.get("/threads", params={"sort": "count", "before": main.encode_cursor(12, "t1")})).status_code
+        return statuses, ok
+
+    statuses, ok = run(scenario)
+    assert statuses == [400] * len(statuses)
+    assert ok == 200
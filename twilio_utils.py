@@ -1,13 +1,17 @@
 # twilio_utils.py
 import os
-from twilio.rest import Client
+from functools import lru_cache
 
 ACC = os.getenv("TWILIO_ACCOUNT_SID")
 TOK = os.getenv("TWILIO_AUTH_TOKEN")
 FROM = os.getenv("TWILIO_FROM_NUMBER")
 
-client = Client(ACC, TOK)
+@lru_cache(maxsize=1)
+def get_client():
+    # built on first send: importing twilio (and its HTTP session) is not free, and most processes never text
+    from twilio.rest import Client
+    return Client(ACC, TOK)
 
 def send_sms(to: str, body: str) -> str:
-    msg = client.messages.create(body=body, from_=FROM, to=to)
+    msg = get_client().messages.create(body=body, from_=FROM, to=to)
     return msg.sid